@@ -1,13 +1,32 @@
 """Project main script"""
 import argparse
+import sys
+from pathlib import Path
 
-from fcn.processing import transcribe_file
+from fcn.batch import transcribe
+from fcn.profiling import StageProfiler
 
 parser = argparse.ArgumentParser()
-parser.add_argument('input', metavar='INPUT', type=str, help='Input file with written czech text')
+parser.add_argument('input', metavar='INPUT', type=str,
+                    help='Input file with written czech text, directory or glob pattern of such files')
 parser.add_argument('output', metavar='OUTPUT', nargs='?', type=str, const=None,
-                    help='Output file to save phonetic transcription')
+                    help='Output file to save phonetic transcription (output directory in batch mode)')
+parser.add_argument('--manifest', action='store_true', help='Treat INPUT as a file listing the input files, one per line')
+parser.add_argument('--jobs', metavar='N', type=int, default=None,
+                    help='Number of worker processes for batch mode or for parallel transcription of a single file')
+parser.add_argument('--chunk-size', metavar='CHARS', type=int, default=None,
+                    help='Transcribe the input in streaming mode, reading the given number of characters at once')
+parser.add_argument('--cache-size', metavar='UNITS', type=int, default=None,
+                    help='Cache transcriptions of up to the given number of distinct word units')
+parser.add_argument('--profile', action='store_true',
+                    help='Print the time, lengths and rule hits of each stage as a JSON line to stderr')
 
 if __name__ == '__main__':
     args = parser.parse_args()
-    transcribe_file(args.input, args.output)
+    # The stages of the worker processes are not collected
+    if args.profile and (args.jobs is not None or args.manifest or not Path(args.input).is_file()):
+        parser.error('--profile is supported only for a single input file without --jobs')
+    profiler = StageProfiler() if args.profile else None
+    transcribe(args.input, args.output, args.manifest, args.jobs, args.chunk_size, args.cache_size, profiler)
+    if profiler is not None:
+        print(profiler.to_log_line(), file=sys.stderr)
@@ -0,0 +1,109 @@
+"""Parallel batch transcription"""
+import glob
+import os
+from collections import deque
+from multiprocessing import Pool
+from pathlib import Path
+
+from .processing import create_cache, get_output_path, grind_stream, read_parts, split_blocks, transcribe_file, \
+    translate_block
+
+# Number of characters of a large file sent to a worker at once
+PARALLEL_CHUNK_SIZE = 1 << 20
+
+# Translation cache of the worker process
+worker_cache = None
+
+
+def init_worker(cache_size):
+    """Creates the translation cache of the worker process, if its size is given."""
+    global worker_cache
+    worker_cache = None if cache_size is None else create_cache(cache_size)
+
+
+def get_input_paths(source, manifest=False):
+    """Returns the sorted list of input files given by a file, directory or glob pattern.
+
+    If ´manifest´ is set, the source is a text file listing the input files, one per line, relative to the manifest."""
+    source_path = Path(source)
+    if manifest:
+        with open(source_path, 'r', encoding='utf-8') as fr:
+            lines = [line.strip() for line in fr]
+        return [source_path.parent / line for line in lines if line]
+    if source_path.is_dir():
+        return sorted(path for path in source_path.iterdir() if path.is_file())
+    if glob.has_magic(source):
+        return sorted(Path(path) for path in glob.glob(source) if Path(path).is_file())
+
+    return [source_path]
+
+
+def transcribe_file_pair(pair):
+    """Transcribes the (input path, output path, chunk size) triple and returns the output path."""
+    input_path, output_path, chunk_size = pair
+    transcribe_file(input_path, output_path, chunk_size, worker_cache)
+
+    return output_path
+
+
+def translate_block_pair(pair):
+    """Returns the transcription of the (block, preceding boundary) pair."""
+    return translate_block(*pair, worker_cache)
+
+
+def transcribe_files(input_paths, output_dir=None, jobs=None, cache_size=None, chunk_size=None):
+    """Transcribes all the input files by a pool of ´jobs´ processes and yields the output paths in the input order.
+
+    The output files are named as by ´transcribe_file´, optionally placed into the ´output_dir´ directory. If
+    ´cache_size´ is given, each worker keeps its translation cache of that size. If ´chunk_size´ is given, each file
+    is streamed in parts of that many characters."""
+    pairs = [(Path(path), get_output_path(Path(path), output_dir=output_dir), chunk_size) for path in input_paths]
+    with Pool(jobs, init_worker, (cache_size,)) as pool:
+        yield from pool.imap(transcribe_file_pair, pairs)
+
+
+def imap_bounded(pool, func, items, window):
+    """Yields the results of ´func´ applied to the items by the pool in order, with at most ´window´ items queued."""
+    queue = deque()
+    for item in items:
+        queue.append(pool.apply_async(func, (item,)))
+        if len(queue) >= window:
+            yield queue.popleft().get()
+    while queue:
+        yield queue.popleft().get()
+
+
+def transcribe_file_parallel(input_path, output_path, jobs=None, chunk_size=None, cache_size=None):
+    """Creates file with the translation of the content of the input file, transcribing its sentence aligned blocks
+    by a pool of ´jobs´ processes."""
+    input_path = Path(input_path)
+    output_path = get_output_path(input_path, output_path)
+    jobs = jobs or os.cpu_count()
+
+    blocks = split_blocks(read_parts(input_path, chunk_size or PARALLEL_CHUNK_SIZE))
+    with Pool(jobs, init_worker, (cache_size,)) as pool, open(output_path, 'w', encoding='utf-8') as f:
+        # Only few blocks per worker are read ahead, so the memory stays bounded
+        for txt in grind_stream(imap_bounded(pool, translate_block_pair, blocks, 2 * jobs)):
+            f.write(txt)
+
+
+def transcribe(source, output=None, manifest=False, jobs=None, chunk_size=None, cache_size=None, profiler=None):
+    """Transcribes a single file (in parallel blocks if ´jobs´ is given) or a batch of files given by a directory,
+    glob pattern or manifest. In the batch mode the ´output´ is the output directory. The ´profiler´ records the
+    stages of a single file transcribed by the main process, it is not supported by the worker processes."""
+    single_file = not manifest and Path(source).is_file()
+    if profiler is not None and (jobs is not None or not single_file):
+        raise ValueError('Profiling is supported only for a single file without worker processes')
+    if single_file:
+        if jobs is None:
+            cache = None if cache_size is None else create_cache(cache_size)
+            transcribe_file(source, output, chunk_size, cache, profiler)
+        else:
+            transcribe_file_parallel(source, output, jobs, chunk_size, cache_size)
+        return
+
+    input_paths = get_input_paths(source, manifest)
+    if output is not None and not Path(output).exists():
+        Path(output).mkdir(parents=True)
+    for _ in transcribe_files(input_paths, output, jobs, cache_size, chunk_size):
+        pass
@@ -0,0 +1,179 @@
+"""Rule compiler"""
+import re
+
+
+def has_overlap(first, second):
+    """Returns True if a proper suffix of the ´first´ string is a proper prefix of the ´second´ string."""
+    for i in range(1, len(first)):
+        suffix = first[i:]
+        if len(suffix) < len(second) and second.startswith(suffix):
+            return True
+
+    return False
+
+
+def is_value_group(items):
+    """Checks whether the rules can be applied at once as a single alternation with one common replacement."""
+    value = items[0][1]
+    keys = [key for key, _ in items]
+    if any(val != value for _, val in items) or any(not key for key in keys):
+        return False
+    # Single character replacements are cheaper as plain string replacements than any regex scan
+    if all(len(key) == 1 for key in keys):
+        return False
+    # The replacement must not take part in any later match
+    if any(char in key for key in keys for char in value):
+        return False
+    for i, first in enumerate(keys):
+        for j, second in enumerate(keys):
+            if i == j:
+                continue
+            # Partially overlapping keys would be matched differently by a single scan
+            if has_overlap(first, second):
+                return False
+            # The key containing another key must come first to win both sequentially and in the alternation
+            if second in first and j < i:
+                return False
+
+    return True
+
+
+def split_insertion(key, value):
+    """Returns the (prefix, inserted text) pair if the rule only inserts text in front of the last key character."""
+    prefix, suffix = key[:-1], key[-1:]
+    if not prefix or len(value) <= len(key) or not value.startswith(prefix) or not value.endswith(suffix):
+        return None
+
+    return prefix, value[len(prefix):-1]
+
+
+def is_insertion_group(items):
+    """Checks whether the rules only insert the same text after the same prefix in front of different characters."""
+    splits = [split_insertion(key, value) for key, value in items]
+    if None in splits or len(set(splits)) != 1:
+        return False
+    prefix, inserted = splits[0]
+    suffixes = [key[-1] for key, _ in items]
+    if len(set(suffixes)) != len(suffixes):
+        return False
+    # Inserted text must not create or hide any match, the prefix must not overlap itself
+    if any(char in prefix + ''.join(suffixes) for char in inserted):
+        return False
+    if any(char in prefix for char in suffixes) or has_overlap(prefix, prefix):
+        return False
+
+    return True
+
+
+def get_group_end(items, start, is_group):
+    """Returns the end index of the longest group of rules starting at ´start´ which satisfies ´is_group´."""
+    end = start + 1
+    while end < len(items) and is_group(items[start:end + 1]):
+        end += 1
+
+    return end
+
+
+def compile_group(items):
+    """Returns the (search, replacement, rule keys) pass equivalent to the sequential application of the given
+    rules."""
+    keys = tuple(key for key, _ in items)
+    if len(items) == 1:
+        return items[0][0], items[0][1], keys
+    if is_insertion_group(items):
+        prefix, inserted = split_insertion(*items[0])
+        suffixes = ''.join(re.escape(key[-1]) for key in keys)
+        regex = re.compile(re.escape(prefix) + '(?=[' + suffixes + '])')
+        return regex, (prefix + inserted).replace('\\', '\\\\'), keys
+
+    regex = re.compile('|'.join(re.escape(key) for key in keys))
+    return regex, items[0][1].replace('\\', '\\\\'), keys
+
+
+def compile_rules(rules):
+    """Compiles the ordered dictionary of replacements into the shortest found list of equivalent passes.
+
+    Consecutive rules are fused into one precompiled regex whenever their sequential application is equal
+    to the single simultaneous scan. The rest stays as plain string replacements."""
+    items = list(rules.items())
+    passes = []
+    start = 0
+    while start < len(items):
+        end = max(get_group_end(items, start, is_value_group), get_group_end(items, start, is_insertion_group))
+        passes.append(compile_group(items[start:end]))
+        start = end
+
+    return passes
+
+
+def count_pass_hits(txt, search, keys, hits):
+    """Adds the number of matches of each rule of the pass in the text to the ´hits´ dictionary."""
+    if isinstance(search, str):
+        hits[search] = hits.get(search, 0) + txt.count(search)
+        return
+    for key in keys:
+        hits.setdefault(key, 0)
+    for match in search.finditer(txt):
+        # The first rule of the pass found at the match position is the one which would replace it
+        key = next(key for key in keys if txt.startswith(key, match.start()))
+        hits[key] += 1
+
+
+def apply_passes(txt, passes, hits=None):
+    """Applies the compiled passes to the text. If the ´hits´ dictionary is given, the number of matches of each
+    rule is added to it."""
+    for search, replacement, keys in passes:
+        if hits is not None:
+            count_pass_hits(txt, search, keys, hits)
+        if isinstance(search, str):
+            txt = txt.replace(search, replacement)
+        else:
+            txt = search.sub(replacement, txt)
+
+    return txt
+
+
+def compile_regex_rules(rules, pivot_rules):
+    """Compiles the regex rules into their faster pivot forms.
+
+    The pivot form finds every occurrence, while the original rule skips the matches overlapping the previous
+    one. The conflict regex finds such overlaps, so that they are resolved only when they really occur."""
+    passes = []
+    for regex in rules:
+        pivot_regex, replacement, left_len, right_len = pivot_rules[regex]
+        width = left_len + right_len
+        conflict_regex = pivot_regex + '(?=(?s:.{0,' + str(width - 1) + '})' + pivot_regex + ')'
+        passes.append((re.compile(pivot_regex), replacement, width, re.compile(conflict_regex), regex))
+
+    return passes
+
+
+def substitute_non_overlapping(txt, pivot_regex, replacement, width):
+    """Replaces the pivot matches which do not overlap the previous replaced one, as the original rule would.
+    Returns the new text and the number of replacements."""
+    parts = []
+    last_end = 0
+    last_start = None
+    for match in pivot_regex.finditer(txt):
+        if last_start is not None and match.start() - last_start <= width:
+            continue
+        parts.append(txt[last_end:match.start()])
+        parts.append(replacement)
+        last_start, last_end = match.start(), match.end()
+    parts.append(txt[last_end:])
+
+    return "".join(parts), len(parts) // 2
+
+
+def apply_regex_passes(txt, passes, hits=None):
+    """Applies the compiled regex passes to the text. If the ´hits´ dictionary is given, the number of replacements
+    of each original rule is added to it."""
+    for pivot_regex, replacement, width, conflict_regex, regex in passes:
+        if conflict_regex.search(txt):
+            txt, count = substitute_non_overlapping(txt, pivot_regex, replacement, width)
+        else:
+            txt, count = pivot_regex.subn(replacement.replace('\\', '\\\\'), txt)
+        if hits is not None:
+            hits[regex] = hits.get(regex, 0) + count
+
+    return txt
@@ -17,6 +17,17 @@ PAIR_CONSONANTS = UNVOICED_CONSONANTS + VOICED_P_CONSONANTS
 # Regexes
 CHAIN_REGIONS_REGEX = '([' + PAIR_CONSONANTS + ']+' + '[\\|]?' + '[' + PAIR_CONSONANTS + ']+)'
 
+# Sentence boundaries where the text can be cut into independently transcribed blocks (the space after the period or
+# semicolon belongs to the boundary, because it is consumed by the same rule)
+SENTENCE_BOUNDARIES = ['\n', '. ', '; ']
+
+# Word final characters after which no rule spans the following space, so the text can be cut into independently
+# transcribed (and cached) units there
+UNIT_FINAL_CHARS = "aeiouyáéíóúůýě"
+UNIT_SPLIT_REGEX = ' (?<=[' + UNIT_FINAL_CHARS + '] )'
+UNIT_FALLBACK_SPLIT_REGEX = '(?<=[' + UNIT_FINAL_CHARS + '])(?= )|(?=\n)'
+UNIT_SEPARATOR = '\x00'
+
 # Maps / Dictionaries
 VOICED_TO_UNVOICED = {
     'b': 'p',
@@ -44,3 +55,7 @@ UNVOICED_TO_VOICED = {
     'C': 'W',
     'Q': 'Q',  # TODO-refactoring: remove this hack
 }
+
+# Translation tables
+VOICING_TABLE = str.maketrans(UNVOICED_TO_VOICED)
+DEVOICING_TABLE = str.maketrans(VOICED_TO_UNVOICED)
@@ -1,9 +1,22 @@
 """Core source code of the algorithm"""
 import re
+import time
+from functools import lru_cache
 from pathlib import Path
 
+from .compiler import apply_passes, apply_regex_passes, compile_regex_rules, compile_rules
+from .profiling import profile_stage
 from .rules import *
 
+# Rules compiled into fewer equivalent passes
+SIMPLE_PASSES = compile_rules(SIMPLE_RULES)
+REGEX_PASSES = compile_regex_rules(REGEX_RULES, PIVOT_REGEX_RULES)
+CHAIN_REGEX = re.compile(CHAIN_REGIONS_REGEX)
+UNIT_SPLITTER = re.compile(UNIT_SPLIT_REGEX)
+UNIT_FALLBACK_SPLITTER = re.compile(UNIT_FALLBACK_SPLIT_REGEX)
+# Default number of units kept by the translation cache
+CACHE_SIZE = 1 << 16
+
 
 def load_text(file_path):
     """Loads and returns the content of specified text file."""
@@ -13,50 +26,37 @@ def load_text(file_path):
     return txt
 
 
-def simple_replacement(txt):
-    """Performs all replacements defined in ´SIMPLE_RULES´ dictionary."""
-    for character in SIMPLE_RULES:
-        txt = txt.replace(character, SIMPLE_RULES[character])
+def simple_replacement(txt, hits=None):
+    """Performs all replacements defined in ´SIMPLE_RULES´ dictionary. If the ´hits´ dictionary is given, the number
+    of matches of each rule is added to it."""
+    return apply_passes(txt, SIMPLE_PASSES, hits)
 
-    return txt
 
+def regex_replacement(txt, hits=None):
+    """Performs all replacements defined in ´REGEX_RULES´ dictionary. If the ´hits´ dictionary is given, the number
+    of replacements of each rule is added to it."""
+    return apply_regex_passes(txt, REGEX_PASSES, hits)
 
-def regex_replacement(txt):
-    """Performs all replacements defined in ´REGEX_RULES´ dictionary."""
-    for regex in REGEX_RULES:
-        txt = re.sub(regex, REGEX_RULES[regex], txt)
 
-    return txt
+@lru_cache(maxsize=4096)
+def voice_chain(chain):
+    """Returns the pair consonants chain assimilated to the voicing of its last (dominant) character."""
+    dominant_char = chain[-1]
+    if dominant_char in RECESSIVE_CHARS:
+        return chain
+    elif dominant_char in VOICED_CHARS:
+        return chain.translate(VOICING_TABLE)
+
+    return chain.translate(DEVOICING_TABLE)
 
 
 def chain_replacement(txt):
     """Finds all the occurrences of pair consonants chains and applies relevant replacements."""
+    # Split the text so that the chains are on the odd positions
+    parts = CHAIN_REGEX.split(txt)
+    parts[1::2] = map(voice_chain, parts[1::2])
 
-    # Create list-type copy of original text for swift character replacements
-    list_txt = list(txt)
-
-    # Find all wanted chains
-    matches = re.finditer(CHAIN_REGIONS_REGEX, txt)
-    matches_positions = [(match.start(), match.end()) for match in matches]
-
-    # Process each chain
-    for match in matches_positions:
-        chain = txt[match[0]:match[1]]
-        dominant_char = chain[-1]
-
-        if dominant_char in RECESSIVE_CHARS:
-            continue
-        elif dominant_char in VOICED_CHARS:
-            for i in range(match[0], match[1]):
-                if txt[i] in PAIR_CONSONANTS and txt[i] in UNVOICED_CONSONANTS:
-                    list_txt[i] = UNVOICED_TO_VOICED[txt[i]]
-
-        elif dominant_char in UNVOICED_CHARS:
-            for i in range(match[0], match[1]):
-                if txt[i] in PAIR_CONSONANTS and txt[i] in VOICED_P_CONSONANTS:
-                    list_txt[i] = VOICED_TO_UNVOICED[txt[i]]
-
-    return "".join(list_txt)
+    return "".join(parts)
 
 
 def grind(txt):
@@ -65,28 +65,162 @@ def grind(txt):
     return txt
 
 
-def translate(txt):
-    """Takes a plain czech text as an input and returns its phonetic transcription."""
-    txt = txt.lower()
+def replace_all(txt):
+    """Performs all the replacement stages on the lowercase text."""
     txt = simple_replacement(txt)
     txt = regex_replacement(txt)
     txt = chain_replacement(txt)
+    return txt
+
+
+def replace_all_profiled(txt, profiler):
+    """Performs all the replacement stages on the lowercase text and records them by the profiler."""
+    txt = profile_stage(profiler, 'simple_replacement', simple_replacement, txt, counts_hits=True)
+    txt = profile_stage(profiler, 'regex_replacement', regex_replacement, txt, counts_hits=True)
+    txt = profile_stage(profiler, 'chain_replacement', chain_replacement, txt)
+    return txt
+
+
+def create_cache(maxsize=CACHE_SIZE):
+    """Returns the LRU cache of unit transcriptions for ´translate´. Its hit and miss counters are available
+    through ´cache_info()´."""
+    return lru_cache(maxsize=maxsize)(replace_all)
+
+
+def split_units(txt):
+    """Splits the lowercase text into units whose transcriptions do not depend on each other.
+
+    The text is cut in front of newlines and in front of spaces following a vowel, as no rule spans such place.
+    Each unit keeps its leading space or newline, so it carries the context of the cross-word rules."""
+    if UNIT_SEPARATOR in txt:
+        return UNIT_FALLBACK_SPLITTER.split(txt)
+    txt = UNIT_SPLITTER.sub(UNIT_SEPARATOR + ' ', txt)
+    return txt.replace('\n', UNIT_SEPARATOR + '\n').split(UNIT_SEPARATOR)
+
+
+def apply_rules(txt, cache=None, profiler=None):
+    """Applies all the transcription rules to the text, without the final modifications.
+
+    If the ´cache´ from ´create_cache´ is given, each distinct unit of the text is transcribed only once. If the
+    ´profiler´ is given, the stages are recorded by it and the whole text goes through them, bypassing the cache."""
+    if profiler is not None:
+        txt = profile_stage(profiler, 'lower', str.lower, txt)
+        return replace_all_profiled(txt, profiler)
+    txt = txt.lower()
+    if cache is None:
+        return replace_all(txt)
+
+    return "".join(map(cache, split_units(txt)))
+
+
+def translate(txt, cache=None, profiler=None):
+    """Takes a plain czech text as an input and returns its phonetic transcription.
+
+    The optional ´profiler´ (see ´StageProfiler´) records the time, lengths and rule hits of each stage."""
+    txt = apply_rules(txt, cache, profiler)
+    if profiler is not None:
+        return profile_stage(profiler, 'grind', grind, txt)
     txt = grind(txt)
     return txt
 
 
-def transcribe_file(input_path, output_path):
-    """Creates file with the translation of the content of the input file."""
+def find_block_end(txt):
+    """Returns the position right after the last sentence boundary in the text and the boundary itself."""
+    end, boundary = 0, ""
+    for sentence_boundary in SENTENCE_BOUNDARIES:
+        i = txt.rfind(sentence_boundary)
+        if i >= 0 and i + len(sentence_boundary) > end:
+            end, boundary = i + len(sentence_boundary), sentence_boundary
+
+    return end, boundary
+
+
+def translate_block(block, context, cache=None, profiler=None):
+    """Returns the transcription of the text block which follows the given sentence boundary.
+
+    The boundary is transcribed together with the block, so the rules spanning it match as in the whole text. Only
+    the transcription of the whole is recorded by the ´profiler´, the boundary alone just gives its length."""
+    return apply_rules(context + block, cache, profiler)[len(apply_rules(context)):]
+
+
+def split_blocks(parts):
+    """Takes a text as an iterable of consecutive parts and yields its blocks cut at the last sentence boundary of
+    each part, as (block, preceding boundary) pairs."""
+    buffer = ""
+    context = ""
+    for part in parts:
+        buffer += part
+        end, boundary = find_block_end(buffer)
+        if end == 0:
+            continue
+        yield buffer[:end], context
+        buffer = buffer[end:]
+        context = boundary
+
+    yield buffer, context
+
+
+def grind_stream(parts, profiler=None):
+    """Performs the final modifications of ´grind´ on the transcription given by consecutive parts.
+
+    The optional ´profiler´ records each part as a run of the grind stage."""
+    # The output is delayed by the characters which are cut off at the end
+    pending = ""
+    yield "|$|"
+    for part in parts:
+        start = time.perf_counter()
+        pending += part
+        txt, pending = pending[:-3], pending[-3:]
+        if profiler is not None:
+            profiler.record('grind', time.perf_counter() - start, len(part), len(txt))
+        yield txt
+
+
+def translate_stream(parts, cache=None, profiler=None):
+    """Takes a plain czech text as an iterable of consecutive parts and yields its phonetic transcription in parts.
+
+    The result is the same as the one of ´translate´ for the whole text, while only the last unfinished sentence
+    is kept in memory."""
+    blocks = (translate_block(block, context, cache, profiler) for block, context in split_blocks(parts))
+    return grind_stream(blocks, profiler)
+
+
+def read_parts(file_path, chunk_size):
+    """Yields the content of the specified text file in parts of the given number of characters."""
+    with open(file_path, "r", encoding='utf-8') as f:
+        for part in iter(lambda: f.read(chunk_size), ""):
+            yield part
+
+
+def get_output_path(input_path, output_path=None, output_dir=None):
+    """Returns the output path, which is build based on the input path if it is not specified."""
+    if output_path is not None:
+        return Path(output_path)
+    file_name = input_path.name.replace("ortho", "phntrn")
+    if output_dir is not None:
+        return Path(output_dir) / file_name
+
+    return input_path.parent.parent / "output" / file_name
+
+
+def transcribe_file(input_path, output_path, chunk_size=None, cache=None, profiler=None):
+    """Creates file with the translation of the content of the input file.
+
+    If ´chunk_size´ is given, the file is read and transcribed in streaming mode by the given number of characters.
+    The optional ´cache´ from ´create_cache´ and ´profiler´ can be shared by several calls."""
     input_path = Path(input_path)
+    output_path = get_output_path(input_path, output_path)
 
-    txt = load_text(input_path)
-    txt = translate(txt)
+    if chunk_size is None:
+        txt = load_text(input_path)
+        txt = translate(txt, cache, profiler)
 
-    # If output path is not specified, it is build based on the input path
-    if output_path is None:
-        file_name = input_path.name.replace("ortho", "phntrn")
-        output_path = input_path.parent.parent / "output" / file_name
+        # Save the output file
+        with open(output_path, 'w', encoding='utf-8') as f:
+            f.write(txt)
+        return
 
-    # Save the output file
+    # Save the output file part by part
     with open(output_path, 'w', encoding='utf-8') as f:
-        f.write(txt)
+        for txt in translate_stream(read_parts(input_path, chunk_size), cache, profiler):
+            f.write(txt)
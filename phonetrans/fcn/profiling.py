@@ -0,0 +1,60 @@
+"""Transcription pipeline instrumentation"""
+import json
+import time
+
+
+class StageProfiler:
+    """Collects the wall time, the input and output lengths and the rule hits of each transcription stage.
+
+    Each record is also passed to the optional ´callback´ as a dictionary."""
+
+    def __init__(self, callback=None, count_hits=True):
+        self.callback = callback
+        self.count_hits = count_hits
+        self.records = []
+
+    def record(self, stage, seconds, input_len, output_len, hits=None):
+        """Stores the record of a single stage run."""
+        record = {'stage': stage, 'seconds': seconds, 'input_len': input_len, 'output_len': output_len}
+        if hits is not None:
+            record['hits'] = hits
+        self.records.append(record)
+        if self.callback is not None:
+            self.callback(record)
+
+    def as_dict(self):
+        """Returns the records summed up by the stage names."""
+        summary = dict()
+        for record in self.records:
+            stage = summary.setdefault(record['stage'], {'calls': 0, 'seconds': 0.0, 'input_len': 0,
+                                                         'output_len': 0})
+            stage['calls'] += 1
+            stage['seconds'] += record['seconds']
+            stage['input_len'] += record['input_len']
+            stage['output_len'] += record['output_len']
+            if 'hits' in record:
+                stage_hits = stage.setdefault('hits', dict())
+                for rule, count in record['hits'].items():
+                    stage_hits[rule] = stage_hits.get(rule, 0) + count
+
+        return summary
+
+    def to_log_line(self):
+        """Returns the summary as a single JSON line."""
+        return json.dumps(self.as_dict(), ensure_ascii=False)
+
+
+def profile_stage(profiler, stage, stage_func, txt, counts_hits=False):
+    """Runs the pipeline stage and records it by the profiler.
+
+    The rule hits are counted by a second, untimed run, so they do not distort the measured time."""
+    start = time.perf_counter()
+    result = stage_func(txt)
+    seconds = time.perf_counter() - start
+    hits = None
+    if counts_hits and profiler.count_hits:
+        hits = dict()
+        stage_func(txt, hits)
+    profiler.record(stage, seconds, len(txt), len(result), hits)
+
+    return result
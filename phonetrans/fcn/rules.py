@@ -84,3 +84,19 @@ REGEX_RULES = {
     '([' + CONSONANTS + '][' + VOWELS + '])' + 'd' + '(\\|)': '\\1t\\2',
     '([' + CONSONANTS + ']\\|)' + 'z': '\\1s',
 }
+
+# Equivalent forms of ´REGEX_RULES´ which match just the replaced character and check its surroundings by lookarounds,
+# which is much faster to scan for. Items are (regex, replacement, left context length, right context length).
+PIVOT_REGEX_RULES = {
+    '([' + UNVOICED_CHARS + '])' + 'R': ('R(?<=[' + UNVOICED_CHARS + ']R)', 'Q', 1, 0),
+    '([' + UNVOICED_CHARS + '])' + 'm' + '([\\|' + UNVOICED_CHARS + '])':
+        ('m(?<=[' + UNVOICED_CHARS + ']m)(?=[\\|' + UNVOICED_CHARS + '])', 'H', 1, 1),
+    '([' + UNVOICED_CHARS + '])' + 'l' + '([\\|' + UNVOICED_CHARS + '])':
+        ('l(?<=[' + UNVOICED_CHARS + ']l)(?=[\\|' + UNVOICED_CHARS + '])', 'L', 1, 1),
+    '([' + CONSONANTS + '])' + 'r' + '([\\|' + CONSONANTS + '])':
+        ('r(?<=[' + CONSONANTS + ']r)(?=[\\|' + CONSONANTS + '])', 'P', 1, 1),
+    '([' + UNVOICED_CHARS + '])' + 'm' + '([\\|' + '])': ('m(?<=[' + UNVOICED_CHARS + ']m)(?=[\\|])', 'H', 1, 1),
+    '([' + CONSONANTS + '][' + VOWELS + '])' + 'd' + '(\\|)':
+        ('d(?<=[' + CONSONANTS + '][' + VOWELS + ']d)(?=\\|)', 't', 2, 1),
+    '([' + CONSONANTS + ']\\|)' + 'z': ('z(?<=[' + CONSONANTS + ']\\|z)', 's', 2, 0),
+}
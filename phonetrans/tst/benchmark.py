@@ -0,0 +1,166 @@
+"""Transcription benchmark"""
+import argparse
+import json
+import statistics
+import time
+import tracemalloc
+from pathlib import Path
+
+from phonetrans.fcn.processing import chain_replacement, grind, load_text, regex_replacement, simple_replacement, \
+    translate
+
+DATA_DIR = Path(__file__).parent.parent / "data"
+BENCH_FILE = DATA_DIR / "test" / "blabot.txt"
+HISTORY_PATH = Path(__file__).parent / "benchmark_history.json"
+# Input sizes relative to the benchmark file, used to check how the throughput scales
+SCALES = [0.25, 0.5, 1, 2, 4]
+REPS = 5
+# Allowed relative drop of the throughput against the recent runs
+REGRESSION_THRESHOLD = 0.2
+# Number of recent runs the result is compared with
+HISTORY_WINDOW = 5
+# Pipeline stages in the order of ´translate´
+STAGES = [
+    ('lower', str.lower),
+    ('simple_replacement', simple_replacement),
+    ('regex_replacement', regex_replacement),
+    ('chain_replacement', chain_replacement),
+    ('grind', grind),
+]
+
+parser = argparse.ArgumentParser()
+parser.add_argument('input', metavar='INPUT', type=str, nargs='?', default=str(BENCH_FILE),
+                    help='Input file with written czech text')
+parser.add_argument('--history', metavar='HISTORY', type=str, default=str(HISTORY_PATH),
+                    help='JSON file with the results of the previous runs')
+parser.add_argument('--threshold', type=float, default=REGRESSION_THRESHOLD,
+                    help='Allowed relative drop of the throughput')
+parser.add_argument('--reps', type=int, default=REPS, help='Number of repetitions of each measurement')
+parser.add_argument('--no-save', action='store_true', help='Do not append the result to the history')
+
+
+def get_scaled_text(txt, scale):
+    """Returns the text repeated or cut to the given multiple of its length."""
+    length = round(len(txt) * scale)
+    txt = txt * (length // len(txt) + 1)
+
+    return txt[:length]
+
+
+def get_size_mb(txt):
+    """Returns the size of the UTF-8 encoded text in MB."""
+    return len(txt.encode('utf-8')) / 1e6
+
+
+def measure_time(func, arg, reps):
+    """Returns the best time of ´reps´ calls of the function and its result."""
+    best_time = float('inf')
+    result = None
+    for _ in range(reps):
+        start = time.perf_counter()
+        result = func(arg)
+        best_time = min(best_time, time.perf_counter() - start)
+
+    return best_time, result
+
+
+def get_stage_times(txt, reps):
+    """Returns the time of each pipeline stage on the given text."""
+    stage_times = dict()
+    for name, stage in STAGES:
+        stage_times[name], txt = measure_time(stage, txt, reps)
+
+    return stage_times
+
+
+def get_peak_memory(txt):
+    """Returns the peak memory in bytes allocated by the transcription of the text."""
+    tracemalloc.start()
+    translate(txt)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return peak
+
+
+def get_scaling(txt, reps):
+    """Returns the throughput of the transcription for the text scaled to various sizes."""
+    scaling = []
+    for scale in SCALES:
+        scaled_txt = get_scaled_text(txt, scale)
+        seconds, _ = measure_time(translate, scaled_txt, reps)
+        size_mb = get_size_mb(scaled_txt)
+        scaling.append({'size_mb': size_mb, 'seconds': seconds, 'mb_per_s': size_mb / seconds})
+
+    return scaling
+
+
+def run_benchmark(input_path=BENCH_FILE, reps=REPS):
+    """Runs the benchmark on the given file and returns the result as a dictionary."""
+    txt = load_text(input_path)
+    size_mb = get_size_mb(txt)
+    seconds, _ = measure_time(translate, txt, reps)
+
+    return {
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'input': Path(input_path).name,
+        'size_mb': size_mb,
+        'seconds': seconds,
+        'mb_per_s': size_mb / seconds,
+        'stages': get_stage_times(txt, reps),
+        'peak_memory': get_peak_memory(txt),
+        'scaling': get_scaling(txt, reps),
+    }
+
+
+def load_history(history_path):
+    """Loads the list of previous results, or returns an empty one if there is no history yet."""
+    if not Path(history_path).exists():
+        return []
+    with open(history_path, 'r', encoding='utf-8') as fr:
+        return json.load(fr)
+
+
+def save_history(history_path, history):
+    """Saves the list of results."""
+    with open(history_path, 'w', encoding='utf-8') as fw:
+        json.dump(history, fw, indent=2)
+
+
+def find_regression(result, history, threshold=REGRESSION_THRESHOLD):
+    """Returns the description of the throughput regression against the recent runs on the same input, or None."""
+    recent = [item['mb_per_s'] for item in history if item['input'] == result['input']][-HISTORY_WINDOW:]
+    if not recent:
+        return None
+    reference = statistics.median(recent)
+    if result['mb_per_s'] >= reference * (1.0 - threshold):
+        return None
+
+    return 'Throughput {0:.2f} MB/s is more than {1:.0%} below the recent median {2:.2f} MB/s'.format(
+        result['mb_per_s'], threshold, reference)
+
+
+def format_result(result):
+    """Returns the human readable summary of the result."""
+    lines = ['Translate: {0:.2f} MB/s ({1:.4f} s for {2:.2f} MB), peak memory {3:.1f} MB'.format(
+        result['mb_per_s'], result['seconds'], result['size_mb'], result['peak_memory'] / 1e6)]
+    for name, seconds in result['stages'].items():
+        lines.append('  {0:<20}{1:.4f} s'.format(name, seconds))
+    for item in result['scaling']:
+        lines.append('  {0:>8.2f} MB: {1:.2f} MB/s'.format(item['size_mb'], item['mb_per_s']))
+
+    return '\n'.join(lines)
+
+
+if __name__ == '__main__':
+    args = parser.parse_args()
+    result = run_benchmark(args.input, args.reps)
+    history = load_history(args.history)
+    regression = find_regression(result, history, args.threshold)
+    print(format_result(result))
+    if not args.no_save:
+        history.append(result)
+        save_history(args.history, history)
+    if regression is not None:
+        print(regression)
+        raise SystemExit(1)
@@ -0,0 +1,189 @@
+"""Phoneme-level accuracy evaluation"""
+import argparse
+from collections import Counter
+from multiprocessing import Pool
+
+import numpy as np
+
+# Symbol of the missing phoneme in the aligned pairs (deletions and insertions)
+EPSILON = ''
+# Characters of the transcription which are not phonemes
+SEPARATORS = '|'
+# Number of lines sent to a worker at once
+LINES_CHUNK_SIZE = 64
+# Number of the most frequent errors in the summary
+TOP_ERRORS = 10
+
+parser = argparse.ArgumentParser()
+parser.add_argument('reference', metavar='REFERENCE', type=str, help='File with the reference transcription')
+parser.add_argument('predicted', metavar='PREDICTED', type=str, help='File with the predicted transcription')
+parser.add_argument('--jobs', type=int, help='Number of worker processes, all CPUs by default')
+parser.add_argument('--matrix', metavar='PATH', type=str,
+                    help='Save the confusion matrix of the phonemes as a tab separated table')
+
+
+def get_phonemes(line):
+    """Returns the phonemes of the transcription line."""
+    for separator in SEPARATORS:
+        line = line.replace(separator, '')
+
+    return line
+
+
+def get_codes(phonemes):
+    """Returns the phonemes as an array of integer codes."""
+    return np.frombuffer(phonemes.encode('utf-32-le'), dtype=np.uint32)
+
+
+def get_distance_matrix(reference, predicted):
+    """Returns the matrix of the edit distances between all prefixes of the reference and predicted phonemes."""
+    ref_codes = get_codes(reference)
+    pred_codes = get_codes(predicted)
+    offsets = np.arange(len(predicted) + 1)
+    dist = np.empty((len(reference) + 1, len(predicted) + 1), dtype=np.int32)
+    dist[0] = offsets
+    row = np.empty(len(predicted) + 1, dtype=np.int32)
+    for i in range(1, len(reference) + 1):
+        # Deletions and substitutions depend on the previous row only
+        row[0] = i
+        np.minimum(dist[i - 1, 1:] + 1, dist[i - 1, :-1] + (pred_codes != ref_codes[i - 1]), out=row[1:])
+        # Insertions chain along the row: dist[i, j] = min over k <= j of row[k] + j - k
+        dist[i] = np.minimum.accumulate(row - offsets) + offsets
+
+    return dist
+
+
+def get_common_prefix_len(reference, predicted):
+    """Returns the length of the common prefix of the phonemes."""
+    length = min(len(reference), len(predicted))
+    mismatches = np.flatnonzero(get_codes(reference[:length]) != get_codes(predicted[:length]))
+
+    return mismatches[0] if len(mismatches) else length
+
+
+def align(reference, predicted):
+    """Returns the list of aligned (reference, predicted) phoneme pairs with the minimal edit distance.
+
+    Deleted and inserted phonemes are paired with the ´EPSILON´."""
+    # The common prefix and suffix are matched, only the rest needs the distance matrix
+    prefix_len = get_common_prefix_len(reference, predicted)
+    suffix_len = get_common_prefix_len(reference[prefix_len:][::-1], predicted[prefix_len:][::-1])
+    prefix = [(phoneme, phoneme) for phoneme in reference[:prefix_len]]
+    suffix = [(phoneme, phoneme) for phoneme in reference[len(reference) - suffix_len:]]
+    reference = reference[prefix_len:len(reference) - suffix_len]
+    predicted = predicted[prefix_len:len(predicted) - suffix_len]
+
+    dist = get_distance_matrix(reference, predicted)
+    pairs = []
+    i, j = len(reference), len(predicted)
+    while i > 0 or j > 0:
+        if i > 0 and j > 0 and dist[i, j] == dist[i - 1, j - 1] + (reference[i - 1] != predicted[j - 1]):
+            pairs.append((reference[i - 1], predicted[j - 1]))
+            i -= 1
+            j -= 1
+        elif i > 0 and dist[i, j] == dist[i - 1, j] + 1:
+            pairs.append((reference[i - 1], EPSILON))
+            i -= 1
+        else:
+            pairs.append((EPSILON, predicted[j - 1]))
+            j -= 1
+
+    return prefix + pairs[::-1] + suffix
+
+
+def count_line_pairs(lines):
+    """Returns the counts of the aligned phoneme pairs of the (reference, predicted) line pair."""
+    reference, predicted = lines
+    return Counter(align(get_phonemes(reference), get_phonemes(predicted)))
+
+
+def get_confusion_matrix(confusion):
+    """Returns the sorted list of symbols and the matrix of the pair counts indexed by the reference and predicted
+    symbol. The ´EPSILON´ is the first symbol."""
+    symbols = sorted({symbol for pair in confusion for symbol in pair} | {EPSILON})
+    index = {symbol: i for i, symbol in enumerate(symbols)}
+    matrix = np.zeros((len(symbols), len(symbols)), dtype=np.int64)
+    for (ref, pred), count in confusion.items():
+        matrix[index[ref], index[pred]] = count
+
+    return symbols, matrix
+
+
+def evaluate(reference_lines, predicted_lines, jobs=1):
+    """Aligns the predicted transcription to the reference one line by line and returns the phoneme error rate,
+    the error counts, the confusion counter of the (reference, predicted) phoneme pairs and the same counts as the
+    confusion matrix of the symbols (see ´get_confusion_matrix´).
+
+    The lines are aligned by a pool of ´jobs´ processes (all CPUs if None)."""
+    if len(reference_lines) != len(predicted_lines):
+        raise ValueError('Reference has {0} lines, prediction has {1}'.format(len(reference_lines),
+                                                                              len(predicted_lines)))
+    pairs = list(zip(reference_lines, predicted_lines))
+    confusion = Counter()
+    if jobs == 1:
+        for line_confusion in map(count_line_pairs, pairs):
+            confusion.update(line_confusion)
+    else:
+        with Pool(jobs) as pool:
+            for line_confusion in pool.imap(count_line_pairs, pairs, LINES_CHUNK_SIZE):
+                confusion.update(line_confusion)
+
+    substitutions = sum(count for (ref, pred), count in confusion.items() if EPSILON not in (ref, pred) and ref != pred)
+    deletions = sum(count for (ref, pred), count in confusion.items() if pred == EPSILON)
+    insertions = sum(count for (ref, pred), count in confusion.items() if ref == EPSILON)
+    phonemes = sum(count for (ref, pred), count in confusion.items() if ref != EPSILON)
+    symbols, confusion_matrix = get_confusion_matrix(confusion)
+
+    return {
+        'lines': len(pairs),
+        'phonemes': phonemes,
+        'substitutions': substitutions,
+        'deletions': deletions,
+        'insertions': insertions,
+        'per': (substitutions + deletions + insertions) / max(phonemes, 1),
+        'confusion': confusion,
+        'symbols': symbols,
+        'confusion_matrix': confusion_matrix,
+    }
+
+
+def evaluate_files(reference_path, predicted_path, jobs=1):
+    """Evaluates the predicted transcription file against the reference one."""
+    with open(reference_path, 'r', encoding='utf-8') as fr:
+        reference_lines = fr.read().splitlines()
+    with open(predicted_path, 'r', encoding='utf-8') as fr:
+        predicted_lines = fr.read().splitlines()
+
+    return evaluate(reference_lines, predicted_lines, jobs)
+
+
+def format_evaluation(result, top_errors=TOP_ERRORS):
+    """Returns the human readable summary of the result with the most frequent errors."""
+    lines = ['PER: {0:.4f} ({1} phonemes in {2} lines, {3} substitutions, {4} deletions, {5} insertions)'.format(
+        result['per'], result['phonemes'], result['lines'], result['substitutions'], result['deletions'],
+        result['insertions'])]
+    errors = [(pair, count) for pair, count in result['confusion'].items() if pair[0] != pair[1]]
+    for (ref, pred), count in sorted(errors, key=lambda item: -item[1])[:top_errors]:
+        lines.append('  {0!r:>6} -> {1!r:<6}{2}'.format(ref, pred, count))
+
+    return '\n'.join(lines)
+
+
+def format_confusion_matrix(result):
+    """Returns the confusion matrix of the result as a tab separated table, the rows are the reference symbols and
+    the columns the predicted ones. The ´EPSILON´ is shown as '-'."""
+    labels = [symbol or '-' for symbol in result['symbols']]
+    lines = ['\t'.join([''] + labels)]
+    for label, row in zip(labels, result['confusion_matrix']):
+        lines.append('\t'.join([label] + [str(count) for count in row]))
+
+    return '\n'.join(lines) + '\n'
+
+
+if __name__ == '__main__':
+    args = parser.parse_args()
+    result = evaluate_files(args.reference, args.predicted, args.jobs)
+    print(format_evaluation(result))
+    if args.matrix is not None:
+        with open(args.matrix, 'w', encoding='utf-8') as fw:
+            fw.write(format_confusion_matrix(result))
@@ -0,0 +1,212 @@
+"""Equivalence tests of the optimized stages against the original implementation"""
+import random
+import re
+import tempfile
+import unittest
+from pathlib import Path
+
+from phonetrans.fcn.batch import get_input_paths, transcribe, transcribe_file_parallel, transcribe_files
+from phonetrans.fcn.processing import *
+from phonetrans.fcn.profiling import StageProfiler
+from phonetrans.fcn.rules import *
+
+DATA_DIR = Path(__file__).parent.parent / "data"
+CORPORA = [DATA_DIR / "test" / "blabot.txt", DATA_DIR / "test" / "vety_HDS.ortho.txt",
+           DATA_DIR / "train" / "ukazka_HDS.ortho.txt"]
+FUZZ_REPS = 20000
+FUZZ_MAX_LEN = 12
+ASSIMILATION_CHARS = CONSONANTS + VOWELS + "|||$#!HLPQ"
+OVERLAP_CHARS = "ksbmlrRzda|"
+STREAM_CHARS = "ahdxčzěKní\t\n\n .;, "
+STREAM_PART_SIZES = [1, 7, 100, 4096]
+STAGE_NAMES = ['lower', 'simple_replacement', 'regex_replacement', 'chain_replacement', 'grind']
+CACHE_CHARS = "aeyýěchdxzkrmsntí \x00.;,\n"
+
+
+def reference_simple_replacement(txt):
+    """Original sequential implementation of the simple replacement."""
+    for character in SIMPLE_RULES:
+        txt = txt.replace(character, SIMPLE_RULES[character])
+
+    return txt
+
+
+def reference_simple_hits(txt):
+    """Returns the number of matches of each simple rule at the moment of its sequential application."""
+    hits = dict()
+    for character in SIMPLE_RULES:
+        hits[character] = txt.count(character)
+        txt = txt.replace(character, SIMPLE_RULES[character])
+
+    return hits
+
+
+def reference_regex_hits(txt):
+    """Returns the number of replacements of each regex rule at the moment of its sequential application."""
+    hits = dict()
+    for regex in REGEX_RULES:
+        txt, hits[regex] = re.subn(regex, REGEX_RULES[regex], txt)
+
+    return hits
+
+
+def reference_regex_replacement(txt):
+    """Original implementation of the regex replacement."""
+    for regex in REGEX_RULES:
+        txt = re.sub(regex, REGEX_RULES[regex], txt)
+
+    return txt
+
+
+def reference_chain_replacement(txt):
+    """Original character by character implementation of the chain replacement."""
+    list_txt = list(txt)
+    matches = re.finditer(CHAIN_REGIONS_REGEX, txt)
+    matches_positions = [(match.start(), match.end()) for match in matches]
+    for match in matches_positions:
+        chain = txt[match[0]:match[1]]
+        dominant_char = chain[-1]
+        if dominant_char in RECESSIVE_CHARS:
+            continue
+        elif dominant_char in VOICED_CHARS:
+            for i in range(match[0], match[1]):
+                if txt[i] in PAIR_CONSONANTS and txt[i] in UNVOICED_CONSONANTS:
+                    list_txt[i] = UNVOICED_TO_VOICED[txt[i]]
+        elif dominant_char in UNVOICED_CHARS:
+            for i in range(match[0], match[1]):
+                if txt[i] in PAIR_CONSONANTS and txt[i] in VOICED_P_CONSONANTS:
+                    list_txt[i] = VOICED_TO_UNVOICED[txt[i]]
+
+    return "".join(list_txt)
+
+
+def reference_assimilation(txt):
+    """Original regex and chain replacement stages."""
+    return reference_chain_replacement(reference_regex_replacement(txt))
+
+
+def get_fuzz_texts(chars):
+    """Yields reproducible random strings of the given characters."""
+    rng = random.Random(0)
+    for _ in range(FUZZ_REPS):
+        yield ''.join(rng.choice(chars) for _ in range(rng.randint(0, FUZZ_MAX_LEN)))
+
+
+def get_fuzz_chars():
+    """Returns all characters taking part in the rules plus few characters outside of them."""
+    chars = set("bk?")
+    for key, value in SIMPLE_RULES.items():
+        chars.update(key + value)
+
+    return ''.join(sorted(chars))
+
+
+class TestEquivalence(unittest.TestCase):
+    """Tests that the optimized stages produce the same output as the original ones."""
+
+    def test_simple_replacement_corpora(self):
+        """Compares the simple replacement on all corpora."""
+        for path in CORPORA:
+            txt = load_text(path).lower()
+            self.assertEqual(reference_simple_replacement(txt), simple_replacement(txt), path.name)
+
+    def test_simple_replacement_fuzz(self):
+        """Compares the simple replacement on random strings of rule characters."""
+        for txt in get_fuzz_texts(get_fuzz_chars()):
+            self.assertEqual(reference_simple_replacement(txt), simple_replacement(txt), repr(txt))
+
+    def test_assimilation_corpora(self):
+        """Compares the regex and chain replacements on all corpora."""
+        for path in CORPORA:
+            txt = simple_replacement(load_text(path).lower())
+            self.assertEqual(reference_assimilation(txt), chain_replacement(regex_replacement(txt)), path.name)
+
+    def test_assimilation_fuzz(self):
+        """Compares the regex and chain replacements on random strings of consonants, vowels and separators."""
+        for txt in get_fuzz_texts(ASSIMILATION_CHARS):
+            self.assertEqual(reference_regex_replacement(txt), regex_replacement(txt), repr(txt))
+            self.assertEqual(reference_chain_replacement(txt), chain_replacement(txt), repr(txt))
+
+    def test_overlapping_regex_matches(self):
+        """Compares the regex replacement on texts where the original rules skip overlapping matches."""
+        for txt in get_fuzz_texts(OVERLAP_CHARS):
+            self.assertEqual(reference_regex_replacement(txt), regex_replacement(txt), repr(txt))
+
+    def test_stream_corpora(self):
+        """Compares the streamed transcription of the corpora by parts of various sizes with the whole one."""
+        for path in CORPORA:
+            txt = load_text(path)
+            for size in STREAM_PART_SIZES:
+                parts = (txt[i:i + size] for i in range(0, len(txt), size))
+                self.assertEqual(translate(txt), "".join(translate_stream(parts)), (path.name, size))
+
+    def test_stream_fuzz(self):
+        """Compares the streamed transcription of random strings split into single characters with the whole one."""
+        for txt in get_fuzz_texts(STREAM_CHARS):
+            self.assertEqual(translate(txt), "".join(translate_stream(txt)), repr(txt))
+
+    def test_parallel_transcription(self):
+        """Compares the files transcribed by the process pool with the whole file transcription."""
+        with tempfile.TemporaryDirectory() as out_dir:
+            out_dir = Path(out_dir)
+            output_paths = list(transcribe_files(CORPORA, out_dir, jobs=2))
+            self.assertEqual([get_output_path(path, output_dir=out_dir) for path in CORPORA], output_paths)
+            for path, output_path in zip(CORPORA, output_paths):
+                self.assertEqual(translate(load_text(path)), load_text(output_path), path.name)
+
+            output_path = out_dir / "blocks.txt"
+            transcribe_file_parallel(CORPORA[0], output_path, jobs=2, chunk_size=10000)
+            self.assertEqual(translate(load_text(CORPORA[0])), load_text(output_path))
+
+    def test_chunked_batch(self):
+        """Compares the files of the batch streamed in small parts with the whole file transcription."""
+        with tempfile.TemporaryDirectory() as out_dir:
+            out_dir = Path(out_dir)
+            transcribe(str(CORPORA[0].parent / "*.txt"), out_dir, jobs=2, chunk_size=1000)
+            for path in get_input_paths(str(CORPORA[0].parent / "*.txt")):
+                output_path = get_output_path(path, output_dir=out_dir)
+                self.assertEqual(translate(load_text(path)), load_text(output_path), path.name)
+
+    def test_cached_translation(self):
+        """Compares the transcription using the unit cache with the uncached one."""
+        cache = create_cache()
+        for path in CORPORA:
+            txt = load_text(path)
+            self.assertEqual(translate(txt), translate(txt, cache), path.name)
+        self.assertGreater(cache.cache_info().hits, cache.cache_info().misses)
+
+        cache = create_cache(maxsize=16)
+        for txt in get_fuzz_texts(CACHE_CHARS):
+            self.assertEqual(translate(txt), translate(txt, cache), repr(txt))
+
+    def test_profiled_translation(self):
+        """Checks that the profiler does not change the transcription and counts the rule hits correctly."""
+        for path in CORPORA:
+            txt = load_text(path)
+            profiler = StageProfiler()
+            self.assertEqual(translate(txt), translate(txt, profiler=profiler), path.name)
+            summary = profiler.as_dict()
+            self.assertEqual(STAGE_NAMES, list(summary))
+            lower_txt = txt.lower()
+            self.assertEqual(reference_simple_hits(lower_txt), summary['simple_replacement']['hits'])
+            self.assertEqual(reference_regex_hits(simple_replacement(lower_txt)), summary['regex_replacement']['hits'])
+
+    def test_profiled_stream(self):
+        """Checks that the streamed transcription records each block once, including the grind of its parts."""
+        profiler = StageProfiler()
+        self.assertEqual(translate("Ahoj. Jak se máš?\n"), "".join(translate_stream(["Ahoj. ", "Jak se máš?\n"],
+                                                                                        profiler=profiler)))
+        summary = profiler.as_dict()
+        self.assertEqual(STAGE_NAMES, list(summary))
+        # The following blocks are transcribed together with their boundaries, the last one is empty
+        self.assertEqual(len("Ahoj. ") + len(". Jak se máš?\n") + len("\n"), summary['lower']['input_len'])
+        self.assertEqual(3, summary['grind']['calls'])
+
+    def test_profiled_batch(self):
+        """Checks that the profiling is rejected for the worker processes and the batch mode."""
+        with tempfile.TemporaryDirectory() as out_dir:
+            with self.assertRaises(ValueError):
+                transcribe(str(CORPORA[0]), Path(out_dir) / "out.txt", jobs=2, profiler=StageProfiler())
+            with self.assertRaises(ValueError):
+                transcribe(str(CORPORA[0].parent / "*.txt"), out_dir, profiler=StageProfiler())
+            self.assertEqual([], list(Path(out_dir).iterdir()))
@@ -1,65 +1,88 @@
 """Project performance tests"""
-import time
+import os
+import random
+import tempfile
 import unittest
 
-import numpy as np
-from sklearn.feature_extraction.text import TfidfVectorizer
 from termcolor import colored
 
-from fcn.processing import *
+from phonetrans.fcn.processing import *
+from phonetrans.tst.benchmark import *
+from phonetrans.tst.evaluation import *
 
-COPY_PASTE_SCORE = 0.3059463604477232
-LAST_FITNESS_NAME = "last_fitness.txt"
+TRAIN_DIR = DATA_DIR / "train"
+# Largest accepted phoneme error rate on the train data
+MAX_TRAIN_PER = 0.01
+SPEED_REPS = 3
+# Environment variable enabling the speed report, the timing is too noisy for the regular test runs
+BENCHMARK_ENV = "PHONETRANS_BENCHMARK"
+# Throughput drop against the benchmark history which is reported by the speed test
+SPEED_REPORT_THRESHOLD = 0.5
+EDIT_DISTANCE_REPS = 5000
+EDIT_DISTANCE_CHARS = "abč|"
 
 
-class TestPerformance(unittest.TestCase):
-    """Tests the performance of the system."""
-
-    def test_speed(self, numb_of_reps=10):
-        """Tests how much time it takes on average to run algorithm on 1 MB file."""
+def reference_edit_distance(reference, predicted):
+    """Returns the edit distance computed by the plain dynamic programming."""
+    prev_row = list(range(len(predicted) + 1))
+    for i, ref in enumerate(reference, 1):
+        row = [i]
+        for j, pred in enumerate(predicted, 1):
+            row.append(min(prev_row[j] + 1, row[j - 1] + 1, prev_row[j - 1] + (ref != pred)))
+        prev_row = row
 
-        avg_time = 0.0
+    return prev_row[-1]
 
-        for i in range(numb_of_reps):
-            start = time.time()
-            process_file(Path("../data/test/blabot.txt"))
-            end = time.time()
 
-            avg_time += end - start
+class TestPerformance(unittest.TestCase):
+    """Tests the performance of the system."""
 
-        avg_time /= numb_of_reps
+    @unittest.skipUnless(os.environ.get(BENCHMARK_ENV), 'set {0} to report the speed'.format(BENCHMARK_ENV))
+    def test_speed(self, numb_of_reps=SPEED_REPS):
+        """Benchmarks the algorithm on 1 MB file and reports the throughput against the previous runs of the benchmark
+        script, which keeps the history and fails on regressions."""
+        result = run_benchmark(BENCH_FILE, numb_of_reps)
+        regression = find_regression(result, load_history(HISTORY_PATH), SPEED_REPORT_THRESHOLD)
 
-        print(colored('\n\nExecute time: {0} seconds'.format(avg_time), 'cyan'))
+        print(colored('\n\n' + format_result(result), 'cyan'))
+        if regression is not None:
+            print(colored(regression, 'red'))
 
     def test_accuracy(self):
-        """Tests the algorithm accuracy."""
-        process_file(Path("../data/train/ukazka_HDS.ortho.txt"))
-
-        # Open ground truth output
-        f = open("../data/train/ukazka_HDS.phntrn.txt", "r", encoding='utf-8')
-        ground_truth = f.read()
-        f.close()
-
-        # Open predicted output
-        f = open("../data/output/ukazka_HDS.phntrn.txt", "r", encoding='utf-8')
-        predict = f.read()
-        f.close()
-
-        # Open previous predicted output
-        f = open(LAST_FITNESS_NAME, "r", encoding='utf-8')
-        last_fitness = float(f.read())
-        f.close()
-
-        # Compute the difference between outputs
-        vect = TfidfVectorizer(min_df=1, encoding="utf-8", lowercase=False, token_pattern="(.)")
-        tfidf = vect.fit_transform([ground_truth, predict])
-        pairwise_similarity = tfidf * tfidf.T
-
-        relative_fitness = np.min(pairwise_similarity)
-
-        print(colored('\n\nRelative similarity on train data: {0}'.format(relative_fitness), 'cyan'))
-        print(colored('Previous relative data similarity: {0}'.format(last_fitness), 'cyan'))
-        print(colored('Relative similarity of copy-paste: {0}'.format(COPY_PASTE_SCORE), 'cyan'))
-
-        with open("last_fitness.txt", 'w', encoding='utf-8') as f:
-            f.write(str(relative_fitness))
+        """Tests the phoneme error rate of the algorithm on the train data against the fixed threshold."""
+        with tempfile.TemporaryDirectory() as out_dir:
+            output_path = Path(out_dir) / "ukazka_HDS.phntrn.txt"
+            transcribe_file(TRAIN_DIR / "ukazka_HDS.ortho.txt", output_path)
+            result = evaluate_files(TRAIN_DIR / "ukazka_HDS.phntrn.txt", output_path)
+        copy_paste_result = evaluate_files(TRAIN_DIR / "ukazka_HDS.phntrn.txt", TRAIN_DIR / "ukazka_HDS.ortho.txt")
+
+        print(colored('\n\n' + format_evaluation(result), 'cyan'))
+        print(colored('PER of copy-paste: {0}'.format(copy_paste_result['per']), 'cyan'))
+
+        self.assertLessEqual(result['per'], MAX_TRAIN_PER)
+
+    def test_confusion_matrix(self):
+        """Checks that the confusion matrix counts the aligned pairs of the substitutions, deletions and insertions."""
+        result = evaluate(["|ahoj|svjete", "|ano"], ["|ahxoj|svjeta", "|an"])
+        symbols = result['symbols']
+        matrix = result['confusion_matrix']
+
+        self.assertEqual(EPSILON, symbols[0])
+        self.assertEqual(sum(result['confusion'].values()), matrix.sum())
+        self.assertEqual(1, matrix[symbols.index(EPSILON), symbols.index('x')])
+        self.assertEqual(1, matrix[symbols.index('e'), symbols.index('a')])
+        self.assertEqual(1, matrix[symbols.index('o'), symbols.index(EPSILON)])
+        self.assertEqual(result['substitutions'] + result['deletions'] + result['insertions'],
+                         matrix.sum() - np.trace(matrix))
+        self.assertEqual(len(symbols) + 1, len(format_confusion_matrix(result).splitlines()))
+
+    def test_edit_distance(self):
+        """Compares the vectorized edit distance with the plain dynamic programming on random strings."""
+        rng = random.Random(0)
+        for _ in range(EDIT_DISTANCE_REPS):
+            reference = ''.join(rng.choice(EDIT_DISTANCE_CHARS) for _ in range(rng.randint(0, 10)))
+            predicted = ''.join(rng.choice(EDIT_DISTANCE_CHARS) for _ in range(rng.randint(0, 10)))
+            pairs = align(reference, predicted)
+            self.assertEqual(reference, ''.join(ref for ref, _ in pairs))
+            self.assertEqual(predicted, ''.join(pred for _, pred in pairs))
+            self.assertEqual(reference_edit_distance(reference, predicted), sum(ref != pred for ref, pred in pairs))
@@ -0,0 +1,94 @@
+"""Parallel batch synthesis"""
+import os
+from multiprocessing import Pool
+
+from unitselection.fcn.concate import get_cache_infos, get_sentence_lines, get_wav_name, synthetize_sentence, \
+    write_sound
+from unitselection.fcn.constants import *
+from unitselection.fcn.inventory_columnar import convert_inventory
+from unitselection.fcn.inventory_diphone import load_inventory, load_phonemes_sim
+from unitselection.fcn.join_cache import create_join_cache
+from unitselection.fcn.metrics import SentenceMetrics
+from unitselection.fcn.viterbi import BEAM, TOP_K
+
+# Number of lines sent to a worker at once
+SYNTHESIS_CHUNK_SIZE = 4
+
+# Synthesis state of the worker process
+worker_state = None
+
+
+def init_worker(inv_dir, top_k, beam, join_cache_size, record_metrics=False, shard_cache_size=None):
+    """Loads the inventory of the worker process (memory mapped, so its pages are shared by all workers, or sharded
+    with its own memory of ´shard_cache_size´) and creates its join cost cache, if its size is given. If
+    ´record_metrics´ is set, the metrics of each sentence are recorded."""
+    global worker_state
+    inv = load_inventory(inv_dir, shard_cache_size)
+    cache = None if join_cache_size is None else create_join_cache(inv, inv_dir, join_cache_size)
+    worker_state = {'inv': inv, 'phonemes_sim': load_phonemes_sim(inv_dir), 'top_k': top_k, 'beam': beam,
+                    'cache': cache, 'record_metrics': record_metrics}
+
+
+def synthetize_line_pair(pair):
+    """Synthetizes the (line, output path) pair into the WAV file and returns the process id with the statistics of
+    its caches (see ´get_cache_infos´) and the metrics of the sentence (None if they are not recorded)."""
+    line, out_path = pair
+    state = worker_state
+    metrics = SentenceMetrics(line) if state['record_metrics'] else None
+    sound = synthetize_sentence(line, state['inv'], state['phonemes_sim'], state['top_k'], state['beam'],
+                                state['cache'], metrics)
+    write_sound(out_path, sound, metrics)
+
+    return os.getpid(), get_cache_infos(state['inv'], state['cache']), metrics
+
+
+def merge_cache_infos(cache_infos):
+    """Returns the sum of the statistics of the same caches of the workers."""
+    merged = dict()
+    for cache_info in cache_infos:
+        for name, value in cache_info.items():
+            merged[name] = merged.get(name, 0) + value
+    hits = merged['hits'] + merged.get('disk_hits', 0)
+    merged['hit_rate'] = hits / max(hits + merged['misses'], 1)
+
+    return merged
+
+
+def synthetize_lines_parallel(lines, hds_dir, out_dir, jobs=None, top_k=TOP_K, beam=BEAM, join_cache_size=None,
+                              metrics=None, shard_cache_size=None):
+    """Creates the same .wav files as ´synthetize_lines´, the lines are synthetized by a pool of ´jobs´ processes (all
+    CPUs if None).
+
+    The workers map the same columnar inventory, a pickled one is converted first so it is not loaded by each of
+    them. If ´join_cache_size´ or ´shard_cache_size´ is given, each worker keeps its caches of that size and the
+    summed cache statistics are returned. The metrics of the sentences are added to the ´metrics´ in the order of the
+    lines."""
+    inv_dir = hds_dir / PREP
+    if not os.path.exists(inv_dir / COLUMNAR / COLUMNAR_INDEX):
+        convert_inventory(inv_dir)
+    pairs = [(line, out_dir / get_wav_name(i)) for i, line in enumerate(get_sentence_lines(lines))]
+
+    cache_infos = dict()
+    init_args = (inv_dir, top_k, beam, join_cache_size, metrics is not None, shard_cache_size)
+    with Pool(jobs, init_worker, init_args) as pool:
+        # The statistics of each worker only grow, so its last ones are kept
+        for pid, cache_info, sentence_metrics in pool.imap(synthetize_line_pair, pairs, SYNTHESIS_CHUNK_SIZE):
+            cache_infos[pid] = cache_info
+            if metrics is not None:
+                metrics.add(sentence_metrics)
+
+    worker_infos = [cache_info for cache_info in cache_infos.values() if cache_info is not None]
+    if not worker_infos:
+        return None
+    return {name: merge_cache_infos(cache_info[name] for cache_info in worker_infos) for name in worker_infos[0]}
+
+
+def synthetize_speech_parallel(input_file, hds_dir, out_dir, jobs=None, top_k=TOP_K, beam=BEAM,
+                               join_cache_size=None, metrics=None, shard_cache_size=None):
+    """Creates the same .wav files as ´synthetize_speech´, the lines of the ´input_file´ are synthetized by a pool of
+    ´jobs´ processes (see ´synthetize_lines_parallel´)."""
+    with open(input_file, 'r', encoding='utf-8') as fr:
+        lines = fr.read().splitlines()
+
+    return synthetize_lines_parallel(lines, hds_dir, out_dir, jobs, top_k, beam, join_cache_size, metrics,
+                                     shard_cache_size)
@@ -2,6 +2,8 @@
 from scipy.io import wavfile
 
 from unitselection.fcn.inventory_diphone import load_inventory, load_phonemes_sim
+from unitselection.fcn.join_cache import create_join_cache
+from unitselection.fcn.metrics import SentenceMetrics
 from unitselection.fcn.viterbi import *
 
 
@@ -35,27 +37,116 @@ def to_diphones(sentence):
     return new_sentence
 
 
-def get_best_sequence(sentence, inv, phonemes_sim):
-    """Returns the best sequence of diphones signal according to implemented viterbi algorithm."""
-    return get_optimal_signal(sentence, inv, phonemes_sim)
+def get_best_sequence(sentence, inv, phonemes_sim, top_k=TOP_K, beam=BEAM, cache=None, metrics=None):
+    """Returns the best sequence of diphones signal according to implemented viterbi algorithm, pruned by the
+    ´top_k´ and ´beam´, with the concatenation losses from the join cost ´cache´ if it is given."""
+    return get_optimal_signal(sentence, inv, phonemes_sim, top_k, beam, cache, metrics)
 
 
-def synthetize_speech(input_file, hds_dir, out_dir):
-    """Creates .wav file for each line of the ´input_file´ with synthetized sentence and saves these files into ´out_dir´.
-    The ´hds_dir´ is necessary to load supportive files."""
-    inv = load_inventory(hds_dir / PREP)
+def clean_line(line):
+    """Removes the characters which are not synthetized from the line of phonetic transcription."""
+    line = line.replace('|', '')
+    line = line.replace('#', '')
+    line = line.replace('?', '')
+    return line
+
+
+def get_sentence_lines(lines):
+    """Returns the lines of phonetic transcription which contain any phonemes to synthetize."""
+    return [line for line in lines if clean_line(line)]
+
+
+def synthetize_sentence(line, inv, phonemes_sim, top_k=TOP_K, beam=BEAM, cache=None, metrics=None):
+    """Returns the synthetized signal of the sentence given by single line of phonetic transcription. The optional
+    ´metrics´ (see ´SentenceMetrics´) record the stages of the synthesis."""
+    if metrics is not None:
+        metrics.start()
+    line = clean_line(line)
+    diphones = to_diphones(line)
+    if metrics is not None:
+        metrics.lap('diphones')
+    sequence = get_best_sequence(diphones, inv, phonemes_sim, top_k, beam, cache, metrics)
+    sound = concat_diphones(sequence)
+    if metrics is not None:
+        metrics.lap('concat')
+        metrics.audio_bytes += sound.nbytes
+    return sound
+
+
+def stream_sentence(line, inv, phonemes_sim, lag=STREAM_LAG, top_k=TOP_K, beam=BEAM, cache=None):
+    """Yields the synthetized signal of the sentence given by single line of phonetic transcription in int16 blocks.
+
+    The units are searched with the fixed ´lag´ (see ´iter_optimal_units´), so the first block is ready after ´lag´
+    diphones are searched, regardless of the sentence length. Each unit is yielded as soon as the next one is
+    committed, as its end is overlapped by the start of the next one. Without the ´lag´ the blocks together are
+    equal to the output of ´synthetize_sentence´."""
+    diphones = to_diphones(clean_line(line))
+    overlap = np.zeros((0,))
+    numb_of_units = 0
+    alternatives = dict()
+    for diphone, i, _ in iter_optimal_units(diphones, inv, phonemes_sim, lag, top_k, beam, cache, None, alternatives):
+        block = alternatives[diphone].get_signal(i).astype('float64')
+        block[:len(overlap)] += overlap
+        overlap = block[len(block) - FADE_LEN:]
+        numb_of_units += 1
+        yield block[:len(block) - FADE_LEN].astype('int16')
+    if numb_of_units > 0:
+        # The signal ends by the silence of the overlapped lengths, as in ´concat_diphones´
+        yield np.concatenate([overlap, np.zeros(((numb_of_units - 1) * FADE_LEN,))]).astype('int16')
+
+
+def get_wav_name(i):
+    """Returns the name of the .wav file of the i-th synthetized sentence, numbered from 0001."""
+    return str(i + 1).zfill(4) + ".wav"
+
+
+def write_sound(out_path, sound, metrics=None):
+    """Saves the signal into the .wav file, the time is recorded by the sentence ´metrics´ if they are given."""
+    if metrics is not None:
+        metrics.start()
+    wavfile.write(out_path, SAMPLE_RATE, sound)
+    if metrics is not None:
+        metrics.lap('wav')
+
+
+def get_cache_infos(inv, cache=None):
+    """Returns the statistics of the join cost ´cache´ and of the sharded inventory, None if neither is used."""
+    cache_infos = dict()
+    if cache is not None:
+        cache_infos['join_cache'] = cache.cache_info()
+    if hasattr(inv, 'cache_info'):
+        cache_infos['inventory'] = inv.cache_info()
+
+    return cache_infos or None
+
+
+def synthetize_lines(lines, hds_dir, out_dir, top_k=TOP_K, beam=BEAM, join_cache_size=None, metrics=None,
+                     shard_cache_size=None):
+    """Creates .wav file for each of the ´lines´ of phonetic transcription with synthetized sentence and saves these
+    files into ´out_dir´, the lines without any phonemes are skipped. The ´hds_dir´ is necessary to load supportive
+    files. The unit search is pruned by the ´top_k´
+    and ´beam´. If ´join_cache_size´ is given, the concatenation losses of the diphone pairs are cached for all lines.
+    If ´shard_cache_size´ is given, the diphones of the inventory are loaded on the first use and kept up to that
+    memory (see ´ShardedInventory´). The statistics of these caches are returned (see ´get_cache_infos´). The metrics
+    of each sentence are added to the ´metrics´ (see ´SynthesisMetrics´) if they are given."""
+    inv = load_inventory(hds_dir / PREP, shard_cache_size)
     phonemes_sim = load_phonemes_sim(hds_dir / PREP)
+    cache = None if join_cache_size is None else create_join_cache(inv, hds_dir / PREP, join_cache_size)
+    for i, line in enumerate(get_sentence_lines(lines)):
+        sentence_metrics = None if metrics is None else SentenceMetrics(line)
+        sound = synthetize_sentence(line, inv, phonemes_sim, top_k, beam, cache, sentence_metrics)
+        write_sound(out_dir / get_wav_name(i), sound, sentence_metrics)
+        if metrics is not None:
+            metrics.add(sentence_metrics)
+
+    return get_cache_infos(inv, cache)
 
+
+def synthetize_speech(input_file, hds_dir, out_dir, top_k=TOP_K, beam=BEAM, join_cache_size=None, metrics=None,
+                      shard_cache_size=None):
+    """Creates .wav file for each line of the ´input_file´ with synthetized sentence and saves these files into
+    ´out_dir´ (see ´synthetize_lines´)."""
     with open(input_file, 'r', encoding='utf-8') as fr:
         lines = fr.read().splitlines()
-        for i, line in enumerate(lines):
-            # Remove unwanted characters
-            line = line.replace('|', '')
-            line = line.replace('#', '')
-            line = line.replace('?', '')
-            # Process the sentence
-            diphones = to_diphones(line)
-            sequence = get_best_sequence(diphones, inv, phonemes_sim)
-            sound = concat_diphones(sequence)
-            f_name = str(i + 1).zfill(4) + ".wav"
-            wavfile.write(out_dir / f_name, SAMPLE_RATE, sound)
+
+    return synthetize_lines(lines, hds_dir, out_dir, top_k, beam, join_cache_size, metrics, shard_cache_size)
@@ -5,6 +5,9 @@ import numpy as np
 ALPHABET = ['$', 'T', 'I', 'm', 'p', 'Q', 'e', 'c', 't', 'k', 'i', 'J', 's', 'n', 'A', 'u', '!', 'o', 'r', 'h', 'y',
             'd', 'f', 'E', 'a', 'D', 'S', 'v', 'l', 'U', '#', 'b', 'z', 'j', 'C', 'Z', 'g', '%', 'R', 'N', 'x', 'O',
             'w', 'Y', 'F', 'W', 'M']
+# Integer ids of the phonemes, the last id marks missing context phoneme
+PHONEME_IDS = {phoneme: i for i, phoneme in enumerate(ALPHABET)}
+NO_PHONEME_ID = len(ALPHABET)
 
 # Characters grouped by 3 levels of similarity
 SIMILARITY = [
@@ -25,6 +28,17 @@ OUT = "out"
 PREP = "prep"
 INV = "inventory.plk"
 PHON_SIM = "phonemes_sim.plk"
+PHON_SIM_MATRIX = "phonemes_sim.npy"
+COLUMNAR = "columnar"
+COLUMNAR_INDEX = "index.json"
+SIGNALS = "signals.npy"
+OFFSETS = "offsets.npy"
+MANIFEST = "manifest.json"
+PARSED = "parsed"
+ENRG_SUFFIX = ".enrg.txt"
+F0_SUFFIX = ".f0.txt"
+MFCC_SUFFIX = ".mfcc.txt"
+JOIN_COSTS = "join_costs"
 ORIG_MLF = "phnalign.mlf"
 # Numeric constants
 TIME_STEP = 1.0e-7  # time step of the original MLF file [s]
@@ -0,0 +1,145 @@
+"""Bulk parsing and alignment of the recorded sentence data"""
+import os
+import re
+from functools import lru_cache
+from itertools import chain
+
+from unitselection.fcn.constants import *
+
+# Lines of the unsel feature tables
+TABLE_LINE_REGEX = re.compile(r'^\|.*$', re.MULTILINE)
+
+
+def read_text(path, encoding=None):
+    """Returns the whole content of the text file."""
+    with open(path, 'r', encoding=encoding) as fr:
+        return fr.read()
+
+
+@lru_cache(maxsize=None)
+def get_fields_regex(numb_of_fields):
+    """Returns the regex of the lines with the given number of whitespace separated fields."""
+    return re.compile(r'^[ \t]*\S+(?:[ \t]+\S+){%d}[ \t]*\r?$' % (numb_of_fields - 1), re.MULTILINE)
+
+
+def split_fields(text, indices):
+    """Returns the columns (lists) of the whitespace separated fields at the given indices (negative ones count from
+    the line end) of the non-empty lines of the text.
+
+    The text is split at once if all its lines have the same number of fields, otherwise line by line."""
+    fields = text.split()
+    if not fields:
+        return [[] for _ in indices]
+    lines = text.splitlines()
+    numb_of_lines = len(lines) - lines.count('')
+    numb_of_fields = len(text.lstrip().split('\n', 1)[0].split())
+    if len(fields) == numb_of_fields * numb_of_lines and \
+            len(get_fields_regex(numb_of_fields).findall(text)) == numb_of_lines:
+        return [fields[i % numb_of_fields::numb_of_fields] for i in indices]
+    # Ragged lines, e.g. MLF with the score or word columns on some of them
+    rows = [line.split() for line in lines if line.strip()]
+
+    return [[row[i] for row in rows] for i in indices]
+
+
+def split_table(text):
+    """Returns the columns (lists) of the '|' separated fields of the table lines (starting with '|') of the text,
+    without spaces."""
+    lines = TABLE_LINE_REGEX.findall(text)
+    if not lines:
+        return []
+    # Each line gives its fields followed by the empty field behind its closing '|'
+    fields = '\n'.join(lines).replace(' ', '').split('|')[1:]
+    numb_of_fields = len(fields) // len(lines)
+    ends = set(fields[numb_of_fields - 1::numb_of_fields])
+    if numb_of_fields * len(lines) != len(fields) or ends - {'', '\n'}:
+        raise ValueError('Lines have different number of fields')
+
+    return [fields[i::numb_of_fields] for i in range(numb_of_fields - 1)]
+
+
+def to_floats(column):
+    """Returns the column (any iterable) of numbers as an array."""
+    return np.array(list(map(float, column)), dtype='float64')
+
+
+def to_matrix(columns):
+    """Returns the columns of numbers as a matrix."""
+    values = to_floats(chain.from_iterable(columns))
+    return values.reshape((len(columns), -1)).T.copy()
+
+
+def load_pitch_marks(pm_f_name):
+    """Returns the array of the pitch mark times loaded from the input file, without the transitional ('T') marks."""
+    times, types = split_fields(read_text(pm_f_name, 'utf-8'), (0, -1))
+    return to_floats([time for time, typ in zip(times, types) if typ != 'T'])
+
+
+def load_mlf(mlf_f_name):
+    """Returns the phonemes and the times of their centers loaded from the MLF file, without its first line."""
+    _, _, text = read_text(mlf_f_name, 'utf-8').partition('\n')
+    starts, stops, phonemes = split_fields(text, (0, 1, 2))
+    start = to_floats(starts) * TIME_STEP
+    stop = to_floats(stops) * TIME_STEP
+
+    return phonemes, (start + stop) / 2
+
+
+def load_unsel_feats(dir, sent_name):
+    """Returns the unsel features for the specified sentence loaded from the given directory: the (time, value)
+    matrices of energy and F0 and the (time, coefficients) matrix of MFCC."""
+    enrg_columns = split_table(read_text(dir / (sent_name + ENRG_SUFFIX)))
+    f0_columns = split_table(read_text(dir / (sent_name + F0_SUFFIX)))
+    mfcc_columns = split_table(read_text(dir / (sent_name + MFCC_SUFFIX)))
+
+    return to_matrix(enrg_columns[0:3:2]), to_matrix(f0_columns[0:3:2]), to_matrix(mfcc_columns)
+
+
+def get_sentence_paths(mlf_dir, pm_dir, unsel_feats_dir, sent_name):
+    """Returns the paths of the parsed source files of the sentence."""
+    return [mlf_dir / (sent_name + ".mlf"), pm_dir / (sent_name + ".pm"), unsel_feats_dir / (sent_name + ENRG_SUFFIX),
+            unsel_feats_dir / (sent_name + F0_SUFFIX), unsel_feats_dir / (sent_name + MFCC_SUFFIX)]
+
+
+def load_sentence_data(mlf_dir, pm_dir, unsel_feats_dir, sent_name, cache_dir=None):
+    """Returns the pitch marks, phonemes, phoneme centers, energy, F0 and MFCC of the sentence.
+
+    If ´cache_dir´ is given, the parsed arrays are stored there and loaded instead of parsing the files again while
+    the files keep their size and modification time."""
+    if cache_dir is not None:
+        stats = [os.stat(path) for path in get_sentence_paths(mlf_dir, pm_dir, unsel_feats_dir, sent_name)]
+        stamps = np.array([[stat.st_size, stat.st_mtime_ns] for stat in stats], dtype='int64')
+        cache_path = cache_dir / (sent_name + ".npz")
+        if os.path.exists(cache_path):
+            with np.load(cache_path) as cached:
+                if np.array_equal(cached['stamps'], stamps):
+                    return (cached['pms'], cached['phonemes'].tolist(), cached['centers'], cached['enrg'],
+                            cached['f0'], cached['mfcc'])
+
+    pms = load_pitch_marks(pm_dir / (sent_name + ".pm"))
+    phonemes, centers = load_mlf(mlf_dir / (sent_name + ".mlf"))
+    enrg, f0, mfcc = load_unsel_feats(unsel_feats_dir, sent_name)
+    if cache_dir is not None:
+        np.savez(cache_path, stamps=stamps, pms=pms, phonemes=np.array(phonemes, dtype='U'), centers=centers,
+                 enrg=enrg, f0=f0, mfcc=mfcc)
+
+    return pms, phonemes, centers, enrg, f0, mfcc
+
+
+def get_sentence(phonemes, centers, pms):
+    """Returns the diphones of the sentence and their start and stop times, the stops aligned to the first pitch mark
+    at or after the phoneme centers."""
+    stops = pms[np.searchsorted(pms, centers)]
+    starts = np.maximum(np.concatenate([[0.0], stops[:-1]]) - FADE_TIME / 2, 0.0)
+    diphones = [last_phoneme + phoneme for last_phoneme, phoneme in zip(['$'] + phonemes[:-1], phonemes)]
+
+    return diphones, starts, stops
+
+
+def get_unsel_feats(times, enrg, f0, mfcc):
+    """Returns the energy, F0 and MFCC coefficients of the first feature frame at or after each of the times."""
+    enrg_in_time = enrg[np.searchsorted(enrg[:, 0], times), 1]
+    f0_in_time = f0[np.searchsorted(f0[:, 0], times), 1]
+    mfcc_in_time = mfcc[np.searchsorted(mfcc[:, 0], times), 1:]
+
+    return enrg_in_time, f0_in_time, mfcc_in_time
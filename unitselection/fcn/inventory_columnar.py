@@ -0,0 +1,367 @@
+"""Columnar diphone inventory"""
+import argparse
+import json
+import os
+import pickle as plk
+import shutil
+import threading
+from collections import OrderedDict
+from collections.abc import Mapping, Sequence
+from pathlib import Path
+
+from unitselection.fcn.constants import *
+from unitselection.fcn.speech_unit import SpeechUnit
+from unitselection.fcn.viterbi import get_substitutions
+
+# Numeric attributes of the speech units stored as columns (one value per unit)
+SCALAR_COLUMNS = ['enrg_start', 'enrg_stop', 'f0_start', 'f0_stop', 'sentence_position']
+# Attributes stored as matrices (one row per unit)
+VECTOR_COLUMNS = ['mfcc_start', 'mfcc_stop']
+# Context phonemes stored as ids into the ´ALPHABET´
+PHONEME_COLUMNS = ['left_phoneme', 'right_phoneme']
+# Source sentence stored as id into the sorted list of sentence names
+SENTENCE_COLUMN = 'sentence'
+# Id of the unknown source sentence (units converted from the pickled inventory)
+NO_SENTENCE_ID = -1
+# Default memory of the loaded diphones of the sharded inventory [B]
+SHARD_CACHE_SIZE = 1 << 28
+
+parser = argparse.ArgumentParser()
+parser.add_argument('hds_data_dir', metavar='HDS_DATA_DIR', type=str,
+                    help='HDS data directory with the pickled inventory to convert')
+
+
+def get_phoneme_id(phoneme):
+    """Returns the id of the context phoneme, ´NO_PHONEME_ID´ if there is none."""
+    return NO_PHONEME_ID if phoneme is None else PHONEME_IDS[phoneme]
+
+
+def get_phoneme(phoneme_id):
+    """Returns the context phoneme of the id, None if there is none."""
+    return None if phoneme_id == NO_PHONEME_ID else ALPHABET[phoneme_id]
+
+
+class DiphoneUnits(Sequence):
+    """Speech units of single diphone backed by the slices of the inventory columns.
+
+    The units are created on access, the columns are available as attributes of the same names."""
+
+    def __init__(self, columns, signals, offsets, sentences):
+        self.columns = columns
+        self.signals = signals
+        self.offsets = offsets
+        self.sentences = sentences
+        for name, column in columns.items():
+            setattr(self, name, column)
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def get_signal(self, i):
+        """Returns the signal of the i-th unit."""
+        return self.signals[self.offsets[i]:self.offsets[i + 1]]
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError('Unit index out of range')
+        unit = SpeechUnit(self.get_signal(i), self.enrg_start[i], self.enrg_stop[i], self.f0_start[i],
+                          self.f0_stop[i], self.mfcc_start[i], self.mfcc_stop[i])
+        unit.sentence_position = self.sentence_position[i]
+        unit.left_phoneme = get_phoneme(self.left_phoneme[i])
+        unit.right_phoneme = get_phoneme(self.right_phoneme[i])
+        if self.sentence[i] != NO_SENTENCE_ID:
+            unit.sentence = self.sentences[self.sentence[i]]
+
+        return unit
+
+
+class ColumnarInventory(Mapping):
+    """Read-only diphone inventory with the signals and features in continuous (possibly memory mapped) arrays.
+
+    Behaves as the dictionary of diphones to the lists of speech units. The ´DiphoneUnits´ of each diphone are created
+    on the first access and kept, so the synthesis reads the feature matrices without any per unit work. The
+    ´substitutions´ give the most similar known diphone of each missing diphone (see ´get_substitutions´), they are
+    computed if not given."""
+
+    def __init__(self, index, columns, signals, offsets, sentences, substitutions=None):
+        self.index = index
+        self.columns = columns
+        self.signals = signals
+        self.offsets = offsets
+        self.sentences = sentences
+        self.substitutions = get_substitutions(index) if substitutions is None else substitutions
+        self.diphones = dict()
+
+    def __getitem__(self, diphone):
+        if diphone not in self.diphones:
+            start, stop = self.index[diphone]
+            columns = {name: column[start:stop] for name, column in self.columns.items()}
+            self.diphones[diphone] = DiphoneUnits(columns, self.signals, self.offsets[start:stop + 1],
+                                                  self.sentences)
+        return self.diphones[diphone]
+
+    def __contains__(self, diphone):
+        return diphone in self.index
+
+    def __iter__(self):
+        return iter(self.index)
+
+    def __len__(self):
+        return len(self.index)
+
+
+class NpyRows:
+    """Reader of the row ranges of the .npy file, the rows are read into memory without mapping the file."""
+
+    def __init__(self, path):
+        self.file = open(path, 'rb')
+        version = np.lib.format.read_magic(self.file)
+        if version == (1, 0):
+            self.shape, _, self.dtype = np.lib.format.read_array_header_1_0(self.file)
+        else:
+            self.shape, _, self.dtype = np.lib.format.read_array_header_2_0(self.file)
+        self.data_offset = self.file.tell()
+        self.row_len = int(np.prod(self.shape[1:]))
+        self.lock = threading.Lock()
+
+    def read(self, start, stop):
+        """Returns the rows from ´start´ to ´stop´."""
+        with self.lock:
+            self.file.seek(self.data_offset + start * self.row_len * self.dtype.itemsize)
+            rows = np.fromfile(self.file, self.dtype, (stop - start) * self.row_len)
+
+        return rows.reshape((stop - start,) + tuple(self.shape[1:]))
+
+    def close(self):
+        """Closes the file."""
+        self.file.close()
+
+
+class ShardedInventory(Mapping):
+    """Read-only diphone inventory of the columnar files, which loads the units of each diphone on the first access.
+
+    The rows of each diphone (its shard) are read into memory, the least recently used diphones are evicted when
+    their total size exceeds ´max_size´ bytes, diphones larger than that are not kept at all. Only the index and the
+    unit offsets are kept all the time, so the memory does not depend on the size of the inventory. The diphones can
+    be accessed from several threads."""
+
+    def __init__(self, inv_dir, max_size=SHARD_CACHE_SIZE):
+        col_dir = inv_dir / COLUMNAR
+        with open(col_dir / COLUMNAR_INDEX, 'r', encoding='utf-8') as fr:
+            index = json.load(fr)
+        self.index = index['diphones']
+        self.sentences = index['sentences']
+        # The substitutions are missing in the index of older inventories
+        substitutions = index.get('substitutions')
+        self.substitutions = get_substitutions(self.index) if substitutions is None else substitutions
+        self.offsets = np.load(col_dir / OFFSETS)
+        self.signals = NpyRows(col_dir / SIGNALS)
+        self.columns = {name: NpyRows(col_dir / (name + ".npy"))
+                        for name in SCALAR_COLUMNS + VECTOR_COLUMNS + PHONEME_COLUMNS + [SENTENCE_COLUMN]}
+        self.max_size = max_size
+        self.diphones = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+
+    def load(self, diphone):
+        """Returns the units of the diphone read from the files."""
+        start, stop = self.index[diphone]
+        columns = {name: column.read(start, stop) for name, column in self.columns.items()}
+        signals = self.signals.read(int(self.offsets[start]), int(self.offsets[stop]))
+
+        return DiphoneUnits(columns, signals, self.offsets[start:stop + 1] - self.offsets[start], self.sentences)
+
+    def __getitem__(self, diphone):
+        with self.lock:
+            if diphone in self.diphones:
+                self.hits += 1
+                self.diphones.move_to_end(diphone)
+                return self.diphones[diphone]
+            self.misses += 1
+        diphone_units = self.load(diphone)
+        size = get_units_size(diphone_units)
+        with self.lock:
+            if diphone in self.diphones or size > self.max_size:
+                return diphone_units
+            self.diphones[diphone] = diphone_units
+            self.size += size
+            while self.size > self.max_size:
+                _, evicted = self.diphones.popitem(last=False)
+                self.size -= get_units_size(evicted)
+                self.evictions += 1
+
+        return diphone_units
+
+    def __contains__(self, diphone):
+        return diphone in self.index
+
+    def __iter__(self):
+        return iter(self.index)
+
+    def __len__(self):
+        return len(self.index)
+
+    def cache_info(self):
+        """Returns the dictionary of the statistics of the loaded diphones."""
+        with self.lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / max(self.hits + self.misses, 1),
+                'evictions': self.evictions,
+                'diphones': len(self.diphones),
+                'size': self.size,
+                'max_size': self.max_size,
+            }
+
+    def close(self):
+        """Closes the files of the inventory."""
+        self.signals.close()
+        for column in self.columns.values():
+            column.close()
+
+
+def get_units_size(diphone_units):
+    """Returns the memory of the arrays of the diphone units loaded by ´ShardedInventory´ [B]."""
+    arrays = list(diphone_units.columns.values()) + [diphone_units.signals, diphone_units.offsets]
+    return sum(array.nbytes for array in arrays)
+
+
+def get_index(inv):
+    """Returns the dictionary of diphones to the (start, stop) ranges of their units."""
+    index = dict()
+    start = 0
+    for diphone, diphone_units in inv.items():
+        index[diphone] = [start, start + len(diphone_units)]
+        start += len(diphone_units)
+
+    return index
+
+
+def get_offsets(units):
+    """Returns the start of each unit signal in the concatenated signals, followed by their total length."""
+    offsets = np.zeros((len(units) + 1,), dtype='int64')
+    offsets[1:] = np.cumsum([len(unit.signal) for unit in units])
+
+    return offsets
+
+
+def get_sentences(units):
+    """Returns the sorted list of the names of the source sentences of the units."""
+    return sorted({unit.sentence for unit in units if getattr(unit, 'sentence', None) is not None})
+
+
+def get_columns(units, sentences):
+    """Returns the dictionary of the feature columns of the units."""
+    columns = dict()
+    for name in SCALAR_COLUMNS:
+        columns[name] = np.array([getattr(unit, name) for unit in units], dtype='float64')
+    mfcc_len = len(units[0].mfcc_start) if units else 0
+    for name in VECTOR_COLUMNS:
+        column = np.array([getattr(unit, name) for unit in units], dtype='float64')
+        columns[name] = column.reshape((len(units), mfcc_len))
+    for name in PHONEME_COLUMNS:
+        columns[name] = np.array([get_phoneme_id(getattr(unit, name)) for unit in units], dtype='int16')
+    sentence_ids = {sentence: i for i, sentence in enumerate(sentences)}
+    columns[SENTENCE_COLUMN] = np.array([sentence_ids.get(getattr(unit, 'sentence', None), NO_SENTENCE_ID)
+                                         for unit in units], dtype='int32')
+
+    return columns
+
+
+def create_columnar_inventory(inv):
+    """Returns the in-memory columnar inventory of the dictionary of diphones to the lists of speech units."""
+    units = [unit for diphone_units in inv.values() for unit in diphone_units]
+    signals = np.concatenate([unit.signal for unit in units]) if units else np.zeros((0,), dtype='float32')
+    sentences = get_sentences(units)
+
+    return ColumnarInventory(get_index(inv), get_columns(units, sentences), signals.astype('float32'),
+                             get_offsets(units), sentences)
+
+
+def save_columnar_inventory(inv, inv_dir):
+    """Saves the inventory given as the dictionary of diphones to the lists of speech units in the columnar format.
+
+    The units of each diphone are stored in a continuous range of rows, the index also gives the substitutions of the
+    missing diphones. The signals are concatenated into single array, the ´offsets´ give the start of each unit
+    signal. The files are written into a temporary directory which then replaces the previous inventory, so the units
+    of the previous inventory can be saved again."""
+    col_dir = inv_dir / (COLUMNAR + ".tmp")
+    if os.path.exists(col_dir):
+        shutil.rmtree(col_dir)
+    os.mkdir(col_dir)
+    units = [unit for diphone_units in inv.values() for unit in diphone_units]
+
+    offsets = get_offsets(units)
+    # The signals are written unit by unit, so they are never held in the memory twice
+    signals = np.lib.format.open_memmap(col_dir / SIGNALS, mode='w+', dtype='float32', shape=(int(offsets[-1]),))
+    for i, unit in enumerate(units):
+        signals[offsets[i]:offsets[i + 1]] = unit.signal
+    signals.flush()
+    del signals
+    np.save(col_dir / OFFSETS, offsets)
+    sentences = get_sentences(units)
+    for name, column in get_columns(units, sentences).items():
+        np.save(col_dir / (name + ".npy"), column)
+
+    with open(col_dir / COLUMNAR_INDEX, 'w', encoding='utf-8') as fw:
+        json.dump({'diphones': get_index(inv), 'sentences': sentences, 'substitutions': get_substitutions(inv)}, fw)
+    # The processes using the previous inventory keep its files mapped until they finish
+    if os.path.exists(inv_dir / COLUMNAR):
+        shutil.rmtree(inv_dir / COLUMNAR)
+    os.rename(col_dir, inv_dir / COLUMNAR)
+
+
+def load_columnar_inventory(inv_dir):
+    """Loads the columnar inventory with all arrays memory mapped, so nothing is read until it is used and the pages
+    are shared by all processes using the same inventory."""
+    col_dir = inv_dir / COLUMNAR
+    with open(col_dir / COLUMNAR_INDEX, 'r', encoding='utf-8') as fr:
+        index = json.load(fr)
+    columns = dict()
+    for name in SCALAR_COLUMNS + VECTOR_COLUMNS + PHONEME_COLUMNS + [SENTENCE_COLUMN]:
+        columns[name] = np.load(col_dir / (name + ".npy"), mmap_mode='r')
+    signals = np.load(col_dir / SIGNALS, mmap_mode='r')
+    offsets = np.load(col_dir / OFFSETS, mmap_mode='r')
+
+    # The substitutions are missing in the index of older inventories
+    return ColumnarInventory(index['diphones'], columns, signals, offsets, index['sentences'],
+                             index.get('substitutions'))
+
+
+def load_sharded_inventory(inv_dir, max_size=SHARD_CACHE_SIZE):
+    """Loads the columnar inventory whose diphones are read on the first access and kept up to ´max_size´ bytes (see
+    ´ShardedInventory´)."""
+    return ShardedInventory(inv_dir, max_size)
+
+
+def get_sentences_units(inv):
+    """Returns the dictionary of the source sentence names to the lists of their (diphone, speech unit) pairs in the
+    order of the sentence."""
+    sentences_units = dict()
+    for diphone in inv:
+        for unit in inv[diphone]:
+            sentences_units.setdefault(unit.sentence, []).append((diphone, unit))
+    for units in sentences_units.values():
+        units.sort(key=lambda pair: pair[1].sentence_position)
+
+    return sentences_units
+
+
+def convert_inventory(inv_dir):
+    """Converts the pickled inventory in the given directory into the columnar format."""
+    with open(inv_dir / INV, 'rb') as fr:
+        inv = plk.load(fr)
+    save_columnar_inventory(inv, inv_dir)
+
+
+if __name__ == '__main__':
+    args = parser.parse_args()
+    convert_inventory(Path(args.hds_data_dir) / PREP)
@@ -1,39 +1,33 @@
 """Diphone inventory assembly"""
 import argparse
-import bisect
 import os
 import pickle as plk
+from functools import partial
+from multiprocessing import Pool
 from pathlib import Path
 
 from scipy.io import wavfile
 
 from unitselection.fcn.constants import *
+from unitselection.fcn.ingest import get_sentence, get_unsel_feats, load_sentence_data
+from unitselection.fcn.inventory_columnar import convert_inventory, create_columnar_inventory, get_sentences_units, \
+    load_columnar_inventory, load_sharded_inventory, save_columnar_inventory
+from unitselection.fcn.join_cache import precompute_join_costs
+from unitselection.fcn.manifest import create_manifest, get_changed_sentences, is_source_changed, load_manifest, \
+    save_manifest
 from unitselection.fcn.prepare_data import split_mlf
 from unitselection.fcn.speech_unit import SpeechUnit
+from unitselection.fcn.viterbi import get_similarity_matrix
+
+# Number of sentences sent to a worker at once
+BUILD_CHUNK_SIZE = 8
 
 parser = argparse.ArgumentParser()
 parser.add_argument('hds_data_dir', metavar='HDS_DATA_DIR', type=str, help='HDS data directory')
-
-
-def get_pitch_marks(pm_f_name):
-    """Returns list of pitch marks loaded from the input file."""
-    pms = []
-    with open(pm_f_name, 'r', encoding='utf-8') as pm_f:
-        for line in pm_f:
-            if line[0] == ' ':
-                line = line[1:]
-            line = line[:-1]
-            items = line.split(' ')
-
-            typ = items[-1]
-            if typ == 'T':
-                continue
-
-            time = float(items[0])
-
-            pms.append((time, typ))
-
-    return pms
+parser.add_argument('--jobs', type=int, help='Number of processes extracting the units of the sentences')
+parser.add_argument('--parse-cache', action='store_true', help='Cache the parsed sentence data in binary form')
+parser.add_argument('--join-costs', metavar='PAIRS', type=int,
+                    help='Precompute the concatenation losses of the given number of the most frequent diphone pairs')
 
 
 def get_signal_cut(signal, start, stop):
@@ -44,14 +38,6 @@ def get_signal_cut(signal, start, stop):
     return np.copy(signal[start_i:stop_i])
 
 
-def nearest_pitchmark(pms, time):
-    """Returns the pitch mark closest to the specified time."""
-    pm_time_i = bisect.bisect_right(pms, (time,))
-    time_pm = pms[pm_time_i][0]
-
-    return time_pm
-
-
 def add_fade(signal):
     """Returns the input signal with smoothed ends (with Hanning window)."""
     win_half = len(WINDOW) // 2
@@ -61,127 +47,111 @@ def add_fade(signal):
     return signal
 
 
-def get_phonem(line):
-    """Return phoneme data parsed from the input line."""
-    line = line[:-1]
-    items = line.split(' ')
-    start = float(items[0]) * TIME_STEP
-    stop = float(items[1]) * TIME_STEP
-    center = (start + stop) / 2
-    phoneme = items[2]
-
-    return phoneme, start, stop, center
-
-
-def get_sentence(mlf_f_name, pms):
-    """Returns sentence data parsed from the input file with support of the given pitch marks."""
-    sentence = []
-    with open(mlf_f_name, 'r', encoding='utf-8') as mlf_f:
-        first_line = True
-        for line in mlf_f:
-            if first_line:
-                last_phoneme = '$'
-                last_center = 0.0
-                first_line = False
-                continue
-            phoneme, _, _, center = get_phonem(line)
-            center = nearest_pitchmark(pms, center)
-            sentence.append((last_phoneme + phoneme, max(last_center - FADE_TIME / 2, 0.0), center))
-            last_center = center
-            last_phoneme = phoneme
-
-    return sentence
-
-
-def load_unsel_feats(dir, sent_name):
-    """Returns the unsel features for the specified sentence loaded from the given directory."""
-    enrg_name = sent_name + ".enrg.txt"
-    f0_name = sent_name + ".f0.txt"
-    mfcc_name = sent_name + ".mfcc.txt"
-    enrg = []
-    f0 = []
-    mfcc = []
-    with open(dir / enrg_name, 'r') as fr:
-        for line in fr:
-            if line[0] != '|':
-                continue
-            line = line[:-1].replace(' ', '')
-            items = line.split('|')
-            enrg.append((float(items[1]), float(items[3])))
-    with open(dir / f0_name, 'r') as fr:
-        for line in fr:
-            if line[0] != '|':
-                continue
-            line = line[:-1].replace(' ', '')
-            items = line.split('|')
-            f0.append((float(items[1]), float(items[3])))
-    with open(dir / mfcc_name, 'r') as fr:
-        for line in fr:
-            if line[0] != '|':
-                continue
-            line = line[:-1].replace(' ', '')
-            items = line.split('|')
-            items = tuple([float(el) for el in items[1:-1]])
-            mfcc.append(items)
-
-    return enrg, f0, mfcc
-
-
-def get_unsel_feats(t, enrg, f0, mfcc):
-    """Returns the unsel features aligned to the pitch mark which is closest to the specified time."""
-    enrg_i = bisect.bisect_right(enrg, (t,))
-    enrg_in_time = enrg[enrg_i][1]
-    f0_i = bisect.bisect_right(f0, (t,))
-    f0_in_time = f0[f0_i][1]
-    mfcc_i = bisect.bisect_right(mfcc, (t,))
-    mfcc_in_time = mfcc[mfcc_i][1:]
-
-    return enrg_in_time, f0_in_time, mfcc_in_time
-
-
-def create_inventory(mlf_dir, pm_dir, spc_dir, inv_f_name, unsel_feats_dir):
-    """Creates the diphone inventory from the given directories."""
+def extract_units(mlf_f_name, mlf_dir, pm_dir, spc_dir, unsel_feats_dir, cache_dir=None):
+    """Returns the list of (diphone, speech unit) pairs extracted from single recorded sentence.
+
+    The parsed sentence data are cached in the ´cache_dir´ if it is given."""
+    # Load relevant data from mlf, pm, spc and unsel_feats directories
+    sent_name = mlf_f_name[:-4]
+    spc_name = sent_name + ".wav"
+    sample_rate, signal = wavfile.read(spc_dir / spc_name)
+    signal = signal.astype('float32')
+    pms, phonemes, centers, enrg, f0, mfcc = load_sentence_data(mlf_dir, pm_dir, unsel_feats_dir, sent_name,
+                                                                cache_dir)
+    diphones, starts, stops = get_sentence(phonemes, centers, pms)
+    # Cut the speech units (diphones) from the signal, the too short ones are skipped
+    kept = []
+    signal_cuts = []
+    for i in range(len(diphones)):
+        signal_cut = get_signal_cut(signal, starts[i], stops[i])
+        if len(signal_cut) <= MIN_LENGTH:
+            continue
+        kept.append(i)
+        signal_cuts.append(add_fade(signal_cut))
+    # Align the starts and stops of all units to the feature frames at once
+    bounds = np.concatenate([starts[kept], stops[kept]])
+    enrg_bounds, f0_bounds, mfcc_bounds = get_unsel_feats(bounds, enrg, f0, mfcc)
+    units = []
+    for j, i in enumerate(kept):
+        # Assembly of speech unit
+        k = j + len(kept)
+        sp_unit = SpeechUnit(signal_cuts[j], enrg_bounds[j], enrg_bounds[k], f0_bounds[j], f0_bounds[k],
+                             mfcc_bounds[j], mfcc_bounds[k])
+        sp_unit.sentence = sent_name
+        sp_unit.sentence_position = i / len(diphones)
+        if i > 0:
+            sp_unit.left_phoneme = diphones[i - 1][0]
+        if i < len(diphones) - 1:
+            sp_unit.right_phoneme = diphones[i + 1][1]
+        units.append((diphones[i], sp_unit))
+
+    return units
+
+
+def map_sentences(func, mlf_files, jobs=None):
+    """Yields the results of the function applied to the sentence files in their order, computed by a pool of ´jobs´
+    processes if given."""
+    if jobs is None:
+        yield from map(func, mlf_files)
+        return
+    with Pool(jobs) as pool:
+        yield from pool.imap(func, mlf_files, BUILD_CHUNK_SIZE)
+
+
+def add_units(inv, units):
+    """Appends the (diphone, speech unit) pairs to the inventory dictionary."""
+    for diphone, sp_unit in units:
+        if diphone not in inv:
+            inv[diphone] = []
+        inv[diphone].append(sp_unit)
+
+
+def get_mlf_files(mlf_dir):
+    """Returns the sorted names of the MLF files of the sentences."""
     _, _, mlf_files = next(os.walk(mlf_dir))
+    return sorted(mlf_files)
+
+
+def save_phonemes_sim(inv_dir):
+    """Saves the phonemes similarity matrix (see ´get_similarity_matrix´)."""
+    np.save(inv_dir / PHON_SIM_MATRIX, get_similarity_matrix(get_phonemes_similarity()))
+
+
+def create_inventory(mlf_dir, pm_dir, spc_dir, inv_f_name, unsel_feats_dir, jobs=None, cache_dir=None):
+    """Creates the diphone inventory from the given directories.
+
+    If ´jobs´ is given, the sentences are processed by a pool of ´jobs´ processes. The units are merged in the order
+    of the sorted sentence names either way, so the inventory is the same as the serial one."""
+    mlf_files = get_mlf_files(mlf_dir)
+    extract = partial(extract_units, mlf_dir=mlf_dir, pm_dir=pm_dir, spc_dir=spc_dir,
+                      unsel_feats_dir=unsel_feats_dir, cache_dir=cache_dir)
+    inv = dict()
+    for units in map_sentences(extract, mlf_files, jobs):
+        add_units(inv, units)
+
+    save_columnar_inventory(inv, inv_f_name)
+    save_phonemes_sim(inv_f_name)
+
+
+def update_inventory(mlf_dir, pm_dir, spc_dir, inv_f_name, unsel_feats_dir, changed, jobs=None, cache_dir=None):
+    """Patches the stored inventory: the units of the ´changed´ (and added) sentences are extracted again, the units
+    of the removed sentences are dropped and the units of the other sentences are kept.
+
+    The units are merged in the order of the sorted sentence names, so the inventory is the same as the full build."""
+    mlf_files = get_mlf_files(mlf_dir)
+    sentences_units = get_sentences_units(load_columnar_inventory(inv_f_name))
+    extract = partial(extract_units, mlf_dir=mlf_dir, pm_dir=pm_dir, spc_dir=spc_dir,
+                      unsel_feats_dir=unsel_feats_dir, cache_dir=cache_dir)
+    changed_files = [mlf_f_name for mlf_f_name in mlf_files if mlf_f_name[:-4] in changed]
+    for mlf_f_name, units in zip(changed_files, map_sentences(extract, changed_files, jobs)):
+        sentences_units[mlf_f_name[:-4]] = units
     inv = dict()
     for mlf_f_name in mlf_files:
-        # Load relevant data from mlf, pm, spc and unsel_feats directories
-        sent_name = mlf_f_name[:-4]
-        pm_name = sent_name + ".pm"
-        spc_name = sent_name + ".wav"
-        sample_rate, signal = wavfile.read(spc_dir / spc_name)
-        signal = signal.astype('float32')
-        pms = get_pitch_marks(pm_dir / pm_name)
-        enrg, f0, mfcc = load_unsel_feats(unsel_feats_dir, sent_name)
-        sentence = get_sentence(mlf_dir / mlf_f_name, pms)
-        # Extract speech units (diphones) from the loaded sentence
-        i = 0
-        for diphone, start, stop in sentence:
-            signal_cut = get_signal_cut(signal, start, stop)
-            if len(signal_cut) <= MIN_LENGTH:
-                i += 1
-                continue
-            signal_cut = add_fade(signal_cut)
-            enrg_start, f0_start, mfcc_start = get_unsel_feats(start, enrg, f0, mfcc)
-            enrg_stop, f0_stop, mfcc_stop = get_unsel_feats(stop, enrg, f0, mfcc)
-            # Assembly of speech unit
-            sp_unit = SpeechUnit(signal_cut, enrg_start, enrg_stop, f0_start, f0_stop, mfcc_start, mfcc_stop)
-            sp_unit.sentence_position = i / len(sentence)
-            if i > 0:
-                left_diphone, _, _ = sentence[i - 1]
-                sp_unit.left_phoneme = left_diphone[0]
-            if i < len(sentence) - 1:
-                right_diphone, _, _ = sentence[i + 1]
-                sp_unit.right_phoneme = right_diphone[1]
-            if diphone not in inv:
-                inv[diphone] = []
-            inv[diphone].append(sp_unit)
-            i += 1
-
-    with open(inv_f_name / INV, 'wb') as fw:
-        plk.dump(inv, fw)
-    phonemes_sim = get_phonemes_similarity()
-    with open(inv_f_name / PHON_SIM, 'wb') as fw:
-        plk.dump(phonemes_sim, fw)
+        add_units(inv, sentences_units.get(mlf_f_name[:-4], []))
+
+    save_columnar_inventory(inv, inv_f_name)
+    if not os.path.exists(inv_f_name / PHON_SIM_MATRIX):
+        save_phonemes_sim(inv_f_name)
 
 
 def get_phonemes_similarity():
@@ -204,36 +174,98 @@ def get_phonemes_similarity():
     return phonemes_sim
 
 
-def load_inventory(dir):
-    """Loads the inventory file."""
+def inventory_exists(dir):
+    """Returns True if the directory contains the inventory and the phonemes similarity file in any format."""
+    has_inventory = os.path.exists(dir / COLUMNAR / COLUMNAR_INDEX) or os.path.exists(dir / INV)
+    return has_inventory and (os.path.exists(dir / PHON_SIM_MATRIX) or os.path.exists(dir / PHON_SIM))
+
+
+def load_inventory(dir, shard_cache_size=None):
+    """Loads the inventory, the columnar one if it exists, otherwise the pickled one converted to the columnar
+    representation in memory.
+
+    If ´shard_cache_size´ is given, the diphones are read on the first access and kept up to that many bytes (see
+    ´ShardedInventory´), a pickled inventory is converted to the columnar files first."""
+    if shard_cache_size is not None:
+        if not os.path.exists(dir / COLUMNAR / COLUMNAR_INDEX):
+            convert_inventory(dir)
+        return load_sharded_inventory(dir, shard_cache_size)
+    if os.path.exists(dir / COLUMNAR / COLUMNAR_INDEX):
+        return load_columnar_inventory(dir)
     with open(dir / INV, 'rb') as fr:
         inv = plk.load(fr)
-    return inv
+    return create_columnar_inventory(inv)
 
 
 def load_phonemes_sim(dir):
-    """Loads the phonemes similarity file."""
+    """Loads the phonemes similarity matrix, the pickled dictionary of an older inventory is converted to it."""
+    if os.path.exists(dir / PHON_SIM_MATRIX):
+        return np.load(dir / PHON_SIM_MATRIX)
     with open(dir / PHON_SIM, 'rb') as fr:
         phonemes_sim = plk.load(fr)
-    return phonemes_sim
+    return get_similarity_matrix(phonemes_sim)
 
 
-def inventory_create(hds_dir):
-    """Creates the speech unit dictionary computed from the given ´hds_data´ directory."""
+def inventory_create(hds_dir, jobs=None, parse_cache=False, join_costs=None):
+    """Creates the speech unit dictionary computed from the given ´hds_data´ directory, optionally by a pool of ´jobs´
+    processes. With ´parse_cache´ the parsed sentence data are cached in binary form. With ´join_costs´ the
+    concatenation losses of that many most frequent diphone pairs are precomputed, the number is kept in the
+    manifest so they are computed again after the next builds replacing the inventory.
+
+    The manifest of the source files and build parameters is saved with the inventory. If the inventory was already
+    built with the same parameters, only the sentences whose source files were added, removed or changed since then
+    are processed."""
     mlf_dir = hds_dir / MLF
+    inv_dir = hds_dir / PREP
+    old_manifest = load_manifest(inv_dir / MANIFEST)
     if not os.path.exists(mlf_dir):
         os.mkdir(mlf_dir)
         split_mlf(hds_dir)
+    elif old_manifest is not None and os.path.exists(hds_dir / ORIG_MLF) and \
+            is_source_changed(hds_dir, ORIG_MLF, old_manifest):
+        # The split files of the sentences removed from the original MLF would be built again otherwise
+        f_names = split_mlf(hds_dir)
+        for mlf_f_name in get_mlf_files(mlf_dir):
+            if mlf_f_name not in f_names:
+                os.remove(mlf_dir / mlf_f_name)
     pm_dir = hds_dir / PM
     spc_dir = hds_dir / SPC
-    inv_dir = hds_dir / PREP
     if not os.path.exists(inv_dir):
         os.mkdir(inv_dir)
     unsel_feats_dir = hds_dir / UNS_FT
-
-    create_inventory(mlf_dir, pm_dir, spc_dir, inv_dir, unsel_feats_dir)
+    cache_dir = None
+    if parse_cache:
+        cache_dir = inv_dir / PARSED
+        if not os.path.exists(cache_dir):
+            os.mkdir(cache_dir)
+
+    sent_names = [mlf_f_name[:-4] for mlf_f_name in get_mlf_files(mlf_dir)]
+    manifest = create_manifest(hds_dir, sent_names, old_manifest)
+    if join_costs is None and old_manifest is not None:
+        join_costs = old_manifest.get('join_costs')
+    if join_costs is not None:
+        manifest['join_costs'] = join_costs
+    if old_manifest is None or old_manifest['params'] != manifest['params'] or \
+            not os.path.exists(inv_dir / COLUMNAR / COLUMNAR_INDEX):
+        create_inventory(mlf_dir, pm_dir, spc_dir, inv_dir, unsel_feats_dir, jobs, cache_dir)
+    else:
+        changed = get_changed_sentences(manifest, old_manifest)
+        if changed or sent_names != old_manifest['sentences']:
+            update_inventory(mlf_dir, pm_dir, spc_dir, inv_dir, unsel_feats_dir, changed, jobs, cache_dir)
+    save_manifest(inv_dir / MANIFEST, manifest)
+    if join_costs is not None:
+        precompute_join_costs(inv_dir, join_costs)
+
+
+def inventory_prepare(hds_dir):
+    """Updates the inventory of the ´hds_data´ directory by ´inventory_create´ if it was built with the manifest and
+    its sources are present. Otherwise the existing inventory is used as it is and only the missing one is created."""
+    inv_dir = hds_dir / PREP
+    has_sources = os.path.exists(hds_dir / ORIG_MLF) or os.path.exists(hds_dir / MLF)
+    if not inventory_exists(inv_dir) or (has_sources and os.path.exists(inv_dir / MANIFEST)):
+        inventory_create(hds_dir)
 
 
 if __name__ == '__main__':
     args = parser.parse_args()
-    inventory_create(Path(args.hds_data_dir))
+    inventory_create(Path(args.hds_data_dir), args.jobs, args.parse_cache, args.join_costs)
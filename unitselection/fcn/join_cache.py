@@ -0,0 +1,196 @@
+"""Cache of the concatenation loss matrices of diphone pairs"""
+import argparse
+import json
+import os
+import shutil
+import threading
+from collections import Counter, OrderedDict
+from pathlib import Path
+
+from unitselection.fcn.inventory_columnar import NO_SENTENCE_ID, SENTENCE_COLUMN, load_columnar_inventory
+from unitselection.fcn.manifest import load_manifest, save_manifest
+from unitselection.fcn.viterbi import *
+
+# Default memory of the cached matrices [B]
+JOIN_CACHE_SIZE = 1 << 28
+# Default number of the most frequent diphone pairs of the corpus precomputed on the disk
+NUMB_OF_PRECOMPUTED = 1000
+# File with the loss parameters the stored matrices were computed with
+JOIN_COSTS_PARAMS = "params.json"
+
+parser = argparse.ArgumentParser()
+parser.add_argument('hds_data_dir', metavar='HDS_DATA_DIR', type=str, help='HDS data directory with the inventory')
+parser.add_argument('--pairs', type=int, default=NUMB_OF_PRECOMPUTED,
+                    help='Number of the most frequent diphone pairs to precompute')
+
+
+def get_join_cost_params():
+    """Returns the parameters the concatenation loss matrices depend on."""
+    return {'ENRG_WEIGHT': ENRG_WEIGHT, 'F0_WEIGHT': F0_WEIGHT, 'MFCC_WEIGHT': MFCC_WEIGHT, 'LOSS_DTYPE': LOSS_DTYPE}
+
+
+def get_pair_file_name(prev_diphone, this_diphone):
+    """Returns the file name of the stored matrix of the diphone pair (the diphones are hex encoded, as the phonemes
+    differ in case only)."""
+    return (prev_diphone + '_' + this_diphone).encode('utf-8').hex() + ".npy"
+
+
+def get_pair_size(inv, prev_diphone, this_diphone):
+    """Returns the size of the concatenation loss matrix of the diphone pair [B]."""
+    return get_matrix_size(inv[prev_diphone], inv[this_diphone])
+
+
+def get_matrix_size(prev_alternatives, this_alternatives):
+    """Returns the size of the concatenation loss matrix of all alternatives of two diphones [B]."""
+    return len(prev_alternatives) * len(this_alternatives) * np.dtype(LOSS_DTYPE).itemsize
+
+
+class JoinCostCache:
+    """LRU cache of the concatenation loss matrices of all alternatives of diphone pairs of single inventory.
+
+    The matrices are kept until their total size exceeds ´max_size´ bytes, larger matrices are not cached at all. If
+    ´cache_dir´ is given, the matrices missing in the memory are looked up there (see ´precompute_join_costs´)."""
+
+    def __init__(self, inv, max_size=JOIN_CACHE_SIZE, cache_dir=None):
+        self.inv = inv
+        self.max_size = max_size
+        self.cache_dir = cache_dir
+        self.matrices = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+
+    def load(self, prev_diphone, this_diphone):
+        """Returns the matrix of the diphone pair stored on the disk, None if there is none."""
+        if self.cache_dir is None:
+            return None
+        path = self.cache_dir / get_pair_file_name(prev_diphone, this_diphone)
+        if not os.path.exists(path):
+            return None
+
+        return np.load(path)
+
+    def get(self, prev_diphone, this_diphone, compute=True, alternatives=None):
+        """Returns the concatenation loss matrix of all alternatives of the diphone pair, None if it is larger than
+        the cache. If ´compute´ is False, the matrix which is neither in the memory nor on the disk is not computed
+        and None is returned. The (previous, this) ´alternatives´ are looked up in the inventory if they are not
+        given."""
+        key = (prev_diphone, this_diphone)
+        with self.lock:
+            if key in self.matrices:
+                self.hits += 1
+                self.matrices.move_to_end(key)
+                return self.matrices[key]
+        if alternatives is None:
+            alternatives = (self.inv[prev_diphone], self.inv[this_diphone])
+        if get_matrix_size(*alternatives) > self.max_size:
+            with self.lock:
+                self.misses += 1
+            return None
+        loss_mat = self.load(prev_diphone, this_diphone)
+        with self.lock:
+            if loss_mat is None:
+                self.misses += 1
+            else:
+                self.disk_hits += 1
+        if loss_mat is None:
+            if not compute:
+                return None
+            loss_mat = get_blocked_pair_concat_loss(*alternatives)
+        self.put(key, loss_mat)
+
+        return loss_mat
+
+    def put(self, key, loss_mat):
+        """Stores the matrix and evicts the least recently used ones over the size limit."""
+        with self.lock:
+            if key in self.matrices:
+                return
+            self.matrices[key] = loss_mat
+            self.size += loss_mat.nbytes
+            while self.size > self.max_size:
+                _, evicted = self.matrices.popitem(last=False)
+                self.size -= evicted.nbytes
+                self.evictions += 1
+
+    def cache_info(self):
+        """Returns the dictionary of the cache statistics."""
+        with self.lock:
+            lookups = self.hits + self.disk_hits + self.misses
+            return {
+                'hits': self.hits,
+                'disk_hits': self.disk_hits,
+                'misses': self.misses,
+                'hit_rate': (self.hits + self.disk_hits) / max(lookups, 1),
+                'evictions': self.evictions,
+                'matrices': len(self.matrices),
+                'size': self.size,
+                'max_size': self.max_size,
+            }
+
+
+def get_frequent_pairs(inv, numb_of_pairs):
+    """Returns the most frequent pairs of consecutive diphones in the source sentences of the columnar inventory."""
+    diphones = list(inv.index)
+    counts = [stop - start for start, stop in inv.index.values()]
+    # The rows of the columns are ordered by the diphones, the units of each sentence are ordered by the position
+    diphone_ids = np.repeat(np.arange(len(diphones)), counts)
+    sentence_ids = np.asarray(inv.columns[SENTENCE_COLUMN])
+    order = np.lexsort((np.asarray(inv.columns['sentence_position']), sentence_ids))
+    diphone_ids = diphone_ids[order]
+    sentence_ids = sentence_ids[order]
+    consecutive = np.flatnonzero((sentence_ids[1:] == sentence_ids[:-1]) & (sentence_ids[1:] != NO_SENTENCE_ID))
+    pairs = Counter(zip(diphone_ids[consecutive].tolist(), diphone_ids[consecutive + 1].tolist()))
+
+    return [(diphones[prev_id], diphones[this_id]) for (prev_id, this_id), _ in pairs.most_common(numb_of_pairs)]
+
+
+def get_join_cost_dir(inv_dir):
+    """Returns the directory of the precomputed matrices of the columnar inventory, None if there are none or they
+    were computed with other loss parameters."""
+    cache_dir = inv_dir / COLUMNAR / JOIN_COSTS
+    if not os.path.exists(cache_dir / JOIN_COSTS_PARAMS):
+        return None
+    with open(cache_dir / JOIN_COSTS_PARAMS, 'r', encoding='utf-8') as fr:
+        if json.load(fr) != get_join_cost_params():
+            return None
+
+    return cache_dir
+
+
+def precompute_join_costs(inv_dir, numb_of_pairs=NUMB_OF_PRECOMPUTED, max_size=JOIN_CACHE_SIZE):
+    """Stores the matrices of the most frequent diphone pairs of the columnar inventory (up to ´max_size´ bytes each)
+    in its directory, so they are replaced together with the inventory."""
+    inv = load_columnar_inventory(inv_dir)
+    cache_dir = inv_dir / COLUMNAR / JOIN_COSTS
+    if get_join_cost_dir(inv_dir) is None:
+        if os.path.exists(cache_dir):
+            shutil.rmtree(cache_dir)
+        os.mkdir(cache_dir)
+    for prev_diphone, this_diphone in get_frequent_pairs(inv, numb_of_pairs):
+        path = cache_dir / get_pair_file_name(prev_diphone, this_diphone)
+        if os.path.exists(path) or get_pair_size(inv, prev_diphone, this_diphone) > max_size:
+            continue
+        np.save(path, get_blocked_pair_concat_loss(inv[prev_diphone], inv[this_diphone]))
+    with open(cache_dir / JOIN_COSTS_PARAMS, 'w', encoding='utf-8') as fw:
+        json.dump(get_join_cost_params(), fw)
+
+
+def create_join_cache(inv, inv_dir=None, max_size=JOIN_CACHE_SIZE):
+    """Returns the join cost cache of the inventory, using the matrices precomputed in ´inv_dir´ if there are any."""
+    cache_dir = None if inv_dir is None else get_join_cost_dir(inv_dir)
+    return JoinCostCache(inv, max_size, cache_dir)
+
+
+if __name__ == '__main__':
+    args = parser.parse_args()
+    inv_dir = Path(args.hds_data_dir) / PREP
+    precompute_join_costs(inv_dir, args.pairs)
+    # The matrices are computed again after the inventory is rebuilt
+    manifest = load_manifest(inv_dir / MANIFEST)
+    if manifest is not None:
+        manifest['join_costs'] = args.pairs
+        save_manifest(inv_dir / MANIFEST, manifest)
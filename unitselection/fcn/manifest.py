@@ -0,0 +1,93 @@
+"""Inventory source manifest"""
+import hashlib
+import json
+import os
+
+from unitselection.fcn.constants import *
+
+# Size of the blocks the files are hashed by [B]
+HASH_BLOCK_SIZE = 1 << 20
+
+
+def get_build_params():
+    """Returns the parameters the extracted units depend on."""
+    return {'FADE_TIME': FADE_TIME, 'MIN_LENGTH': float(MIN_LENGTH)}
+
+
+def get_sentence_files(sent_name):
+    """Returns the paths of the source files of the sentence relative to the HDS data directory."""
+    files = [MLF + "/" + sent_name + ".mlf", PM + "/" + sent_name + ".pm", SPC + "/" + sent_name + ".wav"]
+    files += [UNS_FT + "/" + sent_name + suffix for suffix in [ENRG_SUFFIX, F0_SUFFIX, MFCC_SUFFIX]]
+
+    return files
+
+
+def get_file_hash(path):
+    """Returns the SHA-256 hash of the file content."""
+    file_hash = hashlib.sha256()
+    with open(path, 'rb') as fr:
+        for block in iter(lambda: fr.read(HASH_BLOCK_SIZE), b''):
+            file_hash.update(block)
+
+    return file_hash.hexdigest()
+
+
+def get_file_record(hds_dir, rel_path, old_record=None):
+    """Returns the modification time, size and hash of the file.
+
+    The hash of the old record is reused if the modification time and size did not change."""
+    stat = os.stat(hds_dir / rel_path)
+    record = {'mtime': stat.st_mtime_ns, 'size': stat.st_size}
+    if old_record is not None and old_record['mtime'] == record['mtime'] and old_record['size'] == record['size']:
+        record['hash'] = old_record['hash']
+    else:
+        record['hash'] = get_file_hash(hds_dir / rel_path)
+
+    return record
+
+
+def create_manifest(hds_dir, sent_names, old_manifest=None):
+    """Returns the manifest of the build parameters and the source files of the given sentences."""
+    old_files = dict() if old_manifest is None else old_manifest['files']
+    rel_paths = [ORIG_MLF] if os.path.exists(hds_dir / ORIG_MLF) else []
+    for sent_name in sent_names:
+        rel_paths += get_sentence_files(sent_name)
+    files = {rel_path: get_file_record(hds_dir, rel_path, old_files.get(rel_path)) for rel_path in rel_paths}
+
+    return {'params': get_build_params(), 'sentences': list(sent_names), 'files': files}
+
+
+def is_file_changed(rel_path, manifest, old_manifest):
+    """Returns True if the file is new or its content differs from the old manifest."""
+    old_record = old_manifest['files'].get(rel_path)
+    return old_record is None or old_record['hash'] != manifest['files'][rel_path]['hash']
+
+
+def is_source_changed(hds_dir, rel_path, old_manifest):
+    """Returns True if the file content differs from the old manifest, or the file is not in it."""
+    old_record = old_manifest['files'].get(rel_path)
+    return old_record is None or get_file_record(hds_dir, rel_path, old_record)['hash'] != old_record['hash']
+
+
+def get_changed_sentences(manifest, old_manifest):
+    """Returns the set of the sentences which are new or any of their source files changed."""
+    changed = set()
+    for sent_name in manifest['sentences']:
+        if any(is_file_changed(rel_path, manifest, old_manifest) for rel_path in get_sentence_files(sent_name)):
+            changed.add(sent_name)
+
+    return changed
+
+
+def load_manifest(path):
+    """Loads the manifest, or returns None if there is none."""
+    if not os.path.exists(path):
+        return None
+    with open(path, 'r', encoding='utf-8') as fr:
+        return json.load(fr)
+
+
+def save_manifest(path, manifest):
+    """Saves the manifest."""
+    with open(path, 'w', encoding='utf-8') as fw:
+        json.dump(manifest, fw, indent=1)
@@ -0,0 +1,146 @@
+"""Synthesis instrumentation"""
+import json
+import threading
+import time
+from collections import Counter, deque
+
+# Synthesis stages in the order of ´synthetize_sentence´
+STAGES = ['diphones', 'target', 'join', 'dp', 'backtrack', 'concat', 'wav']
+# Prefix of the names of the Prometheus metrics
+METRICS_PREFIX = 'unitselection_'
+# Output formats of ´SynthesisMetrics´
+METRICS_FORMATS = ['jsonl', 'prometheus']
+
+
+class SentenceMetrics:
+    """Metrics of single synthetized sentence: the time of each stage, the number of the candidates of each searched
+    diphone, the size of the largest concatenation loss matrix, the substituted and dropped diphones and the bytes of
+    the synthetized signal.
+
+    The stage times are measured by laps, each ´lap´ adds the time since the previous one (or ´start´) to the stage."""
+
+    def __init__(self, line):
+        self.line = line
+        self.stages = dict()
+        self.candidates = []
+        self.max_join_matrix = 0
+        self.substituted = []
+        self.dropped = []
+        self.audio_bytes = 0
+        self.last = time.perf_counter()
+
+    def start(self):
+        """Starts the measurement of the next stage, the time since the previous lap is not counted."""
+        self.last = time.perf_counter()
+
+    def lap(self, stage):
+        """Adds the time since the previous lap to the stage."""
+        now = time.perf_counter()
+        self.stages[stage] = self.stages.get(stage, 0.0) + now - self.last
+        self.last = now
+
+    def add_join_matrix(self, loss_mat):
+        """Records the size of the concatenation loss matrix."""
+        self.max_join_matrix = max(self.max_join_matrix, loss_mat.nbytes)
+
+    def as_dict(self):
+        """Returns the metrics as a dictionary."""
+        return {
+            'line': self.line,
+            'seconds': sum(self.stages.values()),
+            'stages': self.stages,
+            'diphones': len(self.candidates),
+            'candidates': self.candidates,
+            'max_join_matrix': self.max_join_matrix,
+            'substituted': self.substituted,
+            'dropped': self.dropped,
+            'audio_bytes': self.audio_bytes,
+        }
+
+
+class SynthesisMetrics:
+    """Collects the metrics of the synthetized sentences (see ´SentenceMetrics´) and their totals.
+
+    Only the last ´max_records´ sentences are kept (all if None), the totals cover all of them. Each record is also
+    passed to the optional ´callback´ as a dictionary. The sentences can be added from several threads."""
+
+    def __init__(self, callback=None, max_records=None):
+        self.callback = callback
+        self.records = deque(maxlen=max_records)
+        self.sentences = 0
+        self.seconds = 0.0
+        self.max_seconds = 0.0
+        self.stages = dict.fromkeys(STAGES, 0.0)
+        self.diphones = 0
+        self.candidates = 0
+        self.max_join_matrix = 0
+        self.substituted = Counter()
+        self.dropped = Counter()
+        self.audio_bytes = 0
+        self.lock = threading.Lock()
+
+    def add(self, sentence_metrics):
+        """Stores the metrics of the sentence and adds them to the totals."""
+        record = sentence_metrics.as_dict()
+        with self.lock:
+            self.records.append(record)
+            self.sentences += 1
+            self.seconds += record['seconds']
+            self.max_seconds = max(self.max_seconds, record['seconds'])
+            for stage, seconds in record['stages'].items():
+                self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+            self.diphones += record['diphones']
+            self.candidates += sum(record['candidates'])
+            self.max_join_matrix = max(self.max_join_matrix, record['max_join_matrix'])
+            self.substituted.update(record['substituted'])
+            self.dropped.update(record['dropped'])
+            self.audio_bytes += record['audio_bytes']
+            # The callback is serialized, so it can write into a shared file
+            if self.callback is not None:
+                self.callback(record)
+
+    def to_json_lines(self):
+        """Returns the kept records as JSON lines, one sentence per line."""
+        with self.lock:
+            return ''.join(json.dumps(record, ensure_ascii=False) + '\n' for record in self.records)
+
+    def to_prometheus(self):
+        """Returns the totals in the Prometheus text format."""
+        with self.lock:
+            metrics = [
+                ('sentences_total', 'counter', 'Synthetized sentences', [('', self.sentences)]),
+                ('seconds_total', 'counter', 'Synthesis time [s]', [('', self.seconds)]),
+                ('max_sentence_seconds', 'gauge', 'Longest synthesis of a sentence [s]', [('', self.max_seconds)]),
+                ('stage_seconds_total', 'counter', 'Synthesis time of each stage [s]',
+                 [(get_labels(stage=stage), seconds) for stage, seconds in self.stages.items()]),
+                ('diphones_total', 'counter', 'Searched diphones', [('', self.diphones)]),
+                ('candidates_total', 'counter', 'Searched candidates of all diphones', [('', self.candidates)]),
+                ('max_join_matrix_bytes', 'gauge', 'Largest concatenation loss matrix [B]',
+                 [('', self.max_join_matrix)]),
+                ('substituted_diphones_total', 'counter', 'Diphones missing in the inventory replaced by similar ones',
+                 [(get_labels(diphone=diphone), count) for diphone, count in sorted(self.substituted.items())]),
+                ('dropped_diphones_total', 'counter', 'Diphones missing in the inventory without a replacement',
+                 [(get_labels(diphone=diphone), count) for diphone, count in sorted(self.dropped.items())]),
+                ('audio_bytes_total', 'counter', 'Synthetized signal [B]', [('', self.audio_bytes)]),
+            ]
+        lines = []
+        for name, metric_type, description, samples in metrics:
+            lines.append('# HELP {0}{1} {2}'.format(METRICS_PREFIX, name, description))
+            lines.append('# TYPE {0}{1} {2}'.format(METRICS_PREFIX, name, metric_type))
+            for labels, value in samples:
+                lines.append('{0}{1}{2} {3}'.format(METRICS_PREFIX, name, labels, value))
+
+        return '\n'.join(lines) + '\n'
+
+    def dump(self, metrics_format='jsonl'):
+        """Returns the metrics in the given format (see ´METRICS_FORMATS´)."""
+        if metrics_format == 'prometheus':
+            return self.to_prometheus()
+        return self.to_json_lines()
+
+
+def get_labels(**labels):
+    """Returns the Prometheus labels of the sample."""
+    values = ['{0}="{1}"'.format(name, value.replace('\\', '\\\\').replace('"', '\\"'))
+              for name, value in labels.items()]
+    return '{' + ','.join(values) + '}'
@@ -0,0 +1,47 @@
+"""In-memory text to speech pipeline"""
+import io
+
+from scipy.io import wavfile
+
+from phonetrans.fcn.processing import translate
+from unitselection.fcn.concate import get_sentence_lines, stream_sentence, synthetize_sentence
+from unitselection.fcn.metrics import SentenceMetrics
+from unitselection.fcn.viterbi import *
+
+
+def transcribe_text(txt, cache=None):
+    """Returns the lines of the phonetic transcription of the text, one sentence per line, the ´cache´ is the one of
+    ´translate´."""
+    return translate(txt, cache).splitlines()
+
+
+def synthetize_text(txt, inv, phonemes_sim, top_k=TOP_K, beam=BEAM, cache=None, metrics=None):
+    """Yields the synthetized int16 signal of each line of the transcription of the text, the same as the .wav files
+    created by ´synthetize_speech´ from its transcription file, the lines without any phonemes are skipped. The
+    metrics of each sentence are added to the ´metrics´ (see ´SynthesisMetrics´) if they are given."""
+    for line in get_sentence_lines(transcribe_text(txt)):
+        sentence_metrics = None if metrics is None else SentenceMetrics(line)
+        sound = synthetize_sentence(line, inv, phonemes_sim, top_k, beam, cache, sentence_metrics)
+        if metrics is not None:
+            metrics.add(sentence_metrics)
+        yield sound
+
+
+def stream_text(txt, inv, phonemes_sim, lag=STREAM_LAG, top_k=TOP_K, beam=BEAM, cache=None):
+    """Yields the synthetized signal of the text in int16 blocks, sentence by sentence (see ´stream_sentence´)."""
+    for line in get_sentence_lines(transcribe_text(txt)):
+        yield from stream_sentence(line, inv, phonemes_sim, lag, top_k, beam, cache)
+
+
+def get_wav_bytes(sound):
+    """Returns the content of .wav file with the signal."""
+    wav = io.BytesIO()
+    wavfile.write(wav, SAMPLE_RATE, sound)
+    return wav.getvalue()
+
+
+def synthetize_text_wav(txt, inv, phonemes_sim, top_k=TOP_K, beam=BEAM, cache=None, metrics=None):
+    """Returns the content of .wav file with all synthetized sentences of the text."""
+    sounds = list(synthetize_text(txt, inv, phonemes_sim, top_k, beam, cache, metrics))
+    sound = np.concatenate(sounds) if sounds else np.zeros((0,), dtype='int16')
+    return get_wav_bytes(sound)
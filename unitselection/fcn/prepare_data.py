@@ -11,14 +11,19 @@ def is_new_sentence_line(line):
 
 
 def split_mlf(root_dir):
-    """Splits the original MLF file into several files each describing single sentence."""
+    """Splits the original MLF file into several files each describing single sentence, returns the set of their
+    names."""
+    f_names = {"Sentence00001.mlf"}
     with open(root_dir / ORIG_MLF, 'r', encoding='utf-8') as fr:
         fw = open(root_dir / MLF / "Sentence00001.mlf", 'w', encoding='utf-8')
         for line in fr:
             if is_new_sentence_line(line):
                 fw.close()
                 f_name = line[3:16] + ".mlf"
+                f_names.add(f_name)
                 fw = open(root_dir / MLF / f_name, 'w', encoding='utf-8')
             elif is_data_line(line):
                 fw.write(line)
         fw.close()
+
+    return f_names
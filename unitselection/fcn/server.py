@@ -0,0 +1,208 @@
+"""Transcription and synthesis server"""
+import argparse
+import asyncio
+import json
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from urllib.parse import urlsplit
+
+from phonetrans.fcn.processing import translate
+from unitselection.fcn.constants import *
+from unitselection.fcn.inventory_diphone import inventory_prepare, load_inventory, load_phonemes_sim
+from unitselection.fcn.join_cache import create_join_cache
+from unitselection.fcn.metrics import SynthesisMetrics
+from unitselection.fcn.pipeline import synthetize_text_wav
+from unitselection.fcn.viterbi import BEAM, TOP_K, beam_arg, top_k_arg
+
+HOST = '127.0.0.1'
+PORT = 8765
+# Largest accepted request body [B]
+MAX_BODY_SIZE = 1 << 20
+# Number of the last synthetized sentences whose metrics are kept
+METRICS_RECORDS = 1000
+STATUS_TEXTS = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed',
+                413: 'Payload Too Large', 500: 'Internal Server Error', 503: 'Service Unavailable'}
+
+parser = argparse.ArgumentParser()
+parser.add_argument('hds_data_dir', metavar='HDS_DATA_DIR', type=str, nargs='?',
+                    help='HDS data directory, without it only the transcription is served')
+parser.add_argument('--host', type=str, default=HOST, help='Address of the HTTP server')
+parser.add_argument('--port', type=int, default=PORT, help='Port of the HTTP server')
+parser.add_argument('--socket', metavar='PATH', type=str, help='Serve on the Unix socket instead of TCP')
+parser.add_argument('--jobs', type=int, help='Number of threads running the transcription and synthesis')
+parser.add_argument('--top-k', type=top_k_arg, default=TOP_K, help='Number of the candidates searched for each diphone')
+parser.add_argument('--beam', type=beam_arg, default=BEAM, help='Beam of the accumulated loss of the searched units')
+parser.add_argument('--join-cache-size', metavar='BYTES', type=int,
+                    help='Cache the concatenation losses of the diphone pairs up to the given memory')
+parser.add_argument('--shard-cache-size', metavar='BYTES', type=int,
+                    help='Load the diphones of the inventory on the first use and keep them up to the given memory')
+parser.add_argument('--metrics', action='store_true', help='Record the synthesis metrics served by /metrics')
+parser.add_argument('--metrics-log', metavar='PATH', type=str,
+                    help='Record the synthesis metrics and append the ones of each sentence to the JSON lines file')
+
+
+class RequestError(Exception):
+    """Error of the request reported to the client by the HTTP status."""
+
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+class SynthesisServer:
+    """Keeps the inventory and the compiled transcription rules loaded and serves the requests over HTTP.
+
+    Endpoints (the text is sent as the UTF-8 body of a POST request):
+    ´/transcribe´ returns the phonetic transcription as plain text,
+    ´/synthesize´ returns the synthetized speech as WAV,
+    ´/health´ returns the server state as JSON,
+    ´/metrics´ returns the synthesis metrics in the Prometheus text format, if they are recorded (see
+    ´SynthesisMetrics´)."""
+
+    def __init__(self, hds_dir=None, jobs=None, top_k=TOP_K, beam=BEAM, join_cache_size=None, metrics=None,
+                 shard_cache_size=None):
+        self.inv = None
+        self.phonemes_sim = None
+        self.top_k = top_k
+        self.beam = beam
+        self.cache = None
+        self.metrics = metrics
+        if hds_dir is not None:
+            self.inv = load_inventory(hds_dir / PREP, shard_cache_size)
+            self.phonemes_sim = load_phonemes_sim(hds_dir / PREP)
+            if join_cache_size is not None:
+                self.cache = create_join_cache(self.inv, hds_dir / PREP, join_cache_size)
+        self.executor = ThreadPoolExecutor(jobs)
+        self.routes = {
+            '/transcribe': self.transcribe,
+            '/synthesize': self.synthesize,
+        }
+
+    def transcribe(self, txt):
+        """Returns the phonetic transcription of the text."""
+        return translate(txt).encode('utf-8'), 'text/plain; charset=utf-8'
+
+    def synthesize(self, txt):
+        """Returns WAV file with the synthetized sentences of the text."""
+        if self.inv is None:
+            raise RequestError(503, 'Inventory is not loaded')
+        wav = synthetize_text_wav(txt, self.inv, self.phonemes_sim, self.top_k, self.beam, self.cache, self.metrics)
+        return wav, 'audio/wav'
+
+    def health(self):
+        """Returns the server state."""
+        state = {'synthesis': self.inv is not None}
+        if self.cache is not None:
+            state['join_cache'] = self.cache.cache_info()
+        if hasattr(self.inv, 'cache_info'):
+            state['inventory'] = self.inv.cache_info()
+        return json.dumps(state).encode('utf-8'), 'application/json'
+
+    def get_metrics(self):
+        """Returns the synthesis metrics."""
+        if self.metrics is None:
+            raise RequestError(404, 'Metrics are not recorded')
+        return self.metrics.to_prometheus().encode('utf-8'), 'text/plain; version=0.0.4; charset=utf-8'
+
+    async def respond(self, method, path, body):
+        """Returns the status, body and content type of the response to the request."""
+        if path == '/health':
+            return (200, *self.health())
+        if path == '/metrics':
+            return (200, *self.get_metrics())
+        if path not in self.routes:
+            raise RequestError(404, 'Unknown path ' + path)
+        if method != 'POST':
+            raise RequestError(405, 'Use POST')
+        try:
+            txt = body.decode('utf-8')
+        except UnicodeDecodeError:
+            raise RequestError(400, 'Body is not UTF-8 text')
+        # The work runs in the thread pool, so the event loop keeps accepting other requests
+        loop = asyncio.get_running_loop()
+        return (200, *await loop.run_in_executor(self.executor, self.routes[path], txt))
+
+    async def handle(self, reader, writer):
+        """Reads single HTTP request from the connection and writes the response. Unexpected errors of the request
+        are answered by 500 and their traceback is printed."""
+        try:
+            try:
+                try:
+                    method, path, body = await read_request(reader)
+                except (asyncio.IncompleteReadError, ValueError):
+                    raise RequestError(400, 'Malformed request')
+                status, content, content_type = await self.respond(method, path, body)
+            except RequestError as e:
+                status, content, content_type = e.status, str(e).encode('utf-8'), 'text/plain; charset=utf-8'
+            except Exception:
+                traceback.print_exc()
+                status, content, content_type = 500, b'Internal server error', 'text/plain; charset=utf-8'
+            try:
+                writer.write(format_response(status, content, content_type))
+                await writer.drain()
+            except ConnectionError:
+                pass
+        finally:
+            writer.close()
+
+    async def serve(self, host=HOST, port=PORT, socket_path=None):
+        """Serves the requests on the TCP port, or on the Unix socket if its path is given, until cancelled."""
+        if socket_path is None:
+            server = await asyncio.start_server(self.handle, host, port)
+        else:
+            server = await asyncio.start_unix_server(self.handle, socket_path)
+        async with server:
+            await server.serve_forever()
+
+
+async def read_request(reader):
+    """Returns the method, path and body of the HTTP request."""
+    request_line = await reader.readline()
+    method, target, _ = request_line.decode('latin-1').split(' ', 2)
+    headers = dict()
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b'\n', b''):
+            break
+        name, _, value = line.decode('latin-1').partition(':')
+        headers[name.strip().lower()] = value.strip()
+    length = int(headers.get('content-length', 0))
+    if length > MAX_BODY_SIZE:
+        raise RequestError(413, 'Body is larger than {0} B'.format(MAX_BODY_SIZE))
+    body = await reader.readexactly(length)
+
+    return method, urlsplit(target).path, body
+
+
+def format_response(status, content, content_type):
+    """Returns the bytes of the HTTP response."""
+    head = 'HTTP/1.1 {0} {1}\r\nContent-Type: {2}\r\nContent-Length: {3}\r\nConnection: close\r\n\r\n'.format(
+        status, STATUS_TEXTS[status], content_type, len(content))
+
+    return head.encode('latin-1') + content
+
+
+if __name__ == '__main__':
+    args = parser.parse_args()
+    hds_dir = None
+    if args.hds_data_dir is not None:
+        hds_dir = Path(args.hds_data_dir)
+        inventory_prepare(hds_dir)
+    metrics = None
+    metrics_log = None
+    if args.metrics_log is not None:
+        metrics_log = open(args.metrics_log, 'a', encoding='utf-8')
+        metrics = SynthesisMetrics(lambda record: print(json.dumps(record, ensure_ascii=False), file=metrics_log,
+                                                        flush=True), METRICS_RECORDS)
+    elif args.metrics:
+        metrics = SynthesisMetrics(max_records=METRICS_RECORDS)
+    server = SynthesisServer(hds_dir, args.jobs, args.top_k, args.beam, args.join_cache_size, metrics,
+                             args.shard_cache_size)
+    try:
+        asyncio.run(server.serve(args.host, args.port, args.socket))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if metrics_log is not None:
+            metrics_log.close()
@@ -3,6 +3,8 @@ class SpeechUnit:
 
     def __init__(self, signal, enrg_start, enrg_stop, f0_start, f0_stop, mfcc_start, mfcc_stop):
         self.signal = signal
+        # Name of the recorded sentence the unit was cut from
+        self.sentence = None
 
         # Target loss params
         self.left_phoneme = None
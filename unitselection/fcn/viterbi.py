@@ -1,4 +1,6 @@
 """Viterbi algorithm"""
+import argparse
+
 from unitselection.fcn.constants import *
 
 # Viterbi algorithm parameters - weights of different synthesis losses
@@ -7,10 +9,18 @@ SENTENCE_POSITION_WEIGHT = 0.1  # relative position in sentence
 ENRG_WEIGHT = 1.0  # concatenation of energy
 F0_WEIGHT = 1.0  # concatenation of F0
 MFCC_WEIGHT = 0.01  # concatenation of MFCC coefficients
+# Pruning of the search, None disables it (exhaustive search)
+TOP_K = None  # number of the candidates with the lowest target loss kept for each diphone
+BEAM = None  # largest difference of the kept accumulated losses from the best one
+# Concatenation loss computation
+LOSS_DTYPE = 'float32'  # precision of the concatenation loss matrices
+LOSS_BLOCK_SIZE = 1 << 26  # largest memory of the loss matrices of one block of the previous states [B]
+# Number of diphones the streaming synthesis searches ahead of the committed unit
+STREAM_LAG = 8
 
 
 def get_sim_diphone(diphone, inv):
-    """Returns the most similar known diphone."""
+    """Returns the most similar known diphone, None if there is none."""
     phon_1_sims = []
     phon_2_sims = []
     for i, sim_level in enumerate(SIMILARITY[::-1]):
@@ -34,69 +44,86 @@ def get_sim_diphone(diphone, inv):
             if sim_diphone in inv:
                 return sim_diphone
 
-    print(f"Similar diphone not found for {diphone}.")
     return None
 
 
-def get_existing_seq(sentence, inv):
-    """Replaces non existing diphones by relatively similar existing option."""
+def get_substitutions(inv):
+    """Returns the dictionary of all diphones of the ´ALPHABET´ missing in the inventory (or any collection of the
+    diphones) to their most similar known diphones, None if there is none."""
+    substitutions = dict()
+    for phon_1 in ALPHABET:
+        for phon_2 in ALPHABET:
+            if phon_1 + phon_2 not in inv:
+                substitutions[phon_1 + phon_2] = get_sim_diphone(phon_1 + phon_2, inv)
+
+    return substitutions
+
+
+def get_existing_seq(sentence, inv, metrics=None):
+    """Replaces non existing diphones by relatively similar existing option, the ones without it are dropped.
+
+    The replacements are looked up in the ´substitutions´ of the columnar inventory, or searched for other inventories
+    and diphones out of the ´ALPHABET´. The replaced and dropped diphones are recorded by the sentence ´metrics´ (see
+    ´SentenceMetrics´) if they are given."""
+    substitutions = getattr(inv, 'substitutions', dict())
     diphone_seq = []
     for diphone in sentence:
         # Equal diphone
         if diphone in inv:
             diphone_seq.append(diphone)
             continue
-        sim_diphone = get_sim_diphone(diphone, inv)
-        if sim_diphone is not None:
+        if diphone in substitutions:
+            sim_diphone = substitutions[diphone]
+        else:
+            sim_diphone = get_sim_diphone(diphone, inv)
+        if sim_diphone is None:
+            if metrics is not None:
+                metrics.dropped.append(diphone)
+        else:
+            if metrics is not None:
+                metrics.substituted.append(diphone)
             diphone_seq.append(sim_diphone)
 
     return diphone_seq
 
 
-def get_empty_target_loss(sentence, inv):
-    """Returns list of empty target loss vectors."""
-    empty_target_loss = []
-    for diphone in sentence:
-        loss_vect = np.zeros((len(inv[diphone]), 1))
-        empty_target_loss.append(loss_vect)
-
-    return empty_target_loss
-
+def get_similarity_matrix(phonemes_sim):
+    """Returns the dictionary of the phoneme similarity losses as a matrix indexed by the phoneme ids of the real
+    phoneme and the context phoneme of the unit.
 
-def get_pred_state_ref(sentence, inv):
-    """Returns list of empty reference previous state indexes (vectors)."""
-    pred_state_ref = []
-    for diphone in sentence:
-        loss_vect = -np.ones((len(inv[diphone]),)).astype('int32')
-        pred_state_ref.append(loss_vect)
+    The ´NO_PHONEME_ID´ column gives the losses of the units without the context phoneme, the ´NO_PHONEME_ID´ row
+    (sentence ends without the real context) has zero losses."""
+    sim_matrix = np.zeros((NO_PHONEME_ID + 1, NO_PHONEME_ID + 1))
+    for phon_1 in ALPHABET:
+        for phon_2 in ALPHABET + [None]:
+            phon_2_id = NO_PHONEME_ID if phon_2 is None else PHONEME_IDS[phon_2]
+            sim_matrix[PHONEME_IDS[phon_1], phon_2_id] = phonemes_sim[(phon_1, phon_2)]
 
-    return pred_state_ref
+    return sim_matrix
 
 
 def get_target_loss(sentence, inv, phonemes_sim):
-    """Computes the target loss of each alternative element."""
-    target_loss = get_empty_target_loss(sentence, inv)
-    for i, diphone in enumerate(sentence):
-        alternatives = inv[diphone]
-        # Sentence position loss
-        real_sentence_position = i / len(sentence)
-        alter_sentence_positions = np.array(list(map(lambda x: x.sentence_position, alternatives)))
-        target_loss[i] += np.expand_dims(np.abs(alter_sentence_positions - real_sentence_position),
-                                         axis=1) * SENTENCE_POSITION_WEIGHT
-        # Surrounding diphones loss
-        if i > 0:
-            real_left_phoneme = sentence[i - 1][0]
-            alter_left_phonemes = [unit.left_phoneme for unit in alternatives]
-            left_phoneme_losses = [phonemes_sim[(real_left_phoneme, l_ph)] for l_ph in alter_left_phonemes]
-            target_loss[i] += np.expand_dims(np.array(left_phoneme_losses), axis=1) * SURROUNDING_WEIGHT
-
-        if i < len(sentence) - 1:
-            real_right_phoneme = sentence[i + 1][1]
-            alter_right_phonemes = [unit.right_phoneme for unit in alternatives]
-            right_phoneme_losses = [phonemes_sim[(real_right_phoneme, r_ph)] for r_ph in alter_right_phonemes]
-            target_loss[i] += np.expand_dims(np.array(right_phoneme_losses), axis=1) * SURROUNDING_WEIGHT
-
-    return target_loss
+    """Computes the target loss of each alternative element.
+
+    The losses of all alternatives of the sentence are computed at once from the concatenated feature columns, the
+    ´phonemes_sim´ is the matrix of ´get_similarity_matrix´ (or the dictionary it is created from)."""
+    if isinstance(phonemes_sim, dict):
+        phonemes_sim = get_similarity_matrix(phonemes_sim)
+    alternatives = [inv[diphone] for diphone in sentence]
+    lengths = [len(alter) for alter in alternatives]
+    # Sentence position loss
+    real_sentence_positions = np.repeat(np.arange(len(sentence)) / len(sentence), lengths)
+    sentence_positions = np.concatenate([alter.sentence_position for alter in alternatives])
+    target_loss = np.abs(sentence_positions - real_sentence_positions) * SENTENCE_POSITION_WEIGHT
+    # Surrounding diphones loss, the first and last diphones have no real left and right phoneme
+    real_left_phonemes = [NO_PHONEME_ID] + [PHONEME_IDS[diphone[0]] for diphone in sentence[:-1]]
+    left_phonemes = np.concatenate([alter.left_phoneme for alter in alternatives])
+    target_loss += phonemes_sim[np.repeat(real_left_phonemes, lengths), left_phonemes] * SURROUNDING_WEIGHT
+    real_right_phonemes = [PHONEME_IDS[diphone[1]] for diphone in sentence[1:]] + [NO_PHONEME_ID]
+    right_phonemes = np.concatenate([alter.right_phoneme for alter in alternatives])
+    target_loss += phonemes_sim[np.repeat(real_right_phonemes, lengths), right_phonemes] * SURROUNDING_WEIGHT
+
+    return np.split(np.expand_dims(target_loss, axis=1), np.cumsum(lengths)[:-1])
 
 
 def get_empty_concat_loss(sentence, inv):
@@ -111,97 +138,298 @@ def get_empty_concat_loss(sentence, inv):
     return empty_concat_loss
 
 
-def get_f0_loss_mat(prev_alter, this_alter):
-    """Returns F0 concatenation loss."""
-    prev_alter = np.repeat(prev_alter, this_alter.shape[1], axis=1)
-    this_alter = np.repeat(this_alter, prev_alter.shape[0], axis=0)
-    loss_mat = np.abs(prev_alter - this_alter)
+def get_f0_loss_mat(prev_f0, this_f0):
+    """Returns F0 concatenation loss of the F0 vectors of the previous and this alternatives."""
+    prev_f0 = np.asarray(prev_f0, dtype=LOSS_DTYPE)
+    this_f0 = np.asarray(this_f0, dtype=LOSS_DTYPE)
+    loss_mat = np.abs(np.expand_dims(prev_f0, axis=1) - np.expand_dims(this_f0, axis=0))
+
+    return loss_mat * np.asarray(F0_WEIGHT, dtype=LOSS_DTYPE)
+
+
+def get_enrg_loss_mat(prev_enrg, this_enrg):
+    """Returns energy concatenation loss of the energy vectors of the previous and this alternatives."""
+    prev_enrg = np.asarray(prev_enrg, dtype=LOSS_DTYPE)
+    this_enrg = np.asarray(this_enrg, dtype=LOSS_DTYPE)
+    loss_mat = np.abs(np.expand_dims(prev_enrg, axis=1) - np.expand_dims(this_enrg, axis=0))
+
+    return loss_mat * np.asarray(ENRG_WEIGHT, dtype=LOSS_DTYPE)
+
 
-    return loss_mat * F0_WEIGHT
+def get_mfcc_loss_mat(prev_mfcc, this_mfcc):
+    """Returns MFCC coeficients concatenation loss (Euclidean distance) of the MFCC matrices of the previous and this
+    alternatives.
 
+    The squared distances are expanded as ||a||^2 + ||b||^2 - 2 a.b, so the only large operation is the matrix product
+    and no alternatives x alternatives x coefficients tensor is created."""
+    prev_mfcc = np.asarray(prev_mfcc, dtype=LOSS_DTYPE)
+    this_mfcc = np.asarray(this_mfcc, dtype=LOSS_DTYPE)
+    loss_mat = prev_mfcc @ this_mfcc.T
+    loss_mat *= -2
+    loss_mat += np.expand_dims(np.einsum('ij,ij->i', prev_mfcc, prev_mfcc), axis=1)
+    loss_mat += np.expand_dims(np.einsum('ij,ij->i', this_mfcc, this_mfcc), axis=0)
+    # The rounding errors can make the distances of close vectors slightly negative
+    np.maximum(loss_mat, 0, out=loss_mat)
+    np.sqrt(loss_mat, out=loss_mat)
+    loss_mat *= MFCC_WEIGHT
 
-def get_enrg_loss_mat(prev_alter, this_alter):
-    """Returns energy concatenation loss."""
-    prev_alter = np.repeat(prev_alter, this_alter.shape[1], axis=1)
-    this_alter = np.repeat(this_alter, prev_alter.shape[0], axis=0)
-    loss_mat = np.abs(prev_alter - this_alter)
+    return loss_mat
 
-    return loss_mat * ENRG_WEIGHT
 
+def get_pair_concat_loss(prev_alternatives, this_alternatives, prev_candidates=slice(None),
+                         this_candidates=slice(None)):
+    """Computes the concatenation loss matrix of the candidates (indexes or slice) of two consecutive diphones."""
+    # Energy loss
+    loss_mat = get_enrg_loss_mat(prev_alternatives.enrg_stop[prev_candidates],
+                                 this_alternatives.enrg_start[this_candidates])
+    # MFCC loss
+    loss_mat += get_mfcc_loss_mat(prev_alternatives.mfcc_stop[prev_candidates],
+                                  this_alternatives.mfcc_start[this_candidates])
+    # F0 loss
+    loss_mat += get_f0_loss_mat(prev_alternatives.f0_stop[prev_candidates],
+                                this_alternatives.f0_start[this_candidates])
 
-def get_mfcc_loss_mat(prev_alter, this_alter):
-    """Returns MFCC coeficients concatenation loss."""
-    prev_alter = np.repeat(prev_alter, this_alter.shape[1], axis=1)
-    this_alter = np.repeat(this_alter, prev_alter.shape[0], axis=0)
-    loss_mat = prev_alter - this_alter
-    loss_mat = np.square(loss_mat)
-    loss_mat = np.sum(loss_mat, axis=2)
-    loss_mat = np.sqrt(loss_mat)
+    # Total concatenation loss
+    return loss_mat
 
-    return loss_mat * MFCC_WEIGHT
+
+def get_block_rows(numb_of_columns, max_block_size=LOSS_BLOCK_SIZE):
+    """Returns the number of the rows of the loss matrices with the given number of columns whose block does not exceed
+    ´max_block_size´ bytes (but it is at least one)."""
+    row_size = numb_of_columns * 2 * (np.dtype(LOSS_DTYPE).itemsize + np.dtype('float64').itemsize)
+    return max(1, max_block_size // max(row_size, 1))
+
+
+def get_blocked_pair_concat_loss(prev_alternatives, this_alternatives, max_block_size=LOSS_BLOCK_SIZE):
+    """Computes the concatenation loss matrix of all alternatives of two consecutive diphones by blocks of the
+    previous alternatives, so the temporary matrices of no block exceed ´max_block_size´ bytes."""
+    loss_mat = np.empty((len(prev_alternatives), len(this_alternatives)), dtype=LOSS_DTYPE)
+    block_rows = get_block_rows(len(this_alternatives), max_block_size)
+    for start in range(0, len(prev_alternatives), block_rows):
+        stop = min(start + block_rows, len(prev_alternatives))
+        loss_mat[start:stop] = get_pair_concat_loss(prev_alternatives, this_alternatives, slice(start, stop))
+
+    return loss_mat
 
 
 def get_concat_loss(sentence, inv):
     """Computes the concatenation loss for each consecutive diphone pair alternatives."""
     concat_loss = get_empty_concat_loss(sentence, inv)
     for i in range(1, len(sentence)):
-        prev_alternatives = inv[sentence[i - 1]]
-        this_alternatives = inv[sentence[i]]
-        # Energy loss
-        prev_enrg_alter = np.expand_dims(np.array(list(map(lambda x: x.enrg_stop, prev_alternatives))), axis=1)
-        this_enrg_alter = np.expand_dims(np.array(list(map(lambda x: x.enrg_start, this_alternatives))), axis=0)
-        enrg_loss_mat = get_enrg_loss_mat(prev_enrg_alter, this_enrg_alter)
-        # MFCC loss
-        prev_mfcc_alter = np.expand_dims(np.array(list(map(lambda x: x.mfcc_stop, prev_alternatives))), axis=1)
-        this_mfcc_alter = np.expand_dims(np.array(list(map(lambda x: x.mfcc_start, this_alternatives))), axis=0)
-        mfcc_loss_mat = get_mfcc_loss_mat(prev_mfcc_alter, this_mfcc_alter)
-        # F0 loss
-        prev_f0_alter = np.expand_dims(np.array(list(map(lambda x: x.f0_stop, prev_alternatives))), axis=1)
-        this_f0_alter = np.expand_dims(np.array(list(map(lambda x: x.f0_start, this_alternatives))), axis=0)
-        f0_loss_mat = get_f0_loss_mat(prev_f0_alter, this_f0_alter)
-        # Total concatenation loss
-        concat_loss[i - 1] += enrg_loss_mat + f0_loss_mat + mfcc_loss_mat
+        concat_loss[i - 1] += get_pair_concat_loss(inv[sentence[i - 1]], inv[sentence[i]])
 
     return concat_loss
 
 
 def merge_target_and_concat_loss(prev_loss, this_target_loss, this_concat_loss):
-    """Returns added target and concatenation losses."""
-    prev_loss = np.repeat(prev_loss, this_target_loss.shape[1], axis=1)
-    this_target_loss = np.repeat(this_target_loss, prev_loss.shape[0], axis=0)
-
-    return this_concat_loss + prev_loss + this_target_loss
-
-
-def get_optimal_signal(sentence, inv, phonemes_sim):
-    """Computes loss of all possible sequence alternatives and returns the best one."""
+    """Returns added target and concatenation losses, the (column) ´prev_loss´ and (row) ´this_target_loss´ are
+    broadcast to the concatenation loss matrix."""
+    loss = prev_loss + this_target_loss
+    loss += this_concat_loss
+
+    return loss
+
+
+def get_best_transitions(prev_loss, this_target_loss, prev_alternatives, this_alternatives, prev_candidates,
+                         this_candidates, max_block_size=LOSS_BLOCK_SIZE, concat_loss=None, metrics=None):
+    """Returns the best previous state of each state of this diphone and the accumulated loss of the transition.
+
+    The loss matrices are computed by blocks of the previous states so no block exceeds ´max_block_size´ bytes (but
+    has at least one row). The first best state is kept across the blocks, as by ´np.argmin´ of the whole matrix.
+    If the ´concat_loss´ matrix of all alternatives is given, the concatenation losses are taken from it. The sentence
+    ´metrics´ record the time of the concatenation losses (´join´) and of the rest (´dp´)."""
+    block_rows = get_block_rows(len(this_candidates), max_block_size)
+    best_prev_state = np.zeros((len(this_candidates),), dtype='int64')
+    best_loss = np.full((len(this_candidates),), np.inf)
+    for start in range(0, len(prev_candidates), block_rows):
+        stop = min(start + block_rows, len(prev_candidates))
+        if concat_loss is None:
+            this_concat_loss = get_pair_concat_loss(prev_alternatives, this_alternatives,
+                                                    prev_candidates[start:stop], this_candidates)
+        else:
+            this_concat_loss = concat_loss[np.ix_(prev_candidates[start:stop], this_candidates)]
+        if metrics is not None:
+            metrics.lap('join')
+            metrics.add_join_matrix(this_concat_loss)
+        loss = merge_target_and_concat_loss(prev_loss[start:stop], this_target_loss, this_concat_loss)
+        block_best = np.argmin(loss, axis=0)
+        block_loss = loss[block_best, np.arange(len(this_candidates))]
+        better = block_loss < best_loss
+        best_prev_state[better] = block_best[better] + start
+        best_loss[better] = block_loss[better]
+        if metrics is not None:
+            metrics.lap('dp')
+
+    return best_prev_state, best_loss
+
+
+def check_pruning(top_k=None, beam=None):
+    """Raises ValueError if the pruning parameters of the search are out of their range."""
+    if top_k is not None and top_k < 1:
+        raise ValueError('Top k must be at least 1')
+    if beam is not None and not beam >= 0:
+        raise ValueError('Beam must not be negative')
+
+
+def top_k_arg(value):
+    """Returns the ´top_k´ given by the command line argument."""
+    top_k = int(value)
+    if top_k < 1:
+        raise argparse.ArgumentTypeError('must be at least 1')
+    return top_k
+
+
+def beam_arg(value):
+    """Returns the ´beam´ given by the command line argument."""
+    beam = float(value)
+    if not beam >= 0:
+        raise argparse.ArgumentTypeError('must not be negative')
+    return beam
+
+
+def get_candidates(target_loss, top_k=None):
+    """Returns the sorted indexes of the ´top_k´ alternatives with the lowest target loss, all if it is None."""
+    check_pruning(top_k=top_k)
+    if top_k is None or top_k >= len(target_loss):
+        return np.arange(len(target_loss))
+
+    return np.sort(np.argpartition(target_loss[:, 0], top_k - 1)[:top_k])
+
+
+def get_beam(cum_loss, beam=None):
+    """Returns the indexes of the states whose accumulated loss is within the ´beam´ from the best one."""
+    check_pruning(beam=beam)
+    if beam is None:
+        return np.arange(len(cum_loss))
+
+    return np.flatnonzero(cum_loss[:, 0] <= np.min(cum_loss) + beam)
+
+
+def get_ancestors(pred_state_ref, stop, start):
+    """Returns the state at the position ´start´ on the best path to each state at the position ´stop´."""
+    ancestors = np.arange(len(pred_state_ref[stop]))
+    for i in range(stop, start, -1):
+        ancestors = pred_state_ref[i][ancestors]
+
+    return ancestors
+
+
+def iter_optimal_units(sentence, inv, phonemes_sim, lag=None, top_k=TOP_K, beam=BEAM, cache=None, metrics=None,
+                       alternatives=None):
+    """Computes loss of the sequence alternatives and yields the (diphone, index of the best unit, accumulated loss of
+    the sequence up to the unit) triples of the searched diphones.
+
+    With ´lag´ the unit of each diphone is committed (and yielded) as soon as the forward pass gets ´lag´ diphones
+    further, it is the unit on the best path to the best state there. The paths not passing through the committed
+    units are then dropped, so the yielded sequence is consistent, but its loss can be higher than the one of the
+    whole sentence search. Without ´lag´ all units are yielded after the whole sentence is searched.
+
+    With ´top_k´ only that many candidates with the lowest target loss are considered for each diphone, with ´beam´
+    the states whose accumulated loss exceeds the best one by more than the beam are not extended. The concatenation
+    loss matrices are computed step by step for the kept candidates only, so the time of each step is bounded by
+    ´top_k´ squared, and by blocks of at most ´LOSS_BLOCK_SIZE´ bytes. If the ´cache´ (see ´JoinCostCache´) is given,
+    the concatenation losses of the diphone pairs are taken from it, the pairs with pruned candidates only use the
+    matrices it already stores.
+
+    The optional sentence ´metrics´ (see ´SentenceMetrics´) record the time of each stage of the search, the number
+    of the candidates of each diphone, the largest concatenation loss matrix and the missing diphones. The time the
+    caller spends between the yielded units is not counted.
+
+    Each searched diphone is looked up in the inventory only once, its units are stored in the ´alternatives´
+    dictionary (if given), so the caller can take the signals of the yielded units from it."""
+    if lag is not None and lag < 1:
+        raise ValueError('Lag must be at least 1')
+    check_pruning(top_k, beam)
     # Prepare the sentence and compute marginal losses
-    sentence = get_existing_seq(sentence, inv)
-    target_loss = get_target_loss(sentence, inv, phonemes_sim)
-    concat_loss = get_concat_loss(sentence, inv)
-    cum_loss = get_empty_target_loss(sentence, inv)
-    pred_state_ref = get_pred_state_ref(sentence, inv)
-    cum_loss[0] += target_loss[0]
+    sentence = get_existing_seq(sentence, inv, metrics)
+    if metrics is not None:
+        metrics.lap('diphones')
+    if not sentence:
+        return
+    # The sharded inventory reads the diphones larger than its cache on every lookup
+    if alternatives is None:
+        alternatives = dict()
+    for diphone in sentence:
+        if diphone not in alternatives:
+            alternatives[diphone] = inv[diphone]
+    target_loss = get_target_loss(sentence, alternatives, phonemes_sim)
+    candidates = [get_candidates(loss, top_k) for loss in target_loss]
+    if metrics is not None:
+        metrics.candidates.extend(len(diphone_candidates) for diphone_candidates in candidates)
+        metrics.lap('target')
+    cum_loss = [np.zeros((len(candidates[i]), 1)) for i in range(len(sentence))]
+    pred_state_ref = [-np.ones((len(candidates[i]),)).astype('int32') for i in range(len(sentence))]
+    cum_loss[0] += target_loss[0][candidates[0]]
+    active = get_beam(cum_loss[0], beam)
+    committed = 0
     # Compute the accumulated loss (Viterbi algorithm)
     for i in range(1, len(target_loss)):
-        prev_loss = cum_loss[i - 1]
-        this_target_loss = np.transpose(target_loss[i])
-        this_concat_loss = concat_loss[i - 1]
-        loss = merge_target_and_concat_loss(prev_loss, this_target_loss, this_concat_loss)
-        best_prev_state = np.argmin(loss, axis=0)
-        pred_state_ref[i] *= -best_prev_state
-        cum_loss[i] += np.expand_dims(loss[list(best_prev_state), [*range(this_target_loss.size)]], axis=1)
-
-    # The best sequence assembly (in backwards)
-    signal = []
-    last_diphone = sentence[-1]
+        prev_loss = cum_loss[i - 1][active]
+        this_target_loss = np.transpose(target_loss[i][candidates[i]])
+        if metrics is not None:
+            metrics.lap('dp')
+        prev_alternatives = alternatives[sentence[i - 1]]
+        this_alternatives = alternatives[sentence[i]]
+        concat_loss = None
+        if cache is not None:
+            # The matrix of all alternatives is not computed for the pruned candidates, only the stored one is used
+            pruned = len(candidates[i - 1]) < len(prev_alternatives) or len(candidates[i]) < len(this_alternatives)
+            concat_loss = cache.get(sentence[i - 1], sentence[i], not pruned, (prev_alternatives, this_alternatives))
+        best_prev_state, best_loss = get_best_transitions(prev_loss, this_target_loss, prev_alternatives,
+                                                          this_alternatives, candidates[i - 1][active], candidates[i],
+                                                          concat_loss=concat_loss, metrics=metrics)
+        pred_state_ref[i] *= -active[best_prev_state]
+        cum_loss[i] += np.expand_dims(best_loss, axis=1)
+        if lag is not None and i - lag >= committed:
+            # Commit the unit on the best path so far and drop the paths not passing through it
+            ancestors = get_ancestors(pred_state_ref, i, committed)
+            best_state = ancestors[np.argmin(cum_loss[i])]
+            cum_loss[i][ancestors != best_state] = np.inf
+            if metrics is not None:
+                metrics.lap('backtrack')
+            yield sentence[committed], int(candidates[committed][best_state]), float(cum_loss[committed][best_state, 0])
+            if metrics is not None:
+                metrics.start()
+            # The losses and references behind the committed unit are not needed anymore
+            cum_loss[committed] = None
+            pred_state_ref[committed + 1] = None
+            committed += 1
+        active = get_beam(cum_loss[i], beam)
+
+    if metrics is not None:
+        metrics.lap('dp')
+    # The best sequence assembly of the rest of the units (in backwards)
     best_last_i = np.argmin(cum_loss[-1])
-    signal.append(inv[last_diphone][best_last_i].signal)
-    for i in range(len(target_loss) - 2, -1, -1):
+    states = [best_last_i]
+    for i in range(len(target_loss) - 2, committed - 1, -1):
         best_last_i = pred_state_ref[i + 1][best_last_i]
-        last_diphone = sentence[i]
-        signal.append(inv[last_diphone][best_last_i].signal)
-    # Flip the reverse assembled sequence of signal fragments
-    signal = signal[::-1]
+        states.append(best_last_i)
+    # Flip the reverse assembled sequence of units
+    steps = [(sentence[i], int(candidates[i][state]), float(cum_loss[i][state, 0]))
+             for i, state in enumerate(states[::-1], committed)]
+    if metrics is not None:
+        metrics.lap('backtrack')
+    yield from steps
+
+
+def get_optimal_units(sentence, inv, phonemes_sim, top_k=TOP_K, beam=BEAM, cache=None, metrics=None,
+                      alternatives=None):
+    """Computes loss of the sequence alternatives and returns the searched diphones, the indexes of their best units
+    and the total loss of the sequence. The search is pruned by the ´top_k´ and ´beam´, uses the join cost ´cache´,
+    is recorded by the sentence ´metrics´ and fills the ´alternatives´ (see ´iter_optimal_units´)."""
+    steps = list(iter_optimal_units(sentence, inv, phonemes_sim, None, top_k, beam, cache, metrics, alternatives))
+    total_loss = steps[-1][2] if steps else 0.0
+
+    return [diphone for diphone, _, _ in steps], [unit for _, unit, _ in steps], total_loss
+
+
+def get_optimal_signal(sentence, inv, phonemes_sim, top_k=TOP_K, beam=BEAM, cache=None, metrics=None):
+    """Computes loss of all possible sequence alternatives and returns the best one.
+
+    The ´inv´ is the columnar inventory returned by ´load_inventory´, the search uses only its feature matrices. The
+    search is pruned by the ´top_k´ and ´beam´, uses the join cost ´cache´ and is recorded by the sentence ´metrics´
+    (see ´iter_optimal_units´)."""
+    alternatives = dict()
+    sentence, units, _ = get_optimal_units(sentence, inv, phonemes_sim, top_k, beam, cache, metrics, alternatives)
 
-    return signal
+    return [alternatives[diphone].get_signal(i) for diphone, i in zip(sentence, units)]
@@ -0,0 +1,190 @@
+"""Unit selection benchmark on a synthetic inventory"""
+import argparse
+import json
+import tempfile
+import time
+import tracemalloc
+from functools import partial
+from pathlib import Path
+
+from unitselection.fcn.concate import concat_diphones, to_diphones
+from unitselection.fcn.inventory_columnar import *
+from unitselection.fcn.inventory_diphone import load_inventory, load_phonemes_sim, save_phonemes_sim
+from unitselection.fcn.viterbi import get_optimal_signal
+
+HISTORY_PATH = Path(__file__).parent / "benchmark_history.json"
+# Default size of the synthetic inventory
+UNITS_PER_DIPHONE = 20
+MFCC_LEN = 13
+MIN_SIGNAL_LEN = 320
+MAX_SIGNAL_LEN = 1280
+# Searched candidates of each diphone (´top_k´) and sentence lengths [diphones] of the latency measurement
+CANDIDATES = [5, 10, 20]
+SENTENCE_LENS = [10, 40, 160]
+REPS = 3
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--units', type=int, default=UNITS_PER_DIPHONE, help='Number of the units of each diphone')
+parser.add_argument('--mfcc-len', type=int, default=MFCC_LEN, help='Dimension of the MFCC vectors')
+parser.add_argument('--signal-len', metavar=('MIN', 'MAX'), type=int, nargs=2,
+                    default=[MIN_SIGNAL_LEN, MAX_SIGNAL_LEN], help='Range of the unit signal lengths [samples]')
+parser.add_argument('--candidates', type=int, nargs='+', default=CANDIDATES,
+                    help='Numbers of the candidates searched for each diphone')
+parser.add_argument('--sentence-lens', type=int, nargs='+', default=SENTENCE_LENS,
+                    help='Lengths of the synthetized sentences [diphones]')
+parser.add_argument('--reps', type=int, default=REPS, help='Number of repetitions of each measurement')
+parser.add_argument('--seed', type=int, default=0, help='Seed of the synthetic inventory and sentences')
+parser.add_argument('--history', metavar='HISTORY', type=str, default=str(HISTORY_PATH),
+                    help='JSON file with the results of the previous runs')
+parser.add_argument('--no-save', action='store_true', help='Do not append the result to the history')
+parser.add_argument('--json', action='store_true', help='Print the result as JSON instead of the summary')
+
+
+def write_synthetic_inventory(inv_dir, units_per_diphone=UNITS_PER_DIPHONE, mfcc_len=MFCC_LEN,
+                              signal_len=(MIN_SIGNAL_LEN, MAX_SIGNAL_LEN), seed=0):
+    """Writes the columnar inventory with random units of all diphones of the ´ALPHABET´ and the phonemes similarity
+    matrix into ´inv_dir´, without any recordings."""
+    # The units are overlapped by ´FADE_LEN´ samples when concatenated
+    if signal_len[0] < 2 * FADE_LEN:
+        raise ValueError('Signals must have at least {0} samples'.format(2 * FADE_LEN))
+    rng = np.random.default_rng(seed)
+    diphones = [phon_1 + phon_2 for phon_1 in ALPHABET for phon_2 in ALPHABET]
+    numb_of_units = len(diphones) * units_per_diphone
+    col_dir = inv_dir / COLUMNAR
+    os.mkdir(col_dir)
+
+    offsets = np.zeros((numb_of_units + 1,), dtype='int64')
+    offsets[1:] = np.cumsum(rng.integers(signal_len[0], signal_len[1] + 1, numb_of_units))
+    signals = np.lib.format.open_memmap(col_dir / SIGNALS, mode='w+', dtype='float32', shape=(int(offsets[-1]),))
+    # The signals are generated by diphones, so they are never held in the memory at once
+    for start in range(0, numb_of_units, units_per_diphone):
+        stop = start + units_per_diphone
+        signals[offsets[start]:offsets[stop]] = rng.standard_normal(offsets[stop] - offsets[start]) * 3000
+    signals.flush()
+    del signals
+    np.save(col_dir / OFFSETS, offsets)
+
+    for name in SCALAR_COLUMNS:
+        np.save(col_dir / (name + ".npy"), rng.random(numb_of_units) * 200)
+    for name in VECTOR_COLUMNS:
+        np.save(col_dir / (name + ".npy"), rng.standard_normal((numb_of_units, mfcc_len)) * 50)
+    for name in PHONEME_COLUMNS:
+        np.save(col_dir / (name + ".npy"), rng.integers(0, NO_PHONEME_ID + 1, numb_of_units).astype('int16'))
+    np.save(col_dir / (SENTENCE_COLUMN + ".npy"), np.full((numb_of_units,), NO_SENTENCE_ID, dtype='int32'))
+
+    index = {diphone: [i * units_per_diphone, (i + 1) * units_per_diphone] for i, diphone in enumerate(diphones)}
+    with open(col_dir / COLUMNAR_INDEX, 'w', encoding='utf-8') as fw:
+        json.dump({'diphones': index, 'sentences': [], 'substitutions': dict()}, fw)
+    save_phonemes_sim(inv_dir)
+
+
+def measure_time(func, arg, reps):
+    """Returns the best time of ´reps´ calls of the function and its result."""
+    best_time = float('inf')
+    result = None
+    for _ in range(reps):
+        start = time.perf_counter()
+        result = func(arg)
+        best_time = min(best_time, time.perf_counter() - start)
+
+    return best_time, result
+
+
+def load_history(history_path):
+    """Loads the list of previous results, or returns an empty one if there is no history yet."""
+    if not Path(history_path).exists():
+        return []
+    with open(history_path, 'r', encoding='utf-8') as fr:
+        return json.load(fr)
+
+
+def save_history(history_path, history):
+    """Saves the list of results."""
+    with open(history_path, 'w', encoding='utf-8') as fw:
+        json.dump(history, fw, indent=2)
+
+
+def get_random_sentence(length, rng):
+    """Returns the diphone sequence of random sentence of the given number of diphones."""
+    phonemes = ['$'] + list(rng.choice(ALPHABET[1:], length - 1)) + ['$']
+    return to_diphones(''.join(phonemes))
+
+
+def get_peak_memory(func, *args):
+    """Returns the peak memory in bytes allocated by the call of the function."""
+    tracemalloc.start()
+    func(*args)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return peak
+
+
+def get_latencies(inv, phonemes_sim, candidates, sentence_lens, reps, rng):
+    """Returns the time of ´get_optimal_signal´ for each number of the searched candidates and sentence length."""
+    sentences = [get_random_sentence(length, rng) for length in sentence_lens]
+    latencies = []
+    for top_k in candidates:
+        search = partial(get_optimal_signal, inv=inv, phonemes_sim=phonemes_sim, top_k=top_k)
+        for sentence in sentences:
+            seconds, _ = measure_time(search, sentence, reps)
+            latencies.append({'candidates': top_k, 'diphones': len(sentence), 'seconds': seconds,
+                              'diphones_per_s': len(sentence) / seconds})
+
+    return latencies
+
+
+def run_benchmark(units_per_diphone=UNITS_PER_DIPHONE, mfcc_len=MFCC_LEN, signal_len=(MIN_SIGNAL_LEN, MAX_SIGNAL_LEN),
+                  candidates=CANDIDATES, sentence_lens=SENTENCE_LENS, reps=REPS, seed=0):
+    """Runs the benchmark on the synthetic inventory of the given size and returns the result as a dictionary."""
+    rng = np.random.default_rng(seed)
+    with tempfile.TemporaryDirectory() as inv_dir:
+        inv_dir = Path(inv_dir)
+        write_synthetic_inventory(inv_dir, units_per_diphone, mfcc_len, signal_len, seed)
+        load_seconds, inv = measure_time(load_inventory, inv_dir, reps)
+        phonemes_sim = load_phonemes_sim(inv_dir)
+
+        latencies = get_latencies(inv, phonemes_sim, candidates, sentence_lens, reps, rng)
+        # The longest sentence searched over the most candidates
+        sentence = get_random_sentence(max(sentence_lens), rng)
+        top_k = max(candidates)
+        signals = [np.array(signal) for signal in get_optimal_signal(sentence, inv, phonemes_sim, top_k)]
+        concat_seconds, sound = measure_time(concat_diphones, signals, reps)
+        peak_memory = get_peak_memory(get_optimal_signal, sentence, inv, phonemes_sim, top_k)
+        inventory_size = sum(os.path.getsize(path) for path in (inv_dir / COLUMNAR).iterdir())
+
+    return {
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'inventory': {'units_per_diphone': units_per_diphone, 'mfcc_len': mfcc_len, 'signal_len': list(signal_len),
+                      'units': units_per_diphone * len(ALPHABET) ** 2, 'size': inventory_size},
+        'load_seconds': load_seconds,
+        'latencies': latencies,
+        'concat_seconds': concat_seconds,
+        'concat_samples_per_s': len(sound) / concat_seconds,
+        'peak_memory': peak_memory,
+    }
+
+
+def format_result(result):
+    """Returns the human readable summary of the result."""
+    inventory = result['inventory']
+    lines = ['Inventory: {0} units ({1:.1f} MB), loaded in {2:.4f} s'.format(
+        inventory['units'], inventory['size'] / 1e6, result['load_seconds'])]
+    for item in result['latencies']:
+        lines.append('  {0:>4} candidates, {1:>4} diphones: {2:.4f} s ({3:.0f} diphones/s)'.format(
+            item['candidates'], item['diphones'], item['seconds'], item['diphones_per_s']))
+    lines.append('Concatenation: {0:.2f} Msamples/s, search peak memory {1:.1f} MB'.format(
+        result['concat_samples_per_s'] / 1e6, result['peak_memory'] / 1e6))
+
+    return '\n'.join(lines)
+
+
+if __name__ == '__main__':
+    args = parser.parse_args()
+    result = run_benchmark(args.units, args.mfcc_len, args.signal_len, args.candidates, args.sentence_lens, args.reps,
+                           args.seed)
+    print(json.dumps(result, indent=2) if args.json else format_result(result))
+    if not args.no_save:
+        history = load_history(args.history)
+        history.append(result)
+        save_history(args.history, history)
@@ -0,0 +1,67 @@
+"""Quality gap of the pruned unit search against the exhaustive one"""
+import argparse
+import time
+from pathlib import Path
+
+from unitselection.fcn.concate import clean_line, to_diphones
+from unitselection.fcn.inventory_diphone import load_inventory, load_phonemes_sim
+from unitselection.fcn.viterbi import *
+
+parser = argparse.ArgumentParser()
+parser.add_argument('hds_data_dir', metavar='HDS_DATA_DIR', type=str, help='HDS data directory with the inventory')
+parser.add_argument('reference', metavar='REFERENCE', type=str,
+                    help='Reference set: file with phonetic transcription, one sentence per line')
+parser.add_argument('--top-k', type=int, help='Number of the candidates kept for each diphone')
+parser.add_argument('--beam', type=float, help='Beam of the accumulated loss')
+
+
+def evaluate_pruning(sentences, inv, phonemes_sim, top_k=None, beam=None):
+    """Searches the diphone sentences exhaustively and with the pruning and returns the relative gaps of the total
+    losses, the ratio of the same selected units and the search times."""
+    gaps = []
+    same_units = 0
+    numb_of_units = 0
+    exhaustive_time = 0.0
+    pruned_time = 0.0
+    for sentence in sentences:
+        start = time.perf_counter()
+        _, exhaustive_units, exhaustive_loss = get_optimal_units(sentence, inv, phonemes_sim)
+        exhaustive_time += time.perf_counter() - start
+        start = time.perf_counter()
+        _, pruned_units, pruned_loss = get_optimal_units(sentence, inv, phonemes_sim, top_k, beam)
+        pruned_time += time.perf_counter() - start
+        gaps.append((pruned_loss - exhaustive_loss) / max(abs(exhaustive_loss), np.finfo('float64').tiny))
+        same_units += sum(exhaustive == pruned for exhaustive, pruned in zip(exhaustive_units, pruned_units))
+        numb_of_units += len(exhaustive_units)
+
+    return {
+        'sentences': len(gaps),
+        'mean_gap': float(np.mean(gaps)) if gaps else 0.0,
+        'max_gap': float(np.max(gaps)) if gaps else 0.0,
+        'same_units': same_units / max(numb_of_units, 1),
+        'exhaustive_time': exhaustive_time,
+        'pruned_time': pruned_time,
+    }
+
+
+def evaluate_file(reference_path, hds_dir, top_k=None, beam=None):
+    """Evaluates the pruning on the sentences of the phonetic transcription file."""
+    inv = load_inventory(hds_dir / PREP)
+    phonemes_sim = load_phonemes_sim(hds_dir / PREP)
+    with open(reference_path, 'r', encoding='utf-8') as fr:
+        lines = [clean_line(line) for line in fr.read().splitlines()]
+
+    return evaluate_pruning([to_diphones(line) for line in lines if len(line) > 1], inv, phonemes_sim, top_k, beam)
+
+
+def format_pruning(result):
+    """Returns the human readable summary of the result."""
+    return ('Loss gap: {0:.4%} mean, {1:.4%} max ({2} sentences), same units: {3:.2%}, '
+            'search time: {4:.3f} s exhaustive, {5:.3f} s pruned').format(
+        result['mean_gap'], result['max_gap'], result['sentences'], result['same_units'], result['exhaustive_time'],
+        result['pruned_time'])
+
+
+if __name__ == '__main__':
+    args = parser.parse_args()
+    print(format_pruning(evaluate_file(args.reference, Path(args.hds_data_dir), args.top_k, args.beam)))
@@ -0,0 +1,244 @@
+"""Equivalence tests of the optimized synthesis against the original implementation"""
+import argparse
+import contextlib
+import io
+import random
+import unittest
+
+from unitselection.fcn.inventory_columnar import create_columnar_inventory
+from unitselection.fcn.inventory_diphone import get_phonemes_similarity
+from unitselection.fcn.join_cache import JoinCostCache, get_pair_size
+from unitselection.fcn.metrics import SentenceMetrics, SynthesisMetrics
+from unitselection.fcn.viterbi import *
+from unitselection.tst.pruning import evaluate_pruning
+from unitselection.tst.test_inventory import MAX_UNITS, get_random_inventory
+
+# Phonemes of the test inventory and sentences, the diphones of some pairs are missing
+PHONEMES = "$aeiouAEptkmnsrlzvbdjJ"
+MISSING_DIPHONE_RATIO = 0.1
+NUMB_OF_SENTENCES = 40
+MAX_SENTENCE_LEN = 30
+
+
+def reference_target_loss(sentence, inv, phonemes_sim):
+    """Original target loss computed from the lists of speech units."""
+    target_loss = [np.zeros((len(inv[diphone]), 1)) for diphone in sentence]
+    for i, diphone in enumerate(sentence):
+        alternatives = inv[diphone]
+        real_sentence_position = i / len(sentence)
+        alter_sentence_positions = np.array(list(map(lambda x: x.sentence_position, alternatives)))
+        target_loss[i] += np.expand_dims(np.abs(alter_sentence_positions - real_sentence_position),
+                                         axis=1) * SENTENCE_POSITION_WEIGHT
+        if i > 0:
+            left_phoneme_losses = [phonemes_sim[(sentence[i - 1][0], unit.left_phoneme)] for unit in alternatives]
+            target_loss[i] += np.expand_dims(np.array(left_phoneme_losses), axis=1) * SURROUNDING_WEIGHT
+        if i < len(sentence) - 1:
+            right_phoneme_losses = [phonemes_sim[(sentence[i + 1][1], unit.right_phoneme)] for unit in alternatives]
+            target_loss[i] += np.expand_dims(np.array(right_phoneme_losses), axis=1) * SURROUNDING_WEIGHT
+
+    return target_loss
+
+
+def reference_loss_mat(prev_alter, this_alter):
+    """Original concatenation loss of the repeated feature matrices."""
+    prev_alter = np.repeat(prev_alter, this_alter.shape[1], axis=1)
+    this_alter = np.repeat(this_alter, prev_alter.shape[0], axis=0)
+    return prev_alter - this_alter
+
+
+def reference_concat_loss(sentence, inv):
+    """Original concatenation loss computed from the lists of speech units."""
+    concat_loss = []
+    for i in range(1, len(sentence)):
+        prev_alternatives = inv[sentence[i - 1]]
+        this_alternatives = inv[sentence[i]]
+        loss_mat = np.zeros((len(prev_alternatives), len(this_alternatives)))
+        for prev_name, this_name, weight in [('enrg_stop', 'enrg_start', ENRG_WEIGHT),
+                                             ('f0_stop', 'f0_start', F0_WEIGHT)]:
+            prev_alter = np.expand_dims(np.array([getattr(unit, prev_name) for unit in prev_alternatives]), axis=1)
+            this_alter = np.expand_dims(np.array([getattr(unit, this_name) for unit in this_alternatives]), axis=0)
+            loss_mat += np.abs(reference_loss_mat(prev_alter, this_alter)) * weight
+        prev_alter = np.expand_dims(np.array([unit.mfcc_stop for unit in prev_alternatives]), axis=1)
+        this_alter = np.expand_dims(np.array([unit.mfcc_start for unit in this_alternatives]), axis=0)
+        mfcc_loss_mat = np.sqrt(np.sum(np.square(reference_loss_mat(prev_alter, this_alter)), axis=2))
+        concat_loss.append(loss_mat + mfcc_loss_mat * MFCC_WEIGHT)
+
+    return concat_loss
+
+
+def reference_optimal_signal(sentence, inv, phonemes_sim):
+    """Original Viterbi search over the lists of speech units."""
+    sentence = get_existing_seq(sentence, inv)
+    target_loss = reference_target_loss(sentence, inv, phonemes_sim)
+    concat_loss = reference_concat_loss(sentence, inv)
+    cum_loss = [np.zeros((len(inv[diphone]), 1)) for diphone in sentence]
+    pred_state_ref = [-np.ones((len(inv[diphone]),)).astype('int32') for diphone in sentence]
+    cum_loss[0] += target_loss[0]
+    for i in range(1, len(target_loss)):
+        this_target_loss = np.transpose(target_loss[i])
+        prev_loss = np.repeat(cum_loss[i - 1], this_target_loss.shape[1], axis=1)
+        loss = concat_loss[i - 1] + prev_loss + np.repeat(this_target_loss, prev_loss.shape[0], axis=0)
+        best_prev_state = np.argmin(loss, axis=0)
+        pred_state_ref[i] *= -best_prev_state
+        cum_loss[i] += np.expand_dims(loss[list(best_prev_state), [*range(this_target_loss.size)]], axis=1)
+
+    best_last_i = np.argmin(cum_loss[-1])
+    signal = [inv[sentence[-1]][best_last_i].signal]
+    for i in range(len(target_loss) - 2, -1, -1):
+        best_last_i = pred_state_ref[i + 1][best_last_i]
+        signal.append(inv[sentence[i]][best_last_i].signal)
+
+    return signal[::-1]
+
+
+def get_test_inventory():
+    """Returns the random inventory of most diphones of the test phonemes, as the dictionary and columnar one."""
+    rng = random.Random(0)
+    diphones = [phon_1 + phon_2 for phon_1 in PHONEMES for phon_2 in PHONEMES
+                if rng.random() >= MISSING_DIPHONE_RATIO]
+    inv = get_random_inventory(diphones=diphones)
+
+    return inv, create_columnar_inventory(inv)
+
+
+def get_test_sentences():
+    """Yields reproducible random diphone sequences of the test phonemes."""
+    rng = random.Random(0)
+    for _ in range(NUMB_OF_SENTENCES):
+        phonemes = '$' + ''.join(rng.choice(PHONEMES[1:]) for _ in range(rng.randint(1, MAX_SENTENCE_LEN))) + '$'
+        yield [phonemes[i:i + 2] for i in range(len(phonemes) - 1)]
+
+
+class TestEquivalence(unittest.TestCase):
+    """Tests that the optimized synthesis selects the same units as the original one."""
+
+    def assertSignalsEqual(self, expected, actual):
+        """Compares two sequences of unit signals."""
+        self.assertEqual(len(expected), len(actual))
+        for expected_signal, actual_signal in zip(expected, actual):
+            np.testing.assert_array_equal(expected_signal, actual_signal)
+
+    def test_optimal_signal(self):
+        """Compares the units selected from the columnar inventory with the original search."""
+        inv, columnar_inv = get_test_inventory()
+        phonemes_sim = get_phonemes_similarity()
+        sim_matrix = get_similarity_matrix(phonemes_sim)
+        for sentence in get_test_sentences():
+            self.assertSignalsEqual(reference_optimal_signal(sentence, inv, phonemes_sim),
+                                    get_optimal_signal(sentence, columnar_inv, sim_matrix))
+
+    def test_substitutions(self):
+        """Compares the diphones replaced by the substitution table of the columnar inventory with the searched ones
+        and checks the counts of the replaced and dropped diphones."""
+        inv, columnar_inv = get_test_inventory()
+        sentence = [phon_1 + phon_2 for phon_1 in ALPHABET for phon_2 in ALPHABET]
+        expected = get_existing_seq(sentence, inv)
+        metrics = SentenceMetrics(sentence)
+
+        self.assertEqual(expected, get_existing_seq(sentence, columnar_inv, metrics))
+        self.assertEqual(len(sentence) - len(inv), len(metrics.substituted) + len(metrics.dropped))
+        self.assertEqual(len(sentence) - len(metrics.dropped), len(expected))
+
+        # The metrics of the sentences are collected separately, so the concurrent searches do not share any counter
+        synthesis_metrics = SynthesisMetrics()
+        synthesis_metrics.add(metrics)
+        synthesis_metrics.add(metrics)
+        self.assertEqual(2 * len(metrics.dropped), sum(synthesis_metrics.dropped.values()))
+
+    def test_concat_loss(self):
+        """Compares the concatenation losses with the original ones and the blocked search of the best transitions
+        with the whole loss matrices."""
+        inv, columnar_inv = get_test_inventory()
+        sentence = get_existing_seq(next(get_test_sentences()), inv)
+        for expected, actual in zip(reference_concat_loss(sentence, inv), get_concat_loss(sentence, columnar_inv)):
+            np.testing.assert_allclose(expected, actual, rtol=1e-4, atol=1e-3)
+
+        prev_alternatives = columnar_inv[sentence[0]]
+        this_alternatives = columnar_inv[sentence[1]]
+        prev_candidates = np.arange(len(prev_alternatives))
+        this_candidates = np.arange(len(this_alternatives))
+        prev_loss = np.expand_dims(np.linspace(0.0, 1.0, len(prev_candidates)), axis=1)
+        this_target_loss = np.expand_dims(np.linspace(1.0, 0.0, len(this_candidates)), axis=0)
+        loss = merge_target_and_concat_loss(prev_loss, this_target_loss,
+                                            get_pair_concat_loss(prev_alternatives, this_alternatives))
+        best_prev_state, best_loss = get_best_transitions(prev_loss, this_target_loss, prev_alternatives,
+                                                          this_alternatives, prev_candidates, this_candidates,
+                                                          max_block_size=1)
+        np.testing.assert_array_equal(np.argmin(loss, axis=0), best_prev_state)
+        np.testing.assert_array_equal(np.min(loss, axis=0), best_loss)
+
+    def test_pruning(self):
+        """Compares the pruned search with the exhaustive one: it is the same without effective pruning and never
+        finds lower loss with it."""
+        _, columnar_inv = get_test_inventory()
+        phonemes_sim = get_similarity_matrix(get_phonemes_similarity())
+        sentences = list(get_test_sentences())
+        for sentence in sentences:
+            self.assertSignalsEqual(get_optimal_signal(sentence, columnar_inv, phonemes_sim),
+                                    get_optimal_signal(sentence, columnar_inv, phonemes_sim, MAX_UNITS, np.inf))
+        result = evaluate_pruning(sentences, columnar_inv, phonemes_sim, top_k=2, beam=1.0)
+        self.assertEqual(len(sentences), result['sentences'])
+        self.assertGreaterEqual(result['mean_gap'], 0.0)
+        self.assertGreaterEqual(result['max_gap'], result['mean_gap'])
+        self.assertLessEqual(result['same_units'], 1.0)
+
+    def test_invalid_pruning(self):
+        """Rejects the number of the candidates lower than 1 and the negative beam."""
+        _, columnar_inv = get_test_inventory()
+        phonemes_sim = get_similarity_matrix(get_phonemes_similarity())
+        sentence = next(get_test_sentences())
+        for top_k, beam in [(0, None), (-1, None), (None, -0.5), (None, np.nan)]:
+            with self.assertRaises(ValueError):
+                get_optimal_signal(sentence, columnar_inv, phonemes_sim, top_k, beam)
+        self.assertEqual(1, len(get_candidates(np.zeros((3, 1)), 1)))
+        self.assertEqual(3, len(get_beam(np.zeros((3, 1)), 0.0)))
+
+        parser = argparse.ArgumentParser()
+        parser.add_argument('--top-k', type=top_k_arg)
+        parser.add_argument('--beam', type=beam_arg)
+        self.assertEqual((3, 0.5), tuple(vars(parser.parse_args(['--top-k', '3', '--beam', '0.5'])).values()))
+        for argv in [['--top-k', '0'], ['--beam', '-1'], ['--top-k', 'x']]:
+            with self.assertRaises(SystemExit), contextlib.redirect_stderr(io.StringIO()):
+                parser.parse_args(argv)
+
+    def test_join_cache(self):
+        """Compares the search with the cached concatenation losses with the search without cache, with the cache
+        large enough for all diphone pairs and with the cache evicting most of them."""
+        _, columnar_inv = get_test_inventory()
+        phonemes_sim = get_similarity_matrix(get_phonemes_similarity())
+        sentences = [get_existing_seq(sentence, columnar_inv) for sentence in get_test_sentences()]
+        pairs = {pair for sentence in sentences for pair in zip(sentence[:-1], sentence[1:])}
+        largest = max(get_pair_size(columnar_inv, *pair) for pair in pairs)
+        for max_size in [largest * len(pairs), largest]:
+            cache = JoinCostCache(columnar_inv, max_size)
+            for sentence in sentences:
+                self.assertSignalsEqual(get_optimal_signal(sentence, columnar_inv, phonemes_sim),
+                                        get_optimal_signal(sentence, columnar_inv, phonemes_sim, cache=cache))
+            info = cache.cache_info()
+            self.assertEqual(sum(len(sentence) - 1 for sentence in sentences), info['hits'] + info['misses'])
+            self.assertLessEqual(info['size'], max_size)
+            if max_size > largest:
+                self.assertEqual(len(pairs), info['misses'])
+                self.assertEqual(0, info['evictions'])
+            else:
+                self.assertGreater(info['evictions'], 0)
+
+        # The pruned search computes only the matrices of the pairs whose candidates are all their units
+        top_k = 2
+        cache = JoinCostCache(columnar_inv, largest * len(pairs))
+        for sentence in sentences:
+            self.assertSignalsEqual(get_optimal_signal(sentence, columnar_inv, phonemes_sim, top_k),
+                                    get_optimal_signal(sentence, columnar_inv, phonemes_sim, top_k, cache=cache))
+        self.assertGreater(cache.cache_info()['misses'], len(cache.matrices))
+        for prev_diphone, this_diphone in cache.matrices:
+            self.assertLessEqual(max(len(columnar_inv[prev_diphone]), len(columnar_inv[this_diphone])), top_k)
+
+    def test_blocked_pair_concat_loss(self):
+        """Compares the concatenation loss matrix of all alternatives computed by blocks with the whole one."""
+        _, columnar_inv = get_test_inventory()
+        diphones = list(columnar_inv.index)
+        for prev_diphone, this_diphone in zip(diphones[:-1], diphones[1:]):
+            expected = get_pair_concat_loss(columnar_inv[prev_diphone], columnar_inv[this_diphone])
+            for max_block_size in [1, 100, LOSS_BLOCK_SIZE]:
+                np.testing.assert_array_equal(expected, get_blocked_pair_concat_loss(
+                    columnar_inv[prev_diphone], columnar_inv[this_diphone], max_block_size))
@@ -0,0 +1,351 @@
+"""Inventory format tests"""
+import filecmp
+import shutil
+import tempfile
+import unittest
+from pathlib import Path
+
+from scipy.io import wavfile
+
+from unitselection.fcn.inventory_columnar import *
+from unitselection.fcn.ingest import load_mlf, load_pitch_marks
+from unitselection.fcn.inventory_diphone import get_phonemes_similarity, inventory_create, inventory_prepare, \
+    load_inventory, load_phonemes_sim, save_phonemes_sim
+from unitselection.fcn.join_cache import create_join_cache, get_frequent_pairs, get_pair_concat_loss
+from unitselection.fcn.manifest import get_sentence_files
+from unitselection.fcn.viterbi import get_similarity_matrix
+
+NUMB_OF_DIPHONES = 50
+MAX_UNITS = 6
+MFCC_LEN = 13
+NUMB_OF_SENTENCES = 12
+FEATS_STEP = 0.01  # time step of the random unsel features [s]
+
+
+def write_random_sentence(hds_dir, sent_name, rng):
+    """Writes the recording, pitch marks, phoneme alignment and unsel features of random sentence."""
+    phonemes = ['$'] + list(rng.choice(ALPHABET[1:], rng.integers(5, 20))) + ['$']
+    bounds = np.concatenate([[0.0], np.cumsum(rng.uniform(0.03, 0.15, len(phonemes)))])
+    length = bounds[-1] + 0.1
+    signal = (rng.standard_normal(int(length * SAMPLE_RATE)) * 3000).astype('int16')
+    wavfile.write(hds_dir / SPC / (sent_name + ".wav"), SAMPLE_RATE, signal)
+    with open(hds_dir / MLF / (sent_name + ".mlf"), 'w', encoding='utf-8') as fw:
+        for i, phoneme in enumerate(phonemes):
+            fw.write("{0} {1} {2}\n".format(round(bounds[i] / TIME_STEP), round(bounds[i + 1] / TIME_STEP), phoneme))
+    with open(hds_dir / PM / (sent_name + ".pm"), 'w', encoding='utf-8') as fw:
+        for time in np.cumsum(rng.uniform(0.004, 0.009, int(length / 0.004))):
+            fw.write(" {0:.6f} 0 {1}\n".format(time, rng.choice(['V', 'U', 'T'])))
+    times = np.arange(0.0, length + FEATS_STEP, FEATS_STEP)
+    for feature, width in [("enrg", 1), ("f0", 1), ("mfcc", MFCC_LEN)]:
+        with open(hds_dir / UNS_FT / (sent_name + "." + feature + ".txt"), 'w', encoding='utf-8') as fw:
+            fw.write("{0}\n".format(feature))
+            for time in times:
+                values = " | ".join("{0:.4f}".format(value) for value in rng.standard_normal(width) * 50)
+                if width == 1:
+                    values = "- | " + values
+                fw.write("| {0:.4f} | {1} |\n".format(time, values))
+
+
+def remove_sentence(hds_dir, sent_name):
+    """Removes all source files of the sentence."""
+    for rel_path in get_sentence_files(sent_name):
+        os.remove(hds_dir / rel_path)
+
+
+def create_random_corpus(hds_dir, numb_of_sentences=NUMB_OF_SENTENCES, seed=0):
+    """Creates HDS data directory with random sentences and already split MLF files."""
+    rng = np.random.default_rng(seed)
+    for dir_name in [SPC, PM, MLF, UNS_FT]:
+        os.mkdir(hds_dir / dir_name)
+    for i in range(numb_of_sentences):
+        write_random_sentence(hds_dir, "Sentence" + str(i + 1).zfill(5), rng)
+
+
+def reference_pitch_marks(pm_f_name):
+    """Original line by line parsing of the pitch mark times, without the transitional ('T') marks."""
+    pms = []
+    with open(pm_f_name, 'r', encoding='utf-8') as pm_f:
+        for line in pm_f:
+            if line[0] == ' ':
+                line = line[1:]
+            items = line[:-1].split(' ')
+            if items[-1] != 'T':
+                pms.append(float(items[0]))
+
+    return pms
+
+
+def reference_mlf(mlf_f_name):
+    """Original line by line parsing of the phonemes and the times of their centers, without the first line."""
+    phonemes, centers = [], []
+    with open(mlf_f_name, 'r', encoding='utf-8') as mlf_f:
+        for line in list(mlf_f)[1:]:
+            items = line[:-1].split(' ')
+            phonemes.append(items[2])
+            centers.append((float(items[0]) * TIME_STEP + float(items[1]) * TIME_STEP) / 2)
+
+    return phonemes, centers
+
+
+def write_ragged_files(dir, rng):
+    """Writes the MLF and pitch marks files whose lines have various numbers of fields, returns their paths."""
+    mlf_path, pm_path = dir / "ragged.mlf", dir / "ragged.pm"
+    with open(mlf_path, 'w', encoding='utf-8') as fw:
+        fw.write("#!MLF!#\n")
+        for i in range(30):
+            # Some lines carry the score and the word
+            extra = rng.choice(["", " -12.5", " -3.25 slovo"])
+            fw.write("{0} {1} {2}{3}\n".format(i * 1000, (i + 1) * 1000, rng.choice(ALPHABET[1:]), extra))
+    with open(pm_path, 'w', encoding='utf-8') as fw:
+        for i in range(30):
+            extra = rng.choice(["", " 1"])
+            fw.write(" {0:.6f} 0{1} {2}\n".format(i * 0.005, extra, rng.choice(['V', 'U', 'T'])))
+
+    return mlf_path, pm_path
+
+
+def write_orig_mlf(hds_dir, sent_names):
+    """Writes the original MLF file of the given sentences from their split MLF files."""
+    with open(hds_dir / ORIG_MLF, 'w', encoding='utf-8') as fw:
+        fw.write("#!MLF!#\n")
+        for sent_name in sent_names:
+            fw.write("\"*/{0}.lab\"\n".format(sent_name))
+            with open(hds_dir / MLF / (sent_name + ".mlf"), 'r', encoding='utf-8') as fr:
+                fw.write(fr.read())
+            fw.write(".\n")
+
+
+def get_random_inventory(seed=0, diphones=None):
+    """Returns reproducible random inventory in the dictionary format, with the given or random diphones."""
+    rng = np.random.default_rng(seed)
+    if diphones is None:
+        diphones = [''.join(rng.choice(ALPHABET, 2)) for _ in range(NUMB_OF_DIPHONES)]
+    inv = dict()
+    for diphone in diphones:
+        inv[diphone] = []
+        for _ in range(rng.integers(1, MAX_UNITS + 1)):
+            signal = rng.standard_normal(rng.integers(400, 1000)).astype('float32')
+            unit = SpeechUnit(signal, rng.random(), rng.random(), rng.random() * 200, rng.random() * 200,
+                              tuple(rng.standard_normal(MFCC_LEN)), tuple(rng.standard_normal(MFCC_LEN)))
+            unit.sentence_position = rng.random()
+            unit.left_phoneme = rng.choice(ALPHABET + [None])
+            unit.right_phoneme = rng.choice(ALPHABET + [None])
+            inv[diphone].append(unit)
+
+    return inv
+
+
+class TestInventory(unittest.TestCase):
+    """Tests the inventory storage formats."""
+
+    def assertColumnarEqual(self, expected_dir, actual_dir):
+        """Compares the columnar inventory files of two directories."""
+        col_files = sorted(os.listdir(expected_dir / PREP / COLUMNAR))
+        self.assertIn(COLUMNAR_INDEX, col_files)
+        _, mismatch, errors = filecmp.cmpfiles(expected_dir / PREP / COLUMNAR, actual_dir / PREP / COLUMNAR,
+                                               col_files, shallow=False)
+        self.assertEqual([], mismatch + errors)
+
+    def assertUnitsEqual(self, expected, actual):
+        """Compares all stored attributes of two speech units."""
+        np.testing.assert_array_equal(expected.signal, actual.signal)
+        for name in SCALAR_COLUMNS + PHONEME_COLUMNS:
+            self.assertEqual(getattr(expected, name), getattr(actual, name), name)
+        for name in VECTOR_COLUMNS:
+            np.testing.assert_array_equal(getattr(expected, name), getattr(actual, name))
+
+    def test_columnar_conversion(self):
+        """Converts the pickled inventory into the columnar format and compares the loaded units."""
+        inv = get_random_inventory()
+        with tempfile.TemporaryDirectory() as inv_dir:
+            inv_dir = Path(inv_dir)
+            with open(inv_dir / INV, 'wb') as fw:
+                plk.dump(inv, fw)
+            convert_inventory(inv_dir)
+            columnar_inv = load_columnar_inventory(inv_dir)
+
+            self.assertEqual(list(inv), list(columnar_inv))
+            for diphone, units in inv.items():
+                self.assertIn(diphone, columnar_inv)
+                self.assertEqual(len(units), len(columnar_inv[diphone]))
+                for unit, columnar_unit in zip(units, columnar_inv[diphone]):
+                    self.assertUnitsEqual(unit, columnar_unit)
+            self.assertNotIn('$$$', columnar_inv)
+
+    def test_sharded_inventory(self):
+        """Loads the diphones of the sharded inventory under small memory and compares them with the columnar
+        inventory."""
+        inv = get_random_inventory()
+        with tempfile.TemporaryDirectory() as inv_dir:
+            inv_dir = Path(inv_dir)
+            with open(inv_dir / INV, 'wb') as fw:
+                plk.dump(inv, fw)
+            max_size = 3 * max(get_units_size(create_columnar_inventory({diphone: units})[diphone])
+                               for diphone, units in inv.items())
+            sharded_inv = load_inventory(inv_dir, max_size)
+            columnar_inv = load_columnar_inventory(inv_dir)
+
+            self.assertEqual(list(columnar_inv), list(sharded_inv))
+            self.assertEqual(columnar_inv.substitutions, sharded_inv.substitutions)
+            for _ in range(2):
+                for diphone, units in columnar_inv.items():
+                    self.assertEqual(len(units), len(sharded_inv[diphone]))
+                    for unit, sharded_unit in zip(units, sharded_inv[diphone]):
+                        self.assertUnitsEqual(unit, sharded_unit)
+                    self.assertLessEqual(sharded_inv.size, max_size)
+            info = sharded_inv.cache_info()
+            sharded_inv.close()
+
+        self.assertGreater(info['evictions'], 0)
+        self.assertGreater(info['hits'], 0)
+        self.assertEqual(info['size'], sharded_inv.size)
+        self.assertEqual(max_size, info['max_size'])
+
+    def test_phonemes_sim(self):
+        """Compares the saved phonemes similarity matrix and the converted pickled dictionary with the dictionary."""
+        phonemes_sim = get_phonemes_similarity()
+        with tempfile.TemporaryDirectory() as inv_dir:
+            inv_dir = Path(inv_dir)
+            with open(inv_dir / PHON_SIM, 'wb') as fw:
+                plk.dump(phonemes_sim, fw)
+            converted = load_phonemes_sim(inv_dir)
+            save_phonemes_sim(inv_dir)
+            sim_matrix = load_phonemes_sim(inv_dir)
+
+        np.testing.assert_array_equal(converted, sim_matrix)
+        for (phon_1, phon_2), loss in phonemes_sim.items():
+            # The similarity groups also contain phonemes out of the ´ALPHABET´
+            if phon_1 not in PHONEME_IDS or phon_2 not in PHONEME_IDS and phon_2 is not None:
+                continue
+            self.assertEqual(loss, sim_matrix[PHONEME_IDS[phon_1], get_phoneme_id(phon_2)])
+        np.testing.assert_array_equal(np.zeros((NO_PHONEME_ID + 1,)), sim_matrix[NO_PHONEME_ID])
+
+    def test_parallel_build(self):
+        """Compares the inventory files built by the process pool with the serial build."""
+        with tempfile.TemporaryDirectory() as serial_dir, tempfile.TemporaryDirectory() as parallel_dir:
+            serial_dir = Path(serial_dir)
+            parallel_dir = Path(parallel_dir)
+            create_random_corpus(serial_dir)
+            create_random_corpus(parallel_dir)
+            inventory_create(serial_dir)
+            inventory_create(parallel_dir, jobs=2)
+
+            self.assertColumnarEqual(serial_dir, parallel_dir)
+            self.assertGreater(len(load_columnar_inventory(serial_dir / PREP)), 0)
+
+    def test_parse_cache(self):
+        """Compares the inventory files built from the cached parsed sentence data with the build without cache."""
+        with tempfile.TemporaryDirectory() as plain_dir, tempfile.TemporaryDirectory() as cached_dir:
+            plain_dir = Path(plain_dir)
+            cached_dir = Path(cached_dir)
+            create_random_corpus(plain_dir)
+            create_random_corpus(cached_dir)
+            inventory_create(plain_dir)
+            inventory_create(cached_dir, parse_cache=True)
+            self.assertEqual(NUMB_OF_SENTENCES, len(os.listdir(cached_dir / PREP / PARSED)))
+            # Forces the full build from the cache
+            os.remove(cached_dir / PREP / MANIFEST)
+            inventory_create(cached_dir, parse_cache=True)
+
+            self.assertColumnarEqual(plain_dir, cached_dir)
+
+    def test_ragged_parsing(self):
+        """Compares the bulk parsing of the files with ragged lines with the original line by line parsing."""
+        rng = np.random.default_rng(0)
+        with tempfile.TemporaryDirectory() as dir:
+            for _ in range(20):
+                mlf_path, pm_path = write_ragged_files(Path(dir), rng)
+                np.testing.assert_array_equal(reference_pitch_marks(pm_path), load_pitch_marks(pm_path))
+                expected_phonemes, expected_centers = reference_mlf(mlf_path)
+                phonemes, centers = load_mlf(mlf_path)
+                self.assertEqual(expected_phonemes, phonemes)
+                np.testing.assert_array_equal(expected_centers, centers)
+
+    def test_join_costs(self):
+        """Precomputes the concatenation losses of the most frequent diphone pairs and reads them from the cache."""
+        with tempfile.TemporaryDirectory() as hds_dir:
+            hds_dir = Path(hds_dir)
+            create_random_corpus(hds_dir)
+            inventory_create(hds_dir, join_costs=5)
+            inv = load_columnar_inventory(hds_dir / PREP)
+            pairs = get_frequent_pairs(inv, 5)
+            self.assertEqual(5, len(pairs))
+            cache = create_join_cache(inv, hds_dir / PREP)
+            for prev_diphone, this_diphone in pairs:
+                np.testing.assert_array_equal(get_pair_concat_loss(inv[prev_diphone], inv[this_diphone]),
+                                              cache.get(prev_diphone, this_diphone))
+            self.assertEqual(5, cache.cache_info()['disk_hits'])
+
+            # The incremental update replaces the inventory together with the matrices, they are computed again
+            remove_sentence(hds_dir, "Sentence00005")
+            write_random_sentence(hds_dir, "Sentence00099", np.random.default_rng(1))
+            inventory_prepare(hds_dir)
+            inv = load_columnar_inventory(hds_dir / PREP)
+            self.assertIn("Sentence00099", inv.sentences)
+            cache = create_join_cache(inv, hds_dir / PREP)
+            for prev_diphone, this_diphone in get_frequent_pairs(inv, 5):
+                np.testing.assert_array_equal(get_pair_concat_loss(inv[prev_diphone], inv[this_diphone]),
+                                              cache.get(prev_diphone, this_diphone))
+            self.assertEqual(5, cache.cache_info()['disk_hits'])
+
+    def test_incremental_build(self):
+        """Changes, removes and adds sentences of the built corpus and compares the updated inventory with the full
+        build of the final corpus."""
+        with tempfile.TemporaryDirectory() as hds_dir, tempfile.TemporaryDirectory() as full_dir:
+            hds_dir = Path(hds_dir)
+            create_random_corpus(hds_dir)
+            inventory_create(hds_dir)
+            index_mtime = os.stat(hds_dir / PREP / COLUMNAR / COLUMNAR_INDEX).st_mtime_ns
+            inventory_create(hds_dir)
+            self.assertEqual(index_mtime, os.stat(hds_dir / PREP / COLUMNAR / COLUMNAR_INDEX).st_mtime_ns)
+
+            rng = np.random.default_rng(1)
+            write_random_sentence(hds_dir, "Sentence00003", rng)
+            remove_sentence(hds_dir, "Sentence00005")
+            write_random_sentence(hds_dir, "Sentence00000", rng)
+            write_random_sentence(hds_dir, "Sentence00099", rng)
+            inventory_create(hds_dir, jobs=2)
+
+            full_dir = Path(full_dir) / "hds"
+            shutil.copytree(hds_dir, full_dir, ignore=shutil.ignore_patterns(PREP))
+            inventory_create(full_dir)
+            self.assertColumnarEqual(full_dir, hds_dir)
+            sentences = load_columnar_inventory(hds_dir / PREP).sentences
+            self.assertIn("Sentence00099", sentences)
+            self.assertNotIn("Sentence00005", sentences)
+
+    def test_removed_orig_mlf_sentence(self):
+        """Removes the sentence from the original MLF file and checks that its split file is not built again."""
+        with tempfile.TemporaryDirectory() as hds_dir:
+            hds_dir = Path(hds_dir)
+            create_random_corpus(hds_dir)
+            sent_names = ["Sentence" + str(i + 1).zfill(5) for i in range(NUMB_OF_SENTENCES)]
+            write_orig_mlf(hds_dir, sent_names)
+            inventory_create(hds_dir)
+            write_orig_mlf(hds_dir, sent_names[:4] + sent_names[5:])
+            inventory_create(hds_dir)
+
+            self.assertFalse(os.path.exists(hds_dir / MLF / (sent_names[4] + ".mlf")))
+            self.assertNotIn(sent_names[4], load_columnar_inventory(hds_dir / PREP).sentences)
+
+    def test_prepare_existing_inventory(self):
+        """Uses the inventory without the manifest or the sources as it is and updates the one with both."""
+        with tempfile.TemporaryDirectory() as hds_dir, tempfile.TemporaryDirectory() as inv_only_dir:
+            hds_dir = Path(hds_dir)
+            create_random_corpus(hds_dir)
+            inventory_prepare(hds_dir)
+            self.assertTrue(os.path.exists(hds_dir / PREP / MANIFEST))
+
+            # Only the built inventory is distributed
+            inv_only_dir = Path(inv_only_dir)
+            shutil.copytree(hds_dir / PREP, inv_only_dir / PREP)
+            inventory_prepare(inv_only_dir)
+            self.assertColumnarEqual(hds_dir, inv_only_dir)
+
+            remove_sentence(hds_dir, "Sentence00005")
+            os.rename(hds_dir / PREP / MANIFEST, hds_dir / "manifest.json")
+            inventory_prepare(hds_dir)
+            self.assertIn("Sentence00005", load_columnar_inventory(hds_dir / PREP).sentences)
+            os.rename(hds_dir / "manifest.json", hds_dir / PREP / MANIFEST)
+            inventory_prepare(hds_dir)
+            self.assertNotIn("Sentence00005", load_columnar_inventory(hds_dir / PREP).sentences)
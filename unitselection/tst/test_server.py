@@ -0,0 +1,136 @@
+"""Server tests"""
+import asyncio
+import contextlib
+import io
+import json
+import os
+import tempfile
+import unittest
+from pathlib import Path
+
+from scipy.io import wavfile
+
+from phonetrans.fcn.processing import translate
+from unitselection.fcn.inventory_diphone import inventory_create
+from unitselection.fcn.metrics import SynthesisMetrics
+from unitselection.fcn.server import *
+from unitselection.tst.test_inventory import create_random_corpus
+
+
+class BufferWriter:
+    """Stream writer keeping the written bytes in memory."""
+
+    def __init__(self):
+        self.data = b''
+        self.closed = False
+
+    def write(self, data):
+        self.data += data
+
+    async def drain(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+
+def get_request(method, path, body=b''):
+    """Returns the bytes of the HTTP request."""
+    head = '{0} {1} HTTP/1.1\r\nHost: localhost\r\nContent-Length: {2}\r\n\r\n'.format(method, path, len(body))
+    return head.encode('latin-1') + body
+
+
+async def handle_request(server, data, writer):
+    """Handles the request bytes by the server, the response is written into the writer."""
+    reader = asyncio.StreamReader()
+    reader.feed_data(data)
+    reader.feed_eof()
+    await server.handle(reader, writer)
+
+
+def parse_response(data):
+    """Returns the status, headers and body of the HTTP response."""
+    head, _, body = data.partition(b'\r\n\r\n')
+    lines = head.decode('latin-1').split('\r\n')
+    headers = dict(line.split(': ', 1) for line in lines[1:])
+
+    return int(lines[0].split(' ')[1]), headers, body
+
+
+class TestServer(unittest.TestCase):
+    """Tests the request handling of the server."""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.tmp_dir = tempfile.TemporaryDirectory()
+        cls.hds_dir = Path(cls.tmp_dir.name) / "hds"
+        os.mkdir(cls.hds_dir)
+        create_random_corpus(cls.hds_dir)
+        inventory_create(cls.hds_dir)
+        cls.server = SynthesisServer(cls.hds_dir, jobs=2, metrics=SynthesisMetrics())
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.executor.shutdown()
+        cls.tmp_dir.cleanup()
+
+    def handle(self, data, server=None):
+        """Passes the request bytes to the server and returns the parsed response."""
+        writer = BufferWriter()
+        asyncio.run(handle_request(server or self.server, data, writer))
+        self.assertTrue(writer.closed)
+
+        return parse_response(writer.data)
+
+    def test_transcribe(self):
+        """Transcribes the text as it is, also the one without the trailing newline."""
+        for txt in ["Ahoj světe.\nJak se máš?\n", "Ahoj světe."]:
+            status, headers, body = self.handle(get_request('POST', '/transcribe', txt.encode('utf-8')))
+            self.assertEqual(200, status)
+            self.assertEqual(str(len(body)), headers['Content-Length'])
+            self.assertEqual(translate(txt), body.decode('utf-8'))
+
+    def test_synthesize(self):
+        """Synthetizes the text into WAV, also the one with empty lines."""
+        for txt in ["Ahoj světe.\n", "a\r\rb"]:
+            status, headers, body = self.handle(get_request('POST', '/synthesize', txt.encode('utf-8')))
+            self.assertEqual(200, status)
+            self.assertEqual('audio/wav', headers['Content-Type'])
+            sample_rate, sound = wavfile.read(io.BytesIO(body))
+            self.assertEqual(SAMPLE_RATE, sample_rate)
+            self.assertGreater(len(sound), 0)
+
+    def test_health_and_metrics(self):
+        """Reports the server state and the synthesis metrics."""
+        self.handle(get_request('POST', '/synthesize', "Ahoj.".encode('utf-8')))
+        status, _, body = self.handle(get_request('GET', '/health'))
+        self.assertEqual(200, status)
+        self.assertTrue(json.loads(body)['synthesis'])
+
+        status, _, body = self.handle(get_request('GET', '/metrics'))
+        self.assertEqual(200, status)
+        self.assertIn('unitselection_sentences_total ', body.decode('utf-8'))
+        status, _, _ = self.handle(get_request('GET', '/metrics'), SynthesisServer())
+        self.assertEqual(404, status)
+
+    def test_errors(self):
+        """Answers the invalid requests by the error statuses."""
+        self.assertEqual(404, self.handle(get_request('POST', '/unknown', b'a'))[0])
+        self.assertEqual(405, self.handle(get_request('GET', '/transcribe'))[0])
+        self.assertEqual(413, self.handle(get_request('POST', '/transcribe', b'a' * (MAX_BODY_SIZE + 1)))[0])
+        self.assertEqual(400, self.handle(get_request('POST', '/transcribe', '\xe1'.encode('latin-1')))[0])
+        self.assertEqual(400, self.handle(b'GARBAGE\r\n\r\n')[0])
+        # The body is shorter than its declared length
+        self.assertEqual(400, self.handle(get_request('POST', '/transcribe', b'abc')[:-1])[0])
+        self.assertEqual(503, self.handle(get_request('POST', '/synthesize', b'a'), SynthesisServer())[0])
+
+    def test_internal_error(self):
+        """Answers the unexpected error of the request by 500."""
+        server = SynthesisServer()
+        server.routes['/transcribe'] = lambda txt: 1 / 0
+        with contextlib.redirect_stderr(io.StringIO()) as stderr:
+            status, _, body = self.handle(get_request('POST', '/transcribe', b'a'), server)
+
+        self.assertEqual(500, status)
+        self.assertEqual(b'Internal server error', body)
+        self.assertIn('ZeroDivisionError', stderr.getvalue())
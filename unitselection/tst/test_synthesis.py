@@ -0,0 +1,209 @@
+"""Synthesis tests"""
+import filecmp
+import io
+import json
+import os
+import tempfile
+import unittest
+from pathlib import Path
+
+from unitselection.fcn.batch import synthetize_lines_parallel, synthetize_speech_parallel
+from unitselection.fcn.concate import *
+from unitselection.fcn.inventory_diphone import inventory_create
+from unitselection.fcn.metrics import STAGES, SynthesisMetrics
+from unitselection.fcn.pipeline import *
+from unitselection.tst.benchmark import run_benchmark
+from unitselection.tst.test_inventory import create_random_corpus
+
+NUMB_OF_LINES = 9
+MAX_LINE_LEN = 20
+
+
+def write_random_transcription(path, seed=0):
+    """Writes the file of random phonetic transcription lines."""
+    rng = np.random.default_rng(seed)
+    with open(path, 'w', encoding='utf-8') as fw:
+        for _ in range(NUMB_OF_LINES):
+            fw.write("|$|" + ''.join(rng.choice(ALPHABET[1:], rng.integers(2, MAX_LINE_LEN))) + "|$|\n")
+
+
+class TestSynthesis(unittest.TestCase):
+    """Tests the synthesis of the transcription files."""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.tmp_dir = tempfile.TemporaryDirectory()
+        cls.hds_dir = Path(cls.tmp_dir.name) / "hds"
+        os.mkdir(cls.hds_dir)
+        create_random_corpus(cls.hds_dir)
+        inventory_create(cls.hds_dir)
+        cls.trans_file = Path(cls.tmp_dir.name) / "trans.txt"
+        write_random_transcription(cls.trans_file)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.tmp_dir.cleanup()
+
+    def assertDirsEqual(self, expected_dir, actual_dir):
+        """Compares the files of two directories."""
+        expected_files = sorted(os.listdir(expected_dir))
+        self.assertEqual(expected_files, sorted(os.listdir(actual_dir)))
+        _, mismatch, errors = filecmp.cmpfiles(expected_dir, actual_dir, expected_files, shallow=False)
+        self.assertEqual([], mismatch + errors)
+
+    def test_parallel_synthesis(self):
+        """Compares the files synthetized by the process pool with the serial synthesis."""
+        with tempfile.TemporaryDirectory() as serial_dir, tempfile.TemporaryDirectory() as parallel_dir:
+            serial_dir = Path(serial_dir)
+            parallel_dir = Path(parallel_dir)
+            synthetize_speech(self.trans_file, self.hds_dir, serial_dir)
+            cache_info = synthetize_speech_parallel(self.trans_file, self.hds_dir, parallel_dir, jobs=2,
+                                                    join_cache_size=1 << 20)
+
+            self.assertEqual(["{0:04d}.wav".format(i + 1) for i in range(NUMB_OF_LINES)],
+                             sorted(os.listdir(serial_dir)))
+            self.assertDirsEqual(serial_dir, parallel_dir)
+            self.assertGreater(cache_info['join_cache']['misses'], 0)
+
+    def test_empty_lines(self):
+        """Checks that the lines without any phonemes are skipped by the synthesis of the lines, as by the synthesis
+        of the text in memory."""
+        inv = load_inventory(self.hds_dir / PREP)
+        phonemes_sim = load_phonemes_sim(self.hds_dir / PREP)
+        txt = "Ahoj světe.\n\nJak se máš?\n"
+        lines = [''] + transcribe_text(txt) + ['|#|']
+        with tempfile.TemporaryDirectory() as serial_dir, tempfile.TemporaryDirectory() as parallel_dir:
+            synthetize_lines(lines, self.hds_dir, Path(serial_dir))
+            synthetize_lines_parallel(lines, self.hds_dir, Path(parallel_dir), jobs=2)
+            self.assertDirsEqual(serial_dir, parallel_dir)
+            sounds = list(synthetize_text(txt, inv, phonemes_sim))
+            self.assertEqual([get_wav_name(i) for i in range(len(sounds))], sorted(os.listdir(serial_dir)))
+            for i, sound in enumerate(sounds):
+                np.testing.assert_array_equal(wavfile.read(Path(serial_dir) / get_wav_name(i))[1], sound)
+
+    def test_streaming(self):
+        """Compares the streamed blocks of the sentences with the whole synthetized sentences, and the units searched
+        with short lag with the whole sentence search."""
+        inv = load_inventory(self.hds_dir / PREP)
+        phonemes_sim = load_phonemes_sim(self.hds_dir / PREP)
+        with open(self.trans_file, 'r', encoding='utf-8') as fr:
+            lines = fr.read().splitlines()
+        for line in lines:
+            sound = synthetize_sentence(line, inv, phonemes_sim)
+            for lag in [None, MAX_LINE_LEN + 1]:
+                np.testing.assert_array_equal(sound, np.concatenate(list(stream_sentence(line, inv, phonemes_sim,
+                                                                                         lag))))
+
+            diphones = to_diphones(clean_line(line))
+            sentence, units, total_loss = get_optimal_units(diphones, inv, phonemes_sim)
+            steps = list(iter_optimal_units(diphones, inv, phonemes_sim, lag=2))
+            self.assertEqual(sentence, [diphone for diphone, _, _ in steps])
+            losses = [loss for _, _, loss in steps]
+            self.assertEqual(sorted(losses), losses)
+            self.assertGreaterEqual(losses[-1], total_loss)
+
+    def test_in_memory(self):
+        """Compares the signals synthetized from the text in memory with the files synthetized from its
+        transcription."""
+        txt = "Ahoj světe.\nJak se máš?\n"
+        inv = load_inventory(self.hds_dir / PREP)
+        phonemes_sim = load_phonemes_sim(self.hds_dir / PREP)
+        with tempfile.TemporaryDirectory() as out_dir:
+            out_dir = Path(out_dir)
+            trans_file = out_dir / "trans.txt"
+            with open(trans_file, 'w', encoding='utf-8') as fw:
+                fw.write(translate(txt))
+            synthetize_speech(trans_file, self.hds_dir, out_dir)
+            sounds = list(synthetize_text(txt, inv, phonemes_sim))
+
+            self.assertEqual(2, len(sounds))
+            for i, sound in enumerate(sounds):
+                _, expected = wavfile.read(out_dir / "{0:04d}.wav".format(i + 1))
+                np.testing.assert_array_equal(expected, sound)
+        np.testing.assert_array_equal(np.concatenate(sounds), np.concatenate(list(stream_text(txt, inv, phonemes_sim,
+                                                                                              None))))
+        sample_rate, sound = wavfile.read(io.BytesIO(synthetize_text_wav(txt, inv, phonemes_sim)))
+        self.assertEqual(SAMPLE_RATE, sample_rate)
+        np.testing.assert_array_equal(np.concatenate(sounds), sound)
+
+        # The text without the trailing newline is transcribed as by ´translate´, without any line appended
+        self.assertEqual(['|$|ahoj|svjete'], transcribe_text("Ahoj světe."))
+        self.assertEqual(1, len(list(synthetize_text("Ahoj světe.", inv, phonemes_sim))))
+
+    def test_benchmark(self):
+        """Runs the benchmark on small synthetic inventory."""
+        result = run_benchmark(2, signal_len=(2 * FADE_LEN, 3 * FADE_LEN), candidates=[1, 2], sentence_lens=[3, 6],
+                               reps=1)
+
+        self.assertEqual(2 * len(ALPHABET) ** 2, result['inventory']['units'])
+        self.assertEqual([(1, 3), (1, 6), (2, 3), (2, 6)],
+                         [(item['candidates'], item['diphones']) for item in result['latencies']])
+        self.assertGreater(result['concat_samples_per_s'], 0)
+        self.assertGreater(result['peak_memory'], 0)
+        json.dumps(result)
+
+    def test_metrics(self):
+        """Records the metrics of the serial and parallel synthesis and compares the files with the synthesis without
+        them."""
+        with tempfile.TemporaryDirectory() as plain_dir, tempfile.TemporaryDirectory() as serial_dir, \
+                tempfile.TemporaryDirectory() as parallel_dir:
+            synthetize_speech(self.trans_file, self.hds_dir, Path(plain_dir))
+            serial_metrics = SynthesisMetrics()
+            synthetize_speech(self.trans_file, self.hds_dir, Path(serial_dir), metrics=serial_metrics)
+            parallel_metrics = SynthesisMetrics()
+            synthetize_speech_parallel(self.trans_file, self.hds_dir, Path(parallel_dir), jobs=2,
+                                       metrics=parallel_metrics)
+            self.assertDirsEqual(plain_dir, serial_dir)
+            self.assertDirsEqual(plain_dir, parallel_dir)
+            sizes = [os.path.getsize(Path(plain_dir) / name) for name in sorted(os.listdir(plain_dir))]
+
+        with open(self.trans_file, 'r', encoding='utf-8') as fr:
+            lines = fr.read().splitlines()
+        for metrics in [serial_metrics, parallel_metrics]:
+            records = [json.loads(line) for line in metrics.to_json_lines().splitlines()]
+            self.assertEqual(lines, [record['line'] for record in records])
+            for record, size in zip(records, sizes):
+                self.assertEqual(len(to_diphones(clean_line(record['line']))),
+                                 record['diphones'] + len(record['dropped']))
+                self.assertEqual(set(STAGES), set(record['stages']))
+                self.assertGreater(record['max_join_matrix'], 0)
+                # The .wav header is not counted
+                self.assertLess(record['audio_bytes'], size)
+            prometheus = metrics.to_prometheus()
+            self.assertIn('unitselection_sentences_total {0}\n'.format(NUMB_OF_LINES), prometheus)
+            self.assertIn('unitselection_audio_bytes_total {0}\n'.format(metrics.audio_bytes), prometheus)
+        self.assertEqual(serial_metrics.candidates, parallel_metrics.candidates)
+        self.assertEqual(serial_metrics.dropped, parallel_metrics.dropped)
+
+    def test_sharded_synthesis(self):
+        """Compares the files synthetized with the sharded inventory under small memory with the synthesis with the
+        whole inventory."""
+        with tempfile.TemporaryDirectory() as plain_dir, tempfile.TemporaryDirectory() as serial_dir, \
+                tempfile.TemporaryDirectory() as parallel_dir:
+            synthetize_speech(self.trans_file, self.hds_dir, Path(plain_dir))
+            cache_infos = synthetize_speech(self.trans_file, self.hds_dir, Path(serial_dir), shard_cache_size=1 << 16)
+            parallel_infos = synthetize_speech_parallel(self.trans_file, self.hds_dir, Path(parallel_dir), jobs=2,
+                                                        shard_cache_size=1 << 16)
+
+            self.assertDirsEqual(plain_dir, serial_dir)
+            self.assertDirsEqual(plain_dir, parallel_dir)
+        self.assertEqual(['inventory'], list(cache_infos))
+        self.assertLessEqual(cache_infos['inventory']['size'], 1 << 16)
+        self.assertGreater(cache_infos['inventory']['evictions'], 0)
+        self.assertEqual(['inventory'], list(parallel_infos))
+        self.assertGreater(parallel_infos['inventory']['misses'], 0)
+
+    def test_sharded_lookups(self):
+        """Checks that the search (also the streamed one) reads each diphone from the sharded inventory only once,
+        even if it does not fit into its cache."""
+        phonemes_sim = load_phonemes_sim(self.hds_dir / PREP)
+        with open(self.trans_file, 'r', encoding='utf-8') as fr:
+            line = fr.readline()
+        diphones = get_existing_seq(to_diphones(clean_line(line)), load_inventory(self.hds_dir / PREP))
+        searches = [lambda inv, cache: get_optimal_signal(diphones, inv, phonemes_sim, cache=cache),
+                    lambda inv, cache: list(stream_sentence(line, inv, phonemes_sim, cache=cache))]
+        for search in searches:
+            inv = load_inventory(self.hds_dir / PREP, shard_cache_size=0)
+            search(inv, create_join_cache(inv))
+            self.assertEqual({'hits': 0, 'misses': len(set(diphones))},
+                             {name: inv.cache_info()[name] for name in ['hits', 'misses']})
@@ -1,17 +1,37 @@
 """Project main script"""
 import argparse
+import json
 import os
 from pathlib import Path
 
-from phonetrans.fcn.processing import transcribe_file
-from unitselection.fcn.concate import synthetize_speech
+from phonetrans.fcn.processing import load_text
+from unitselection.fcn.batch import synthetize_lines_parallel
+from unitselection.fcn.concate import synthetize_lines
 from unitselection.fcn.constants import *
-from unitselection.fcn.inventory_diphone import inventory_create
+from unitselection.fcn.inventory_diphone import inventory_prepare
+from unitselection.fcn.metrics import METRICS_FORMATS, SynthesisMetrics
+from unitselection.fcn.pipeline import transcribe_text
+from unitselection.fcn.viterbi import BEAM, TOP_K, beam_arg, top_k_arg
 
 parser = argparse.ArgumentParser()
 parser.add_argument('input', metavar='INPUT', type=str, help='Input file with written czech text')
 parser.add_argument('hds_data_dir', metavar='HDS_DATA_DIR', type=str, help='HDS data directory')
 parser.add_argument('output_dir', metavar='OUTPUT_DIR', type=str, help='Directory for output .wav files')
+parser.add_argument('--top-k', type=top_k_arg, default=TOP_K, help='Number of the candidates searched for each diphone')
+parser.add_argument('--beam', type=beam_arg, default=BEAM, help='Beam of the accumulated loss of the searched units')
+parser.add_argument('--join-cache-size', metavar='BYTES', type=int,
+                    help='Cache the concatenation losses of the diphone pairs up to the given memory and print its '
+                         'statistics')
+parser.add_argument('--shard-cache-size', metavar='BYTES', type=int,
+                    help='Load the diphones of the inventory on the first use, keep them up to the given memory and print '
+                         'the statistics')
+parser.add_argument('--jobs', type=int, help='Synthetize the lines by the given number of worker processes')
+parser.add_argument('--trans-file', metavar='PATH', type=str,
+                    help='Also save the phonetic transcription, it is kept in memory only otherwise')
+parser.add_argument('--metrics', metavar='PATH', type=str,
+                    help='Save the metrics of the synthesis (stage times, candidates, missing diphones) of each line')
+parser.add_argument('--metrics-format', choices=METRICS_FORMATS, default=METRICS_FORMATS[0],
+                    help='Format of the metrics: JSON line of each line, or Prometheus text with the totals')
 
 if __name__ == '__main__':
     # Load params
@@ -21,16 +41,27 @@ if __name__ == '__main__':
     if not os.path.exists(out_dir):
         os.mkdir(out_dir)
 
-    # Prepare inventory
+    # Prepare inventory (only the changed sentences are processed if it was built before)
     hds_dir = Path(args.hds_data_dir)
-    if not os.path.exists(hds_dir / PREP / INV) or not os.path.exists(hds_dir / PREP / PHON_SIM):
-        inventory_create(hds_dir)
+    inventory_prepare(hds_dir)
 
-    # Transcribe input text
-    input_file = Path(args.input)
-    trans_file = input_file.parent / "trans.txt"
-    transcribe_file(input_file, trans_file)
+    # Transcribe input text in memory
+    lines = transcribe_text(load_text(Path(args.input)))
+    if args.trans_file is not None:
+        with open(args.trans_file, 'w', encoding='utf-8') as fw:
+            fw.write('\n'.join(lines) + '\n')
 
     # Synthesize voice signal and save to out directory
     hds_dir = Path(args.hds_data_dir)
-    synthetize_speech(trans_file, hds_dir, out_dir)
+    metrics = None if args.metrics is None else SynthesisMetrics()
+    if args.jobs is None:
+        cache_infos = synthetize_lines(lines, hds_dir, out_dir, args.top_k, args.beam, args.join_cache_size, metrics,
+                                       args.shard_cache_size)
+    else:
+        cache_infos = synthetize_lines_parallel(lines, hds_dir, out_dir, args.jobs, args.top_k, args.beam,
+                                                args.join_cache_size, metrics, args.shard_cache_size)
+    if cache_infos is not None:
+        print(json.dumps(cache_infos))
+    if metrics is not None:
+        with open(args.metrics, 'w', encoding='utf-8') as fw:
+            fw.write(metrics.dump(args.metrics_format))